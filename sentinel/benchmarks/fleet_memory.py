@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+节点数据模型内存 / 扫描开销对比
+
+按给定规模生成合成 fleet，对比两种表示：
+- dict：get_nodes_grouped_by_project() 的逐节点 dict + 每节点一份 get_node_status() 结果
+- columnar：FleetSnapshot（intern 字符串 + array 列 + 项目行区间）
+
+输出每节点内存占用（tracemalloc）、构建耗时，以及异常过滤 / Top-N 的扫描耗时。
+
+用法：
+    python benchmarks/fleet_memory.py --nodes 5000 --projects 40
+    python benchmarks/fleet_memory.py --nodes 20000
+"""
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sentinel  # noqa: E402
+
+ROLES = ("web", "api", "worker", "db", "cache", "gateway")
+REGIONS = ("ap-east-1", "ap-southeast-1", "us-west-2")
+
+
+def synthetic_vector(n_nodes: int, n_projects: int, seed: int) -> Tuple[List[Dict[str, Any]], Dict[str, Dict[str, float]]]:
+    """模拟 Prometheus 返回：up{job="nodes"} 的 label 集合 + 各指标按 instance 的取值"""
+    rnd = random.Random(seed)
+    up, metrics = [], {col: {} for col in sentinel.FleetSnapshot.METRICS}
+    for i in range(n_nodes):
+        instance = "10.%d.%d.%d:9100" % (i // 65536, (i // 256) % 256, i % 256)
+        up.append({
+            "project": "project-%02d" % (i % n_projects),
+            "instance": instance,
+            "alias": "node-%05d" % i,
+            "role": ROLES[i % len(ROLES)],
+            "region": REGIONS[i % len(REGIONS)],
+        })
+        metrics["cpu"][instance] = rnd.uniform(1, 99)
+        metrics["mem"][instance] = rnd.uniform(10, 95)
+        metrics["disk"][instance] = rnd.uniform(5, 92)
+        metrics["load1"][instance] = rnd.uniform(0, 16)
+        metrics["cpu_5m"][instance] = rnd.uniform(1, 99)
+    return up, metrics
+
+
+def build_dicts(up: List[Dict[str, Any]], metrics: Dict[str, Dict[str, float]]):
+    """与改造前一致：分组后的节点 dict + 每节点一份状态 dict"""
+    projects: Dict[str, List[Dict[str, str]]] = {}
+    statuses: Dict[str, Dict[str, Any]] = {}
+    for metric in up:
+        project = metric["project"]
+        instance = metric["instance"]
+        projects.setdefault(project, []).append({
+            "instance": instance,
+            "alias": metric["alias"],
+            "role": metric["role"],
+            "region": metric["region"],
+        })
+        statuses[instance] = {
+            "cpu_percent": metrics["cpu"][instance],
+            "load1": metrics["load1"][instance],
+            "mem_percent": metrics["mem"][instance],
+            "mem_used_gib": None,
+            "mem_total_gib": None,
+            "disk_percent": metrics["disk"][instance],
+            "disk_root_percent": None,
+            "disk_root_used_gib": None,
+            "disk_root_total_gib": None,
+        }
+    for nodes in projects.values():
+        nodes.sort(key=lambda x: x["alias"])
+    return projects, statuses
+
+
+def build_columnar(up: List[Dict[str, Any]], metrics: Dict[str, Dict[str, float]]):
+    projects: Dict[str, List[Dict[str, str]]] = {}
+    for metric in up:
+        projects.setdefault(metric["project"], []).append({
+            "instance": metric["instance"],
+            "alias": metric["alias"],
+            "role": metric["role"],
+            "region": metric["region"],
+        })
+    for nodes in projects.values():
+        nodes.sort(key=lambda x: x["alias"])
+    return sentinel.FleetSnapshot.build(projects, metrics)
+
+
+def measure(build: Callable[[], Any]) -> Tuple[Any, int]:
+    """
+    返回 (结果, 构建后仍保留的字节数)
+    标签字符串在测量前已分配、两种表示共享，只比较数据结构本身的开销。
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, retained
+
+
+def timed(fn: Callable[[], Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=5000, help="节点数")
+    parser.add_argument("--projects", type=int, default=40, help="项目数")
+    parser.add_argument("--top", type=int, default=sentinel.HOTSPOT_TOP_N, help="Top-N 的 N")
+    parser.add_argument("--repeat", type=int, default=20, help="扫描耗时取最优的重复次数")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    up, metrics = synthetic_vector(args.nodes, args.projects, args.seed)
+
+    (projects, statuses), dict_bytes = measure(lambda: build_dicts(up, metrics))
+    fleet, col_bytes = measure(lambda: build_columnar(up, metrics))
+    dict_build = timed(lambda: build_dicts(up, metrics), 3)
+    col_build = timed(lambda: build_columnar(up, metrics), 3)
+
+    def dict_abnormal():
+        return [n for nodes in projects.values() for n in nodes if sentinel.is_node_abnormal(statuses[n["instance"]])]
+
+    def dict_top():
+        rows = [(statuses[n["instance"]]["cpu_percent"], n) for nodes in projects.values() for n in nodes]
+        rows.sort(key=lambda x: x[0], reverse=True)
+        return rows[:args.top]
+
+    def dict_project():
+        nodes = projects["project-00"]
+        return [n for n in nodes if sentinel.is_node_abnormal(statuses[n["instance"]])]
+
+    assert len(dict_abnormal()) == len(fleet.abnormal())
+    assert [r[1]["instance"] for r in dict_top()] == [fleet.instances[i] for i in fleet.top_n("cpu", args.top)]
+
+    n = args.nodes
+    print(f"nodes / projects  : {n} / {args.projects}")
+    print(f"{'':18}{'dict':>14}{'columnar':>14}")
+    print(f"{'retained memory':18}{dict_bytes / 1024:>11.0f}KiB{col_bytes / 1024:>11.0f}KiB")
+    print(f"{'per node':18}{dict_bytes / n:>12.0f} B{col_bytes / n:>12.0f} B")
+    print(f"{'build':18}{dict_build * 1e3:>12.2f}ms{col_build * 1e3:>12.2f}ms")
+    print(f"{'abnormal (fleet)':18}{timed(dict_abnormal, args.repeat) * 1e3:>12.2f}ms"
+          f"{timed(fleet.abnormal, args.repeat) * 1e3:>12.2f}ms")
+    print(f"{'abnormal (project)':18}{timed(dict_project, args.repeat) * 1e3:>12.3f}ms"
+          f"{timed(lambda: fleet.abnormal(fleet.rows('project-00')), args.repeat) * 1e3:>12.3f}ms")
+    print(f"{'top-' + str(args.top) + ' cpu':18}{timed(dict_top, args.repeat) * 1e3:>12.2f}ms"
+          f"{timed(lambda: fleet.top_n('cpu', args.top), args.repeat) * 1e3:>12.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Webhook 接入路径回放压测
+
+把录制的 Alertmanager 负载（.json 单个负载 / .jsonl 每行一个负载）按指定速率
+推给 /webhook，统计接入延迟与端到端处理吞吐。未提供录制文件时生成合成负载。
+
+用法：
+    python benchmarks/replay_webhook.py recorded/*.json --rate 500 --count 5000
+    python benchmarks/replay_webhook.py --synthetic 200 --rate 0 --count 2000
+    python benchmarks/replay_webhook.py recorded.jsonl --url http://sentinel-bot:5000/webhook
+
+默认在进程内通过 Flask test client 压测，Telegram 发送被替换为计数桩；
+指定 --url 时改为向运行中的 Bot 发 HTTP 请求（仅统计接入延迟）。
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List
+
+# 压测只关注接入路径：放开投递通道的限速与队列
+os.environ.setdefault("ALERT_LANE_RATE_PER_MIN", "1000000")
+os.environ.setdefault("ALERT_LANE_BURST", "1000000")
+os.environ.setdefault("ALERT_LANE_QUEUE_SIZE", "1000000")
+os.environ.setdefault("WEBHOOK_QUEUE_SIZE", "10000")
+os.environ.setdefault("TELEGRAM_CHAT_ID", "-1000000000000")
+# 告警历史写到临时目录，避免污染正式数据
+os.environ.setdefault("HISTORY_DIR", tempfile.mkdtemp(prefix="sentinel-history-"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sentinel  # noqa: E402
+
+
+class CountingBot:
+    """替代 Telegram Bot：只计数，不发网络请求"""
+
+    def __init__(self):
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def send_message(self, **kwargs):
+        with self._lock:
+            self.sent += 1
+
+
+def load_payloads(paths: List[str]) -> List[bytes]:
+    payloads = []
+    for path in paths:
+        with open(path, "rb") as f:
+            if path.endswith(".jsonl"):
+                payloads.extend(line.strip() for line in f if line.strip())
+            else:
+                payloads.append(f.read().strip())
+    return payloads
+
+
+def synthetic_payload(n_alerts: int, seq: int) -> bytes:
+    alerts: List[Dict[str, Any]] = []
+    for i in range(n_alerts):
+        alerts.append({
+            "status": "firing" if (i + seq) % 4 else "resolved",
+            "labels": {
+                "alertname": ("InstanceDown", "HighCPUUsage", "DiskSpaceLow")[i % 3],
+                "project": f"Project{chr(65 + i % 4)}",
+                "severity": "critical" if i % 3 == 0 else "warning",
+                "instance": f"10.0.{i % 250}.{seq % 250}:9100",
+                "alias": f"node-{i}",
+                "role": "web",
+            },
+            "annotations": {"description": f"synthetic alert {seq}/{i}"},
+            "startsAt": f"2026-01-08T0{i % 10}:{seq % 60:02d}:52.{i:09d}Z",
+            "fingerprint": f"{seq:08x}{i:08x}",
+        })
+    return json.dumps({"status": "firing", "alerts": alerts}).encode()
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("payloads", nargs="*", help="录制的 Alertmanager 负载（.json / .jsonl）")
+    parser.add_argument("--synthetic", type=int, default=50, help="无录制文件时每个合成负载的告警数")
+    parser.add_argument("--count", type=int, default=2000, help="发送的请求总数")
+    parser.add_argument("--rate", type=float, default=500, help="目标请求速率（次/秒），0 表示不限速")
+    parser.add_argument("--url", help="向运行中的 Bot 发送，而不是进程内压测")
+    args = parser.parse_args()
+
+    payloads = load_payloads(args.payloads) or [synthetic_payload(args.synthetic, i) for i in range(64)]
+
+    if args.url:
+        import requests
+        session = requests.Session()
+
+        def post(body: bytes) -> int:
+            return session.post(args.url, data=body, headers={"Content-Type": "application/json"}).status_code
+        bot = None
+    else:
+        bot = CountingBot()
+        sentinel.bot_instance = bot
+        sentinel.start_ingest_workers()
+        client = sentinel.create_app().test_client()
+
+        def post(body: bytes) -> int:
+            return client.post("/webhook", data=body, content_type="application/json").status_code
+
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    interval = 1.0 / args.rate if args.rate > 0 else 0.0
+    started = time.perf_counter()
+    for i in range(args.count):
+        if interval:
+            delay = started + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        t0 = time.perf_counter()
+        code = post(payloads[i % len(payloads)])
+        latencies.append(time.perf_counter() - t0)
+        statuses[code] = statuses.get(code, 0) + 1
+    accepted = time.perf_counter() - started
+
+    if bot is not None:
+        # 等接入队列与所有投递通道都处理完，"messages sent" 才是最终结果
+        if not sentinel.drain_delivery(timeout=600):
+            print("warning: delivery lanes not idle after 600s, counts below are partial")
+    drained = time.perf_counter() - started
+
+    n_alerts = sum(len(json.loads(p).get("alerts", [])) for p in payloads)
+    avg_alerts = n_alerts / len(payloads)
+    print(f"json decoder    : {'orjson' if sentinel.orjson else 'json'}")
+    print(f"requests        : {args.count} ({avg_alerts:.0f} alerts/payload avg)")
+    print(f"status codes    : {statuses}")
+    print(f"accept time     : {accepted:.2f}s ({args.count / accepted:.0f} req/s)")
+    print(f"webhook latency : p50 {percentile(latencies, 50) * 1e3:.2f}ms  "
+          f"p99 {percentile(latencies, 99) * 1e3:.2f}ms  max {max(latencies) * 1e3:.2f}ms")
+    if bot is not None:
+        print(f"drain time      : {drained:.2f}s ({args.count * avg_alerts / drained:.0f} alerts/s processed)")
+        print(f"messages sent   : {bot.sent} (delivery lanes, stub bot)")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,14 +7,43 @@ import threading
 import json
 import re
 import datetime
-from typing import Dict, List, Any, Optional
+import gzip
+import math
+import bisect
+import hashlib
+import socket
+import sqlite3
+import struct
+import zlib
+import sys
+import io
+import contextlib
+import collections
+import queue
+import functools
+import abc
+import heapq
+import itertools
+import operator
+from array import array
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List, Any, Optional, Set, Tuple
 
-import pyotp
 import requests
-from flask import Flask, request
-from werkzeug.serving import make_server
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ParseMode, Update
-from telegram.ext import Updater, CommandHandler, CallbackQueryHandler, CallbackContext
+from telegram import (
+    InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle,
+    InputTextMessageContent, ParseMode, Update,
+)
+from telegram.error import RetryAfter
+from telegram.ext import Updater, CommandHandler, CallbackQueryHandler, CallbackContext, InlineQueryHandler
+
+# 可选依赖：安装了 orjson 时用它解析 webhook 负载
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    orjson = None
+    json_loads = json.loads
 
 # ==========================================
 # 🔧 配置区域
@@ -33,8 +62,92 @@ ADMIN_ID = os.getenv("TELEGRAM_ADMIN_ID")
 CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 
 PROMETHEUS_URL = os.getenv("PROMETHEUS_URL", "http://prometheus:9090")
+
+# 多 Prometheus 后端，格式：region=url,region=url（未配置时只使用 PROMETHEUS_URL）
+PROMETHEUS_BACKENDS_RAW = os.getenv("PROMETHEUS_BACKENDS", "")
+# 合并结果时写入样本的来源标签名
+PROMETHEUS_BACKEND_LABEL = os.getenv("PROMETHEUS_BACKEND_LABEL", "region")
+# 单个后端的查询超时（秒）
+PROMETHEUS_TIMEOUT = float(os.getenv("PROMETHEUS_TIMEOUT", "5"))
+# 后端超时/失败后暂时跳过的时长（秒），仅多后端模式生效
+PROMETHEUS_BACKOFF_SECONDS = float(os.getenv("PROMETHEUS_BACKOFF_SECONDS", "30"))
 CLOUDWATCH_EXPORTER_URL = os.getenv("CLOUDWATCH_EXPORTER_URL", "http://cloudwatch-exporter:9106/metrics")
 
+# 同一消息上重复点击的去抖窗口（秒）
+CALLBACK_DEBOUNCE_SECONDS = float(os.getenv("CALLBACK_DEBOUNCE_SECONDS", "2"))
+
+# 热点视图每项指标展示的实例数
+HOTSPOT_TOP_N = int(os.getenv("HOTSPOT_TOP_N", "5"))
+
+# 列式节点快照的复用时间（秒）：同一时间窗内的列表页 / 热点 / 报表采样共享一次全局查询
+FLEET_CACHE_SECONDS = float(os.getenv("FLEET_CACHE_SECONDS", "10"))
+
+# 磁盘容量预测：拟合窗口与预警范围（天）
+FORECAST_WINDOW = os.getenv("FORECAST_WINDOW", "6h")
+FORECAST_HORIZON_DAYS = float(os.getenv("FORECAST_HORIZON_DAYS", "7"))
+# 预测视图最多展示的条目数（最先写满的优先），其余只显示数量，避免超出 Telegram 消息长度 / 按钮数限制
+FORECAST_TOP_N = int(os.getenv("FORECAST_TOP_N", "15"))
+
+# 启动快照：路径、落盘间隔（秒）、可用于冷启动展示的最大快照年龄（秒）
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "/app/data/snapshot.json.gz")
+SNAPSHOT_INTERVAL_SECONDS = int(os.getenv("SNAPSHOT_INTERVAL_SECONDS", "60"))
+SNAPSHOT_MAX_AGE_SECONDS = int(os.getenv("SNAPSHOT_MAX_AGE_SECONDS", "86400"))
+
+# 指标汇总（报表用）：采集间隔（秒）、存储路径、保留天数
+ROLLUP_COLLECT_SECONDS = int(os.getenv("ROLLUP_COLLECT_SECONDS", "300"))
+ROLLUP_PATH = os.getenv("ROLLUP_PATH", "/app/data/rollups.json.gz")
+ROLLUP_RETENTION_DAYS = int(os.getenv("ROLLUP_RETENTION_DAYS", "35"))
+# 定时报表：是否开启与发送时间（ALERT_DISPLAY_TZ 时区，HH:MM）
+DAILY_REPORT_ENABLED = os.getenv("DAILY_REPORT_ENABLED", "false").lower() == "true"
+WEEKLY_REPORT_ENABLED = os.getenv("WEEKLY_REPORT_ENABLED", "false").lower() == "true"
+REPORT_TIME = os.getenv("REPORT_TIME", "09:00")
+
+# 多副本模式：共享状态后端（sqlite:////app/data/shared.db 或 redis://host:6379/0），为空时单进程运行
+SHARED_STATE_URL = os.getenv("SHARED_STATE_URL", "")
+REPLICA_ID = os.getenv("REPLICA_ID") or f"{socket.gethostname()}-{os.getpid()}"
+# 选主租约时长（秒）；Webhook 告警按 fingerprint 去重的窗口（秒）
+LEADER_LEASE_SECONDS = float(os.getenv("LEADER_LEASE_SECONDS", "15"))
+ALERT_DEDUPE_SECONDS = int(os.getenv("ALERT_DEDUPE_SECONDS", "120"))
+# 退出（含 leader 丢失租约）前等待 webhook 队列与投递通道清空的最长时间（秒）
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "30"))
+
+# 即时查询结果按规范化表达式缓存的时间（秒），0 表示只在单次渲染内去重
+PROMQL_CACHE_SECONDS = float(os.getenv("PROMQL_CACHE_SECONDS", "5"))
+
+# 诊断：保留最近多少次回调的调用追踪；采样分析器的采样间隔（秒）
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+
+# 后台刷新 inventory（搜索索引）的间隔（秒）
+INVENTORY_REFRESH_SECONDS = int(os.getenv("INVENTORY_REFRESH_SECONDS", "300"))
+
+# 告警路由（JSON 列表，按顺序匹配）：
+#   [{"match": {"alertname": "InstanceDown"}, "chat_id": "-100...", "continue": true},
+#    {"match": {"project": "ProjectA", "severity": "critical"}, "chat_id": "-100..."}]
+# match 的值为正则（整串匹配）；continue 为 true 时继续匹配后续规则；
+# 没有规则命中的告警发往 TELEGRAM_CHAT_ID
+ALERT_ROUTES: List[Dict[str, Any]] = json.loads(os.getenv("ALERT_ROUTES", "[]") or "[]")
+
+# 每个目的地独立投递通道的限速（条/分钟）与突发容量
+ALERT_LANE_RATE_PER_MIN = float(os.getenv("ALERT_LANE_RATE_PER_MIN", "20"))
+ALERT_LANE_BURST = int(os.getenv("ALERT_LANE_BURST", "5"))
+ALERT_LANE_QUEUE_SIZE = int(os.getenv("ALERT_LANE_QUEUE_SIZE", "500"))
+
+# Webhook 接入：负载大小上限（字节）、单批告警上限、待处理队列长度与处理线程数
+WEBHOOK_MAX_BYTES = int(os.getenv("WEBHOOK_MAX_BYTES", str(2 * 1024 * 1024)))
+WEBHOOK_MAX_ALERTS = int(os.getenv("WEBHOOK_MAX_ALERTS", "1000"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "256"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "2"))
+
+# 告警历史：段文件目录、单段大小上限（字节）、保留天数、每页条数
+HISTORY_DIR = os.getenv("HISTORY_DIR", "/app/data/history")
+HISTORY_SEGMENT_BYTES = int(os.getenv("HISTORY_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "365"))
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "10"))
+
+# 告警时间的显示时区（IANA 名称，或 UTC+8 / +08:00 这样的固定偏移）
+ALERT_DISPLAY_TZ = os.getenv("ALERT_DISPLAY_TZ", "Asia/Shanghai")
+
 RDS_INSTANCES: List[Dict[str, str]] = [
       {"id": "project-a-db", "project": "ProjectA", "alias": "ProjectA 主库"},
       {"id": "project-b-db",  "project": "ProjectB", "alias": "ProjectB 主库"},
@@ -47,6 +160,7 @@ RDS_INSTANCES: List[Dict[str, str]] = [
 def get_totp_info():
     if not MFA_SECRET:
         return "❌ No Secret", 0
+    import pyotp  # 延迟导入，缩短冷启动时间
     totp = pyotp.TOTP(MFA_SECRET)
     code = totp.now()
     remaining_seconds = totp.interval - (time.time() % totp.interval)
@@ -78,22 +192,380 @@ def send_mfa_message(send_func):
     ]
     send_func(message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN)
 
+# ==========================================
+# 🧱 PromQL 构造
+# ==========================================
+
+# 模板中的 selector 写作 metric{...}，花括号内可以是：
+#   @片段名             引用 PROMQL_FRAGMENTS 中的公共过滤条件
+#   label op "value"    模板自带的固定 matcher（值按 PromQL 字面量书写）
+# 调用时传入的标签（instance / mountpoint / project ...）会转义后追加到模板里的每个 selector，
+# matcher 排序去重后输出，同一语义的查询总是得到同一字符串，便于结果缓存与单次渲染内去重。
+# 标签值为列表时生成 label=~"a|b"（每个值按正则字面量转义），用于限定一组实例。
+# $name 为非标签参数（时间窗口、阈值、topk 数量等），通过 params 传入，只允许数字 / 时长这类简单值。
+
+PROMQL_FRAGMENTS: Dict[str, Tuple[Tuple[str, str, str], ...]] = {
+    "nodes": (("job", "=", "nodes"),),
+    "fstype": (("fstype", "!~", "tmpfs|overlay|squashfs"),),
+    "fs": (
+        ("fstype", "!~", "tmpfs|overlay|squashfs"),
+        ("mountpoint", "!~", "^/(proc|sys|run)($|/)"),
+    ),
+}
+
+PROMQL_TEMPLATES: Dict[str, str] = {
+    # inventory（带 instance 时为单个节点的标签）
+    "node_up": 'up{@nodes}',
+    # 单节点（按 instance）
+    "node_cpu_percent": 'avg(1 - rate(node_cpu_seconds_total{mode="idle"}[5m])) * 100',
+    "node_load1": 'node_load1{}',
+    "node_mem_total": 'node_memory_MemTotal_bytes{}',
+    "node_mem_avail": 'node_memory_MemAvailable_bytes{}',
+    "node_mem_percent": (
+        '(node_memory_MemTotal_bytes{} - node_memory_MemAvailable_bytes{}) '
+        '/ node_memory_MemTotal_bytes{} * 100'
+    ),
+    "node_disk_worst_percent": (
+        'max(((node_filesystem_size_bytes{@fs} - node_filesystem_avail_bytes{@fs}) '
+        '/ node_filesystem_size_bytes{@fs}) * 100)'
+    ),
+    "node_root_size": 'node_filesystem_size_bytes{@fstype,mountpoint="/"}',
+    "node_root_avail": 'node_filesystem_avail_bytes{@fstype,mountpoint="/"}',
+    "node_root_percent": (
+        '(node_filesystem_size_bytes{@fstype,mountpoint="/"} - node_filesystem_avail_bytes{@fstype,mountpoint="/"}) '
+        '/ node_filesystem_size_bytes{@fstype,mountpoint="/"} * 100'
+    ),
+    "node_fs_size": 'node_filesystem_size_bytes{@fs}',
+    "node_fs_avail": 'node_filesystem_avail_bytes{@fs}',
+    "node_fs_readonly": 'node_filesystem_readonly{@fs}',
+    # 全局（按 instance 聚合）
+    "fleet_cpu": 'avg by (instance, project, alias) (1 - rate(node_cpu_seconds_total{@nodes,mode="idle"}[5m])) * 100',
+    "fleet_mem": '(1 - node_memory_MemAvailable_bytes{@nodes} / node_memory_MemTotal_bytes{@nodes}) * 100',
+    "fleet_disk": (
+        'max by (instance, project, alias) (((node_filesystem_size_bytes{@nodes,@fs} - node_filesystem_avail_bytes{@nodes,@fs}) '
+        '/ node_filesystem_size_bytes{@nodes,@fs}) * 100)'
+    ),
+    "fleet_load1": 'node_load1{@nodes}',
+    # 容量预测：avail / -斜率 = 剩余秒数；只保留斜率为负（在变满）且可写的分区
+    "disk_ttf": (
+        '(node_filesystem_avail_bytes{@nodes,@fs} / -(deriv(node_filesystem_avail_bytes{@nodes,@fs}[$window]) < 0)) '
+        '< $horizon unless on(instance, mountpoint) node_filesystem_readonly{@nodes,@fs} == 1'
+    ),
+    "disk_used_percent": (
+        '(node_filesystem_size_bytes{@nodes,@fs} - node_filesystem_avail_bytes{@nodes,@fs}) '
+        '/ node_filesystem_size_bytes{@nodes,@fs} * 100'
+    ),
+    "rds_storage_ttf": (
+        '(aws_rds_free_storage_space_average{} / -(deriv(aws_rds_free_storage_space_average{}[$window]) < 0)) '
+        '< $horizon'
+    ),
+}
+
+# 报表补齐：节点指标 x 统计量的 *_over_time 子查询，用 label_replace 标上 rollup_metric / rollup_stat 后 or 成一条查询
+ROLLUP_GAP_STATS = (
+    ("min", "min_over_time", ""), ("avg", "avg_over_time", ""),
+    ("max", "max_over_time", ""), ("p95", "quantile_over_time", "0.95, "),
+)
+PROMQL_TEMPLATES["rollup_gap_fill"] = " or ".join(
+    f'label_replace(label_replace({fn}({arg}({PROMQL_TEMPLATES[f"fleet_{metric}"]})[$window:$step]), '
+    f'"rollup_metric", "{metric}", "", ""), "rollup_stat", "{stat}", "", "")'
+    for metric in ("cpu", "mem", "disk") for stat, fn, arg in ROLLUP_GAP_STATS
+)
+
+# 全局 Top-N：每项指标一次服务端 topk
+for _metric in ("cpu", "mem", "disk", "load1"):
+    PROMQL_TEMPLATES[f"fleet_top_{_metric}"] = f"topk($n, {PROMQL_TEMPLATES[f'fleet_{_metric}']})"
+
+_LABEL_NAME_RE = re.compile(r"^[a-zA-Z_][a-zA-Z0-9_]*$")
+_PARAM_VALUE_RE = re.compile(r"^[0-9a-zA-Z_.:]+$")
+_SELECTOR_RE = re.compile(r"([a-zA-Z_:][a-zA-Z0-9_:]*)\{([^}]*)\}(\[[^\]]+\])?")
+_MATCHER_RE = re.compile(r'\s*(?:@(\w+)|([a-zA-Z_][a-zA-Z0-9_]*)\s*(=~|!~|!=|=)\s*"((?:[^"\\]|\\.)*)")\s*(?:,|$)')
+_PARAM_RE = re.compile(r"\$(\w+)")
+
+def escape_label_value(value: Any) -> str:
+    """PromQL 双引号字符串转义"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+_REGEX_META_RE = re.compile(r"([\\.+*?()|\[\]{}^$])")
+
+def escape_regex_value(value: Any) -> str:
+    """把值转成只匹配其本身的 RE2 正则（Prometheus 的 =~ 为全匹配）"""
+    return _REGEX_META_RE.sub(r"\\\1", str(value))
+
+def _parse_matchers(body: str) -> List[Tuple[str, str, str]]:
+    matchers: List[Tuple[str, str, str]] = []
+    pos = 0
+    while pos < len(body):
+        m = _MATCHER_RE.match(body, pos)
+        if not m or m.end() == pos:
+            raise ValueError(f"Bad PromQL template matchers: {body!r}")
+        if m.group(1):
+            matchers.extend(
+                (label, op, escape_label_value(value)) for label, op, value in PROMQL_FRAGMENTS[m.group(1)]
+            )
+        else:
+            matchers.append((m.group(2), m.group(3), m.group(4)))
+        pos = m.end()
+    return matchers
+
+@functools.lru_cache(maxsize=4096)
+def _compile_promql(name: str, labels: Tuple[Tuple[str, str], ...], offset: Optional[str],
+                    params: Tuple[Tuple[str, str], ...]) -> str:
+    template = PROMQL_TEMPLATES.get(name)
+    if template is None:
+        raise ValueError(f"Unknown PromQL template: {name!r}")
+    values = dict(params)
+    for key, value in values.items():
+        if not _PARAM_VALUE_RE.match(value):
+            raise ValueError(f"Invalid PromQL param {key}={value!r}")
+    missing = set(_PARAM_RE.findall(template)) - set(values)
+    unknown = set(values) - set(_PARAM_RE.findall(template))
+    if missing or unknown:
+        raise ValueError(f"PromQL template {name!r}: missing params {sorted(missing)}, unknown params {sorted(unknown)}")
+    # 参数先于标签代入：标签值中的 $ 不会被当作参数
+    template = _PARAM_RE.sub(lambda m: values[m.group(1)], template)
+
+    extra = [
+        (label, "=~", escape_label_value("|".join(escape_regex_value(v) for v in value)))
+        if isinstance(value, tuple) else (label, "=", escape_label_value(value))
+        for label, value in labels
+    ]
+
+    def selector(m: "re.Match") -> str:
+        matchers = sorted(set(_parse_matchers(m.group(2)) + extra))
+        body = ",".join(f'{label}{op}"{value}"' for label, op, value in matchers)
+        out = f"{m.group(1)}{{{body}}}{m.group(3) or ''}"
+        return f"{out} offset {offset}" if offset else out
+
+    return _SELECTOR_RE.sub(selector, template)
+
+def promql(name: str, offset: Optional[str] = None, params: Optional[Dict[str, Any]] = None, **labels: Any) -> str:
+    """
+    由模板生成规范化的 PromQL
+    :param name: PROMQL_TEMPLATES 中的模板名
+    :param offset: 给每个 selector 加上 offset（如 "5m"），用于和历史值比较
+    :param params: $name 参数，必须与模板中的参数一一对应
+    :param labels: 追加到每个 selector 的等值标签，值会被转义；值为列表 / 集合时匹配其中任意一个
+    """
+    normalized = []
+    for label, value in labels.items():
+        if not _LABEL_NAME_RE.match(label):
+            raise ValueError(f"Invalid label name: {label!r}")
+        if isinstance(value, (list, tuple, set, frozenset)):
+            if not value:
+                raise ValueError(f"Empty value list for label {label!r}")
+            value = tuple(sorted({str(v) for v in value}))
+        else:
+            value = str(value)
+        normalized.append((label, value))
+    return _compile_promql(
+        name,
+        tuple(sorted(normalized)),
+        offset,
+        tuple(sorted((k, str(v)) for k, v in (params or {}).items())),
+    )
+
+class QueryResultCache:
+    """按规范化表达式缓存即时查询结果（短 TTL），让相邻渲染 / 多个用户共享同一次查询"""
+
+    def __init__(self, ttl: float, max_entries: int = 2048):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "collections.OrderedDict[Tuple[str, str], Tuple[float, Dict[str, Any]]]" = collections.OrderedDict()
+
+    def get(self, key: Tuple[str, str]) -> Optional[Dict[str, Any]]:
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Tuple[str, str], value: Dict[str, Any]):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+query_cache = QueryResultCache(PROMQL_CACHE_SECONDS)
+
 # ==========================================
 # 📊 监控核心逻辑 (100% 还原旧版)
 # ==========================================
 
-def prom_query(expr: str) -> Dict[str, Any]:
-    url = PROMETHEUS_URL.rstrip("/") + "/api/v1/query"
-    try:
-        resp = requests.get(url, params={"query": expr}, timeout=5)
-        resp.raise_for_status()
-        return resp.json()
-    except Exception as e:
-        logger.error(f"Prometheus Query Failed: {e}")
-        return {}
+def parse_prometheus_backends(raw: str) -> List[Dict[str, str]]:
+    """解析 PROMETHEUS_BACKENDS；为空时退化为单一 PROMETHEUS_URL"""
+    backends = []
+    for part in raw.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, sep, url = part.partition("=")
+        if not sep:
+            name, url = "", name
+        backends.append({"name": name.strip(), "url": url.strip()})
+    if not backends:
+        backends.append({"name": "", "url": PROMETHEUS_URL})
+    return backends
+
+PROMETHEUS_BACKENDS = parse_prometheus_backends(PROMETHEUS_BACKENDS_RAW)
+MULTI_BACKEND = len(PROMETHEUS_BACKENDS) > 1
+
+_prom_pool = ThreadPoolExecutor(max_workers=max(4, 2 * len(PROMETHEUS_BACKENDS)), thread_name_prefix="prom")
+_backend_lock = threading.Lock()
+_backend_down_until: Dict[str, float] = {}
+_backend_names = {b["name"] for b in PROMETHEUS_BACKENDS if b["name"]}
+
+def node_ref(instance: str, region: str = "") -> str:
+    """
+    节点在 bot 内的唯一键（快照行、搜索索引、报表、node: 回调）
+    多后端时不同区域可能出现相同的 instance（如相同的内网 IP），键为 region/instance
+    """
+    return f"{region}/{instance}" if region else instance
+
+def parse_node_ref(ref: str) -> Tuple[str, str]:
+    """node_ref 的逆操作，返回 (region, instance)；前缀不是已配置的后端名时整体视为 instance"""
+    region, sep, instance = ref.partition("/")
+    if sep and region in _backend_names:
+        return region, instance
+    return "", ref
+
+def node_ref_of(metric: Dict[str, str]) -> str:
+    """合并后的样本标签 -> 节点键"""
+    region = metric.get(PROMETHEUS_BACKEND_LABEL, "") if MULTI_BACKEND else ""
+    return node_ref(metric.get("instance", ""), region)
+
+def _mark_backend_down(backend: Dict[str, str], reason: Any):
+    logger.warning(f"Prometheus backend {backend['name'] or backend['url']} degraded: {reason}")
+    if not MULTI_BACKEND:
+        return
+    with _backend_lock:
+        _backend_down_until[backend["name"]] = time.monotonic() + PROMETHEUS_BACKOFF_SECONDS
+
+def degraded_backends() -> List[str]:
+    """当前处于退避期（超时或失败）的后端名称"""
+    if not MULTI_BACKEND:
+        return []
+    now = time.monotonic()
+    with _backend_lock:
+        return sorted(name for name, until in _backend_down_until.items() if until > now)
 
-def query_single_value(expr: str) -> Optional[float]:
-    data = prom_query(expr)
+def degraded_note() -> Optional[str]:
+    names = degraded_backends()
+    if not names:
+        return None
+    return f"⚠️ _区域 {', '.join(names)} 暂不可用，以下数据可能不完整_"
+
+def _backends_for(node: Optional[str]) -> List[Dict[str, str]]:
+    region = parse_node_ref(node)[0] if node else ""
+    if region:
+        return [b for b in PROMETHEUS_BACKENDS if b["name"] == region]
+    if not MULTI_BACKEND:
+        return PROMETHEUS_BACKENDS
+    now = time.monotonic()
+    with _backend_lock:
+        return [b for b in PROMETHEUS_BACKENDS if _backend_down_until.get(b["name"], 0) <= now]
+
+def _prom_get(backend: Dict[str, str], path: str, params: Optional[Dict[str, str]]) -> Tuple[Dict[str, Any], int]:
+    """返回 (json, 响应字节数)"""
+    url = backend["url"].rstrip("/") + path
+    resp = requests.get(url, params=params, timeout=PROMETHEUS_TIMEOUT)
+    resp.raise_for_status()
+    return resp.json(), len(resp.content)
+
+def prom_fanout(path: str, params: Optional[Dict[str, str]] = None,
+                node: Optional[str] = None) -> List[Tuple[Dict[str, str], Dict[str, Any]]]:
+    """
+    并发请求所有（健康的）后端，返回 [(backend, json)]
+    单个后端超时只影响它自己的那部分数据，并进入退避期，
+    之后的查询直接跳过它，整体耗时接近最快的健康后端。
+    """
+    check_render_cancelled()
+    targets = _backends_for(node)
+    with trace_span("promql", (params or {}).get("query", path)) as span:
+        if len(targets) == 1:
+            backend = targets[0]
+            try:
+                data, span["bytes"] = _prom_get(backend, path, params)
+                return [(backend, data)]
+            except Exception as e:
+                _mark_backend_down(backend, e)
+                return []
+
+        futures = {_prom_pool.submit(_prom_get, b, path, params): b for b in targets}
+        done, not_done = wait(futures, timeout=PROMETHEUS_TIMEOUT + 0.5)
+        responses = []
+        for future in done:
+            backend = futures[future]
+            try:
+                data, nbytes = future.result()
+                span["bytes"] += nbytes
+                responses.append((backend, data))
+            except Exception as e:
+                _mark_backend_down(backend, e)
+        for future in not_done:
+            future.cancel()
+            _mark_backend_down(futures[future], "timeout")
+        return responses
+
+def prom_query(expr: str, node: Optional[str] = None, at: Optional[float] = None) -> Dict[str, Any]:
+    """
+    即时查询；多后端时合并各后端结果，并给样本打上来源标签
+    :param node: 节点键（node_ref），带区域时只查询其所属后端
+    :param at: 查询时间点（Unix 秒），默认当前
+    当前时刻的查询先查单次渲染内的结果，再查 query_cache，相同表达式只发一次。
+    """
+    if at is not None:
+        return _prom_query(expr, node, at)
+    key = (expr, node or "")
+    results = getattr(_render_local, "results", None)
+    if results is not None and key in results:
+        trace_event("promql_dedup", expr)
+        return results[key]
+    data = query_cache.get(key)
+    if data is not None:
+        trace_event("promql_cached", expr)
+    else:
+        data = _prom_query(expr, node, None)
+        if data:
+            query_cache.put(key, data)
+    if results is not None and data:
+        results[key] = data
+    return data
+
+def _prom_query(expr: str, node: Optional[str], at: Optional[float]) -> Dict[str, Any]:
+    params = {"query": expr}
+    if at is not None:
+        params["time"] = "%.3f" % at
+    responses = prom_fanout("/api/v1/query", params, node)
+    if not responses:
+        logger.error(f"Prometheus Query Failed: {expr}")
+        return {}
+    if len(responses) == 1 and not MULTI_BACKEND:
+        return responses[0][1]
+
+    result_type = None
+    merged: List[Dict[str, Any]] = []
+    for backend, data in responses:
+        body = data.get("data", {})
+        result_type = result_type or body.get("resultType")
+        for item in body.get("result", []):
+            if backend["name"] and isinstance(item, dict):
+                item.setdefault("metric", {}).setdefault(PROMETHEUS_BACKEND_LABEL, backend["name"])
+            merged.append(item)
+    return {"status": "success", "data": {"resultType": result_type, "result": merged}}
+
+def query_single_value(expr: str, node: Optional[str] = None) -> Optional[float]:
+    data = prom_query(expr, node)
     result = data.get("data", {}).get("result", [])
     if not result: return None
     try:
@@ -101,8 +573,25 @@ def query_single_value(expr: str) -> Optional[float]:
     except:
         return None
 
+def query_vector(expr: str, node: Optional[str] = None,
+                 at: Optional[float] = None) -> List[Tuple[Dict[str, str], float]]:
+    """返回 instant vector 的 (labels, value) 列表，无法解析的样本跳过"""
+    data = prom_query(expr, node, at)
+    result = data.get("data", {}).get("result", [])
+    samples: List[Tuple[Dict[str, str], float]] = []
+    for item in result:
+        try:
+            samples.append((item.get("metric", {}), float(item.get("value", [None, None])[1])))
+        except (TypeError, ValueError):
+            continue
+    return samples
+
 def get_nodes_grouped_by_project() -> Dict[str, List[Dict[str, str]]]:
-    data = prom_query('up{job="nodes"}')
+    cached = snapshot_lookup("nodes")
+    if cached is not None:
+        return cached
+
+    data = prom_query(promql("node_up"))
     result = data.get("data", {}).get("result", [])
     projects: Dict[str, List[Dict[str, str]]] = {}
 
@@ -112,6 +601,7 @@ def get_nodes_grouped_by_project() -> Dict[str, List[Dict[str, str]]]:
         instance = metric.get("instance", "")
         alias = metric.get("alias", instance)
         role = metric.get("role", "unknown")
+        region = metric.get(PROMETHEUS_BACKEND_LABEL, "") if MULTI_BACKEND else ""
 
         if project not in projects:
             projects[project] = []
@@ -119,18 +609,30 @@ def get_nodes_grouped_by_project() -> Dict[str, List[Dict[str, str]]]:
             "instance": instance,
             "alias": alias,
             "role": role,
+            "region": region,
         })
 
     for proj in projects:
         projects[proj].sort(key=lambda x: x["alias"])
+
+    # 有区域退避时 inventory 不完整：只增不删，避免误删该区域节点
+    if data:
+        search_index.update_nodes(projects, allow_removals=not degraded_backends())
+        snapshot_store.record("nodes", projects)
     return projects
 
 def get_rds_grouped_by_project() -> Dict[str, List[Dict[str, Any]]]:
     if not RDS_INSTANCES: return {}
+    cached = snapshot_lookup("rds")
+    if cached is not None:
+        return cached
+    check_render_cancelled()
     try:
-        resp = requests.get(CLOUDWATCH_EXPORTER_URL, timeout=5)
-        resp.raise_for_status()
-        text = resp.text
+        with trace_span("exporter", CLOUDWATCH_EXPORTER_URL) as span:
+            resp = requests.get(CLOUDWATCH_EXPORTER_URL, timeout=5)
+            resp.raise_for_status()
+            text = resp.text
+            span["bytes"] = len(resp.content)
     except Exception as e:
         logger.warning(f"Exporter fetch failed: {e}")
         return {}
@@ -145,30 +647,31 @@ def get_rds_grouped_by_project() -> Dict[str, List[Dict[str, Any]]]:
         "aws_rds_free_storage_space_average": "free_storage",
     }
     
-    inst_stats = {}
-    line_re = re.compile(r"^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)\{(?P<labels>[^}]*)\}\s+(?P<value>[-0-9.eE]+)")
-    
-    for line in text.splitlines():
-        if not line or line.startswith("#"): continue
-        m2 = line_re.match(line)
-        if not m2: continue
-        name = m2.group("name")
-        if name not in metric_map: continue
-        
-        labels_str = m2.group("labels")
-        value_str = m2.group("value")
-        labels = {}
-        for part in labels_str.split(","):
-            if "=" in part:
-                k, v = part.split("=", 1)
-                labels[k.strip()] = v.strip().strip('"')
-        
-        inst = labels.get("dbinstance_identifier") or labels.get("DBInstanceIdentifier")
-        if not inst: continue
-        try:
-            val = float(value_str)
-            inst_stats.setdefault(inst, {})[metric_map[name]] = val
-        except: continue
+    with trace_span("exporter_parse", f"{len(text)} chars"):
+        inst_stats = {}
+        line_re = re.compile(r"^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)\{(?P<labels>[^}]*)\}\s+(?P<value>[-0-9.eE]+)")
+
+        for line in text.splitlines():
+            if not line or line.startswith("#"): continue
+            m2 = line_re.match(line)
+            if not m2: continue
+            name = m2.group("name")
+            if name not in metric_map: continue
+
+            labels_str = m2.group("labels")
+            value_str = m2.group("value")
+            labels = {}
+            for part in labels_str.split(","):
+                if "=" in part:
+                    k, v = part.split("=", 1)
+                    labels[k.strip()] = v.strip().strip('"')
+
+            inst = labels.get("dbinstance_identifier") or labels.get("DBInstanceIdentifier")
+            if not inst: continue
+            try:
+                val = float(value_str)
+                inst_stats.setdefault(inst, {})[metric_map[name]] = val
+            except: continue
 
     projects = {}
     for inst, stats in inst_stats.items():
@@ -186,32 +689,40 @@ def get_rds_grouped_by_project() -> Dict[str, List[Dict[str, Any]]]:
     
     for proj in projects:
         projects[proj].sort(key=lambda x: x["alias"])
+    snapshot_store.record("rds", projects)
     return projects
 
-def get_node_labels(instance: str) -> Dict[str, str]:
-    data = prom_query(f'up{{job="nodes",instance="{instance}"}}')
+def get_node_labels(node: str) -> Dict[str, str]:
+    """:param node: 节点键（node_ref），下同"""
+    region, instance = parse_node_ref(node)
+    data = prom_query(promql("node_up", instance=instance), node)
     result = data.get("data", {}).get("result", [])
     if not result:
-        return {"instance": instance, "alias": instance, "role": "unknown", "project": "unknown"}
+        return {"instance": instance, "alias": instance, "role": "unknown", "project": "unknown", "region": region}
     metric = result[0].get("metric", {})
     return {
         "instance": metric.get("instance", instance),
         "alias": metric.get("alias", instance),
         "role": metric.get("role", "unknown"),
         "project": metric.get("project", "unknown"),
+        "region": metric.get(PROMETHEUS_BACKEND_LABEL, region) if MULTI_BACKEND else "",
     }
 
-def get_node_status(instance: str) -> Dict[str, Optional[float]]:
+def get_node_status(node: str) -> Dict[str, Optional[float]]:
+    cached = snapshot_lookup("node_status", node)
+    if cached is not None:
+        return cached
+    instance = parse_node_ref(node)[1]
+
     # CPU
-    cpu_expr = f'avg(1 - rate(node_cpu_seconds_total{{instance="{instance}",mode="idle"}}[5m])) * 100'
-    cpu_percent = query_single_value(cpu_expr)
+    cpu_percent = query_single_value(promql("node_cpu_percent", instance=instance), node)
 
     # Load1
-    load1 = query_single_value(f'node_load1{{instance="{instance}"}}')
+    load1 = query_single_value(promql("node_load1", instance=instance), node)
 
     # Mem
-    mem_total = query_single_value(f'node_memory_MemTotal_bytes{{instance="{instance}"}}')
-    mem_avail = query_single_value(f'node_memory_MemAvailable_bytes{{instance="{instance}"}}')
+    mem_total = query_single_value(promql("node_mem_total", instance=instance), node)
+    mem_avail = query_single_value(promql("node_mem_avail", instance=instance), node)
     mem_percent = None
     mem_used_gib = None
     mem_total_gib = None
@@ -224,24 +735,13 @@ def get_node_status(instance: str) -> Dict[str, Optional[float]]:
     # Disk summary:
     # - disk_percent: worst partition usage across all meaningful mountpoints (/, /data, etc.)
     # - disk_root_*: root partition (/) usage, used for node detail display
-    fs_filter = 'fstype!~"tmpfs|overlay|squashfs"'
-    mp_filter = 'mountpoint!~"^/(proc|sys|run)($|/)"'
 
     # Worst disk usage %
-    worst_expr = (
-        f'max(((node_filesystem_size_bytes{{instance="{instance}",{fs_filter},{mp_filter}}} '
-        f'- node_filesystem_avail_bytes{{instance="{instance}",{fs_filter},{mp_filter}}}) '
-        f'/ node_filesystem_size_bytes{{instance="{instance}",{fs_filter},{mp_filter}}}) * 100)'
-    )
-    disk_percent = query_single_value(worst_expr)
+    disk_percent = query_single_value(promql("node_disk_worst_percent", instance=instance), node)
 
     # Root (/) usage for detail view
-    disk_root_total = query_single_value(
-        f'node_filesystem_size_bytes{{instance="{instance}",mountpoint="/",{fs_filter}}}'
-    )
-    disk_root_avail = query_single_value(
-        f'node_filesystem_avail_bytes{{instance="{instance}",mountpoint="/",{fs_filter}}}'
-    )
+    disk_root_total = query_single_value(promql("node_root_size", instance=instance), node)
+    disk_root_avail = query_single_value(promql("node_root_avail", instance=instance), node)
     disk_root_percent = None
     disk_root_used_gib = None
     disk_root_total_gib = None
@@ -251,7 +751,7 @@ def get_node_status(instance: str) -> Dict[str, Optional[float]]:
         disk_root_used_gib = disk_root_used / (1024**3)
         disk_root_total_gib = disk_root_total / (1024**3)
 
-    return {
+    status = {
         "cpu_percent": cpu_percent,
         "load1": load1,
         "mem_percent": mem_percent,
@@ -264,40 +764,37 @@ def get_node_status(instance: str) -> Dict[str, Optional[float]]:
         "disk_root_used_gib": disk_root_used_gib,
         "disk_root_total_gib": disk_root_total_gib,
     }
+    if any(v is not None for v in status.values()):
+        snapshot_store.record("node_status", status, node)
+    return status
 
 
-def get_node_disks(instance: str) -> List[Dict[str, Any]]:
-    """返回该节点所有有意义的磁盘分区使用情况（mountpoint 维度）。"""
-    fs_filter = 'fstype!~"tmpfs|overlay|squashfs"'
-    mp_filter = 'mountpoint!~"^/(proc|sys|run)($|/)"'
-
-    # 先拿到所有 mountpoint（通过 size 指标的 label 集合）
-    data = prom_query(
-        f'node_filesystem_size_bytes{{instance="{instance}",{fs_filter},{mp_filter}}}'
-    )
-    result = data.get("data", {}).get("result", []) if data else []
-    if not result:
+def get_node_disks(node: str) -> List[Dict[str, Any]]:
+    """
+    返回该节点所有有意义的磁盘分区使用情况（mountpoint 维度）。
+    size / avail / readonly 各一次按分区返回的查询，在本地按 mountpoint 关联，查询数与分区数无关。
+    """
+    instance = parse_node_ref(node)[1]
+    # size 指标的 label 集合即分区列表
+    sizes = query_vector(promql("node_fs_size", instance=instance), node)
+    if not sizes:
         return []
+    avails = {m.get("mountpoint"): v for m, v in query_vector(promql("node_fs_avail", instance=instance), node)}
+    readonly = {m.get("mountpoint"): v for m, v in query_vector(promql("node_fs_readonly", instance=instance), node)}
 
     disks: List[Dict[str, Any]] = []
-    for item in result:
-        metric = item.get("metric", {}) or {}
+    seen: Set[str] = set()
+    for metric, size in sizes:
         mountpoint = metric.get("mountpoint")
         device = metric.get("device")
         fstype = metric.get("fstype")
 
-        if not mountpoint:
+        if not mountpoint or mountpoint in seen:
             continue
+        seen.add(mountpoint)
 
-        size = query_single_value(
-            f'node_filesystem_size_bytes{{instance="{instance}",mountpoint="{mountpoint}",{fs_filter}}}'
-        )
-        avail = query_single_value(
-            f'node_filesystem_avail_bytes{{instance="{instance}",mountpoint="{mountpoint}",{fs_filter}}}'
-        )
-        ro = query_single_value(
-            f'node_filesystem_readonly{{instance="{instance}",mountpoint="{mountpoint}",{fs_filter}}}'
-        )
+        avail = avails.get(mountpoint)
+        ro = readonly.get(mountpoint)
 
         # 跳过只读分区（例如某些系统挂载）
         if ro is not None and ro != 0:
@@ -322,9 +819,75 @@ def get_node_disks(instance: str) -> List[Dict[str, Any]]:
     disks.sort(key=lambda x: (0 if x["mountpoint"] == "/" else 1, x["mountpoint"]))
     return disks
 
+def get_disk_forecasts(project: Optional[str] = None,
+                       horizon_days: float = FORECAST_HORIZON_DAYS) -> List[Dict[str, Any]]:
+    """
+    预测磁盘写满时间（time-to-full）
+    - 节点分区：一次 deriv 查询算出所有持续下降分区的剩余秒数，一次查询取当前使用率
+    - RDS：对 free_storage 做同样的 deriv 预测
+    仅返回 horizon_days 内会写满的条目，按剩余时间升序排列。
+    """
+    labels = {"project": project} if project else {}
+    params = {"window": FORECAST_WINDOW, "horizon": "%.0f" % (horizon_days * 86400)}
+    ttf_expr = promql("disk_ttf", params=params, **labels)
+    used_expr = promql("disk_used_percent", **labels)
+
+    forecasts: List[Dict[str, Any]] = []
+    ttf_samples = query_vector(ttf_expr)
+    if ttf_samples:
+        used_pct = {
+            (node_ref_of(m), m.get("mountpoint")): v for m, v in query_vector(used_expr)
+        }
+        inventory: Dict[str, Dict[str, str]] = {}
+        for proj, nodes in get_nodes_grouped_by_project().items():
+            for node in nodes:
+                inventory[node_ref(node["instance"], node.get("region", ""))] = {"alias": node["alias"], "project": proj}
+
+        for metric, seconds in ttf_samples:
+            ref = node_ref_of(metric)
+            instance = metric.get("instance", "")
+            mountpoint = metric.get("mountpoint", "?")
+            info = inventory.get(ref, {})
+            forecasts.append({
+                "kind": "node",
+                "id": ref,
+                "alias": info.get("alias", metric.get("alias", instance)),
+                "project": info.get("project", metric.get("project", "unknown")),
+                "mountpoint": mountpoint,
+                "used_pct": used_pct.get((ref, mountpoint)),
+                "hours_to_full": seconds / 3600.0,
+            })
+
+    # RDS 剩余存储（CloudWatch exporter 已被 Prometheus 抓取）
+    if RDS_INSTANCES:
+        rds_meta = {item["id"]: item for item in RDS_INSTANCES}
+        for metric, seconds in query_vector(promql("rds_storage_ttf", params=params)):
+            inst = metric.get("dbinstance_identifier") or metric.get("DBInstanceIdentifier")
+            meta = rds_meta.get(inst)
+            if not meta:
+                continue
+            if project and meta.get("project", "unknown") != project:
+                continue
+            forecasts.append({
+                "kind": "rds",
+                "id": inst,
+                "alias": meta.get("alias", inst),
+                "project": meta.get("project", "unknown"),
+                "mountpoint": None,
+                "used_pct": None,
+                "hours_to_full": seconds / 3600.0,
+            })
+
+    forecasts.sort(key=lambda x: x["hours_to_full"])
+    return forecasts
+
 # 格式化工具
 def fmt_pct(v): return "—" if v is None else "%.1f%%" % v
 def fmt_load(v): return "—" if v is None else "%.2f" % v
+def fmt_duration_hours(h):
+    if h is None: return "—"
+    if h < 48: return "%.1f 小时" % h
+    return "%.1f 天" % (h / 24)
 def fmt_gib_pair(used, total):
     if used is None or total is None: return "—"
     return "%.1fG / %.1fG" % (used, total)
@@ -341,20 +904,24 @@ def overall_emoji(cpu, mem, disk):
     if not vals: return "⚪"
     return level_emoji(max(vals))
 
-def get_metric_trend(expr_current: str, threshold: float = 0.1) -> str:
+def get_metric_trend(template: str, node: str, threshold: float = 0.1) -> str:
     """
-    计算指标趋势
-    :param expr_current: 当前值的 PromQL 表达式
+    计算单节点指标趋势
+    :param template: PROMQL_TEMPLATES 中的模板名（当前值与 get_node_status 同一表达式，渲染内只查一次）
+    :param node: 节点键（带区域时只查询其所属 Prometheus）
     :param threshold: 变化阈值（默认 10%）
     :return: 趋势箭头 ↗️/↘️/➡️
     """
-    current = query_single_value(expr_current)
+    # 快照渲染时不发起趋势查询，后台刷新后再补上
+    if getattr(_render_local, "allow_stale", False):
+        return ""
+    instance = parse_node_ref(node)[1]
+    current = query_single_value(promql(template, instance=instance), node)
     if current is None:
         return ""
     
-    # 查询 5 分钟前的值
-    expr_past = f"{expr_current} offset 5m"
-    past = query_single_value(expr_past)
+    # 查询 5 分钟前的值（offset 加在每个 selector 上）
+    past = query_single_value(promql(template, offset="5m", instance=instance), node)
     
     if past is None or past == 0:
         return ""
@@ -368,37 +935,973 @@ def get_metric_trend(expr_current: str, threshold: float = 0.1) -> str:
     else:
         return "➡️"
 
+def fleet_metric_exprs() -> Dict[str, str]:
+    """全局按 instance 聚合的 CPU / 内存 / 最紧张分区使用率表达式"""
+    return {key: promql(f"fleet_{key}") for key in ("cpu", "mem", "disk")}
+
+def get_fleet_hotspots(top_n: int = HOTSPOT_TOP_N) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    全局 Top-N 热点实例（CPU / 内存 / 最紧张分区 / load1）
+    每项指标一次服务端 topk 查询，只传回 N 条样本；再用 inventory（与列表页共享缓存）补齐 alias/project。
+    """
+    inventory: Dict[str, Dict[str, str]] = {}
+    for project, nodes in get_nodes_grouped_by_project().items():
+        for node in nodes:
+            inventory[node_ref(node["instance"], node.get("region", ""))] = {"alias": node["alias"], "project": project}
+
+    hotspots: Dict[str, List[Dict[str, Any]]] = {}
+    for key in ("cpu", "mem", "disk", "load1"):
+        rows = []
+        for metric, value in query_vector(promql(f"fleet_top_{key}", params={"n": top_n})):
+            instance = metric.get("instance", "")
+            ref = node_ref_of(metric)
+            info = inventory.get(ref, {})
+            rows.append({
+                "node": ref,
+                "instance": instance,
+                "alias": info.get("alias", metric.get("alias", instance)),
+                "project": info.get("project", metric.get("project", "unknown")),
+                "value": value,
+            })
+        # 多后端时每个后端各返回 top_n，合并后再截断；同值按节点键排序，结果与后端返回顺序无关
+        hotspots[key] = heapq.nsmallest(top_n, rows, key=lambda x: (-x["value"], x["node"]))
+    return hotspots
+
+# 节点异常阈值（%），is_node_abnormal 与 FleetSnapshot.abnormal 共用
+NODE_ABNORMAL_THRESHOLDS = {"cpu_percent": 80, "mem_percent": 85, "disk_percent": 85}
+
 def is_node_abnormal(status: Dict[str, Optional[float]]) -> bool:
     """
     判断节点是否异常
     :param status: 节点状态字典
     :return: True 表示异常
     """
-    cpu = status.get("cpu_percent")
-    mem = status.get("mem_percent")
-    disk = status.get("disk_percent")
-    
-    if cpu and cpu > 80:
-        return True
-    if mem and mem > 85:
-        return True
-    if disk and disk > 85:
-        return True
-    
+    for key, threshold in NODE_ABNORMAL_THRESHOLDS.items():
+        value = status.get(key)
+        if value and value > threshold:
+            return True
     return False
 
+# ==========================================
+# 🗃 列式节点快照（大规模 fleet）
+# ==========================================
+
+NAN = float("nan")
+
+class FleetSnapshot:
+    """
+    全部节点的紧凑列式快照：
+    - 标签字符串 intern，role / region 等重复值全局只存一份，project 以 array('H') 编码
+    - 指标按列存成 array('d')（缺失为 NaN），每节点 8 字节/指标，无逐节点 dict
+    - 行按 (project, alias) 排序，每个项目对应一段连续的行号 range
+    过滤、排序、Top-N 都是对列的整体扫描，只有最终展示的行才物化成 dict。
+    """
+
+    # cpu_5m 为 5 分钟前的 CPU，用于列表页的趋势箭头（整个 fleet 一次 offset 查询）
+    METRICS = ("cpu", "mem", "disk", "load1", "cpu_5m")
+
+    __slots__ = (
+        "built_at", "projects", "project_code", "instances", "aliases", "roles", "regions",
+        "row_of", "by_project", "cpu", "mem", "disk", "load1", "cpu_5m",
+    )
+
+    def __init__(self):
+        self.built_at = time.time()
+        self.projects: Tuple[str, ...] = ()
+        self.project_code = array("H")
+        self.instances: List[str] = []
+        self.aliases: List[str] = []
+        self.roles: List[str] = []
+        self.regions: List[str] = []
+        self.row_of: Dict[str, int] = {}
+        self.by_project: Dict[str, range] = {}
+        for col in self.METRICS:
+            setattr(self, col, array("d"))
+
+    @classmethod
+    def build(cls, projects: Dict[str, List[Dict[str, str]]],
+              metrics: Dict[str, Dict[str, float]]) -> "FleetSnapshot":
+        """projects 为 get_nodes_grouped_by_project() 的结果；metrics 为 {列名: {node_ref: value}}"""
+        snap = cls()
+        intern = sys.intern
+        snap.projects = tuple(intern(p) for p in sorted(projects))
+        columns = [(getattr(snap, col), metrics.get(col, {})) for col in cls.METRICS]
+        row = 0
+        for code, project in enumerate(snap.projects):
+            start = row
+            for node in projects[project]:
+                instance = intern(node["instance"])
+                region = intern(node.get("region", ""))
+                ref = node_ref(instance, region)
+                snap.instances.append(instance)
+                snap.aliases.append(intern(node["alias"]))
+                snap.roles.append(intern(node["role"]))
+                snap.regions.append(region)
+                snap.project_code.append(code)
+                snap.row_of[ref] = row
+                for column, values in columns:
+                    column.append(values.get(ref, NAN))
+                row += 1
+            snap.by_project[project] = range(start, row)
+        return snap
+
+    def __len__(self) -> int:
+        return len(self.instances)
+
+    def rows(self, project: Optional[str] = None) -> range:
+        if project is None:
+            return range(len(self.instances))
+        return self.by_project.get(project, range(0))
+
+    def value(self, col: str, i: int) -> Optional[float]:
+        v = getattr(self, col)[i]
+        return None if v != v else v
+
+    def ref(self, i: int) -> str:
+        """第 i 行的节点键（node_ref）"""
+        return node_ref(self.instances[i], self.regions[i])
+
+    def node(self, i: int) -> Dict[str, str]:
+        return {
+            "instance": self.instances[i],
+            "alias": self.aliases[i],
+            "role": self.roles[i],
+            "region": self.regions[i],
+            "project": self.projects[self.project_code[i]],
+        }
+
+    def status(self, i: int) -> Dict[str, Optional[float]]:
+        """与 get_node_status() 同名键的子集，供列表页使用"""
+        return {
+            "cpu_percent": self.value("cpu", i),
+            "mem_percent": self.value("mem", i),
+            "disk_percent": self.value("disk", i),
+            "load1": self.value("load1", i),
+        }
+
+    def trend(self, col: str, i: int, threshold: float = 0.1) -> str:
+        """与 get_metric_trend() 相同的判定，比较 col 与 {col}_5m 两列"""
+        current, past = getattr(self, col)[i], getattr(self, f"{col}_5m")[i]
+        if current != current or past != past or past == 0:
+            return ""
+        change_rate = (current - past) / past
+        if change_rate > threshold:
+            return "↗️"
+        elif change_rate < -threshold:
+            return "↘️"
+        else:
+            return "➡️"
+
+    def abnormal(self, rows: Optional[range] = None) -> List[int]:
+        """is_node_abnormal() 的整列版本；NaN 与任何阈值比较都为 False"""
+        cpu, mem, disk = self.cpu, self.mem, self.disk
+        cpu_t = NODE_ABNORMAL_THRESHOLDS["cpu_percent"]
+        mem_t = NODE_ABNORMAL_THRESHOLDS["mem_percent"]
+        disk_t = NODE_ABNORMAL_THRESHOLDS["disk_percent"]
+        return [
+            i for i in (self.rows() if rows is None else rows)
+            if cpu[i] > cpu_t or mem[i] > mem_t or disk[i] > disk_t
+        ]
+
+    def top_n(self, col: str, n: int, rows: Optional[range] = None) -> List[int]:
+        column = getattr(self, col)
+        candidates = (i for i in (self.rows() if rows is None else rows) if column[i] == column[i])
+        return heapq.nlargest(n, candidates, key=column.__getitem__)
+
+    def to_json(self) -> Dict[str, Any]:
+        """写入 warm start 快照；NaN 以 null 保存"""
+        return {
+            "built_at": self.built_at,
+            "projects": list(self.projects),
+            "project_code": self.project_code.tolist(),
+            "instances": self.instances,
+            "aliases": self.aliases,
+            "roles": self.roles,
+            "regions": self.regions,
+            **{col: [None if v != v else v for v in getattr(self, col)] for col in self.METRICS},
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "FleetSnapshot":
+        snap = cls()
+        intern = sys.intern
+        snap.built_at = data.get("built_at", 0.0)
+        snap.projects = tuple(intern(p) for p in data["projects"])
+        snap.project_code = array("H", data["project_code"])
+        snap.instances = [intern(s) for s in data["instances"]]
+        snap.aliases = [intern(s) for s in data["aliases"]]
+        snap.roles = [intern(s) for s in data["roles"]]
+        snap.regions = [intern(s) for s in data["regions"]]
+        snap.row_of = {snap.ref(i): i for i in range(len(snap.instances))}
+        for col in cls.METRICS:
+            # 旧版本快照可能缺少新增的列
+            values = data.get(col) or [None] * len(snap.instances)
+            setattr(snap, col, array("d", (NAN if v is None else v for v in values)))
+        start = 0
+        for code, project in enumerate(snap.projects):
+            stop = start
+            while stop < len(snap.project_code) and snap.project_code[stop] == code:
+                stop += 1
+            snap.by_project[project] = range(start, stop)
+            start = stop
+        return snap
+
+_fleet_lock = threading.Lock()
+_fleet_cache: Optional[FleetSnapshot] = None
+
+def get_fleet(max_age: float = FLEET_CACHE_SECONDS) -> FleetSnapshot:
+    """
+    全局节点快照：1 次 inventory + 5 次全局向量查询（含 5 分钟前的 CPU），查询次数与节点规模无关。
+    max_age 内复用上一次结果；并发调用只构建一次。
+    """
+    global _fleet_cache
+    cached = snapshot_lookup("fleet")
+    if cached is not None:
+        return FleetSnapshot.from_json(cached)
+
+    snap = _fleet_cache
+    if snap is not None and time.time() - snap.built_at <= max_age:
+        return snap
+    with _fleet_lock:
+        snap = _fleet_cache
+        if snap is not None and time.time() - snap.built_at <= max_age:
+            return snap
+        exprs = dict(fleet_metric_exprs(), load1=promql("fleet_load1"), cpu_5m=promql("fleet_cpu", offset="5m"))
+        projects = get_nodes_grouped_by_project()
+        metrics = {
+            col: {node_ref_of(m): v for m, v in query_vector(expr)} for col, expr in exprs.items()
+        }
+        snap = FleetSnapshot.build(projects, metrics)
+        # inventory 来自快照时不进缓存，交给后台刷新重建
+        if len(snap) and not getattr(_render_local, "used_snapshot", False):
+            _fleet_cache = snap
+            snapshot_store.record("fleet", snap.to_json())
+        return snap
+
+# ==========================================
+# 🚦 回调去抖与并发合并
+# ==========================================
+
+class RenderCancelled(Exception):
+    """当前渲染已被同一消息上的新操作取代。"""
+
+class RenderTicket:
+    __slots__ = ("data", "finished_at", "cancelled", "done")
+
+    def __init__(self, data: str):
+        self.data = data
+        self.finished_at = 0.0
+        self.cancelled = False
+        self.done = threading.Event()
+
+class RenderRegistry:
+    """
+    按 (chat_id, message_id) 登记正在进行的渲染
+    - 渲染进行中再次点击同一按钮：并入当前渲染，不再重复查询
+    - 去抖窗口内刚完成的同一渲染：直接合并
+    - 用户已切换到其他视图：标记旧渲染取消，后续查询不再发出
+    """
+
+    def __init__(self, debounce_seconds: float):
+        self.debounce_seconds = debounce_seconds
+        self._lock = threading.Lock()
+        self._tickets: Dict[Tuple[Any, Any], RenderTicket] = {}
+
+    def acquire(self, key: Tuple[Any, Any], data: str) -> Optional[RenderTicket]:
+        """返回新的渲染票据；若本次点击被合并则返回 None"""
+        now = time.monotonic()
+        with self._lock:
+            current = self._tickets.get(key)
+            if current is not None and not current.done.is_set():
+                if current.data == data and not current.cancelled:
+                    return None
+                current.cancelled = True
+            elif current is not None and current.data == data:
+                if now - current.finished_at < self.debounce_seconds:
+                    return None
+            ticket = RenderTicket(data)
+            self._tickets[key] = ticket
+            return ticket
+
+    def release(self, key: Tuple[Any, Any], ticket: RenderTicket):
+        now = time.monotonic()
+        with self._lock:
+            ticket.finished_at = now
+            ticket.done.set()
+            # 清理已过去抖窗口的记录，避免常驻内存增长
+            stale = [
+                k for k, t in self._tickets.items()
+                if t.done.is_set() and now - t.finished_at >= self.debounce_seconds
+            ]
+            for k in stale:
+                del self._tickets[k]
+
+render_registry = RenderRegistry(CALLBACK_DEBOUNCE_SECONDS)
+_render_local = threading.local()
+
+def check_render_cancelled():
+    """在发起外部查询前调用：当前渲染已被取代时中止"""
+    ticket = getattr(_render_local, "ticket", None)
+    if ticket is not None and ticket.cancelled:
+        raise RenderCancelled()
+
+class CancellableQuery:
+    """
+    CallbackQuery 代理：edit_message_text 前最后检查一次取消
+    数据查询完成后、真正写消息前被新操作取代的渲染，不会用旧视图覆盖新视图。
+    """
+
+    def __init__(self, query):
+        self._query = query
+
+    def edit_message_text(self, *args, **kwargs):
+        check_render_cancelled()
+        return self._query.edit_message_text(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._query, name)
+
+def callback_render_key(query) -> Tuple[Any, Any]:
+    if query.message:
+        return (query.message.chat_id, query.message.message_id)
+    return ("inline", query.inline_message_id)
+
+# ==========================================
+# 🔎 节点搜索索引
+# ==========================================
+
+class SearchIndex:
+    """
+    内存中的节点 / RDS 搜索索引（前缀 + trigram）
+    - 词项：instance、IP、alias、role、project、region；RDS 的 id、alias、project
+    - 短查询（< 3 字符）走有序词表的前缀二分查找
+    - 长查询走 trigram 倒排求交，再做子串校验
+    inventory 变化时按条目做增量更新，搜索本身不访问 Prometheus。
+    """
+
+    # 单个词最多校验的候选条目数：过宽的词（如单个字符）只取前缀序最靠前的一部分，完全匹配总在最前面
+    CANDIDATE_LIMIT = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._docs: Dict[str, Dict[str, str]] = {}
+        self._terms: Dict[str, Tuple[str, ...]] = {}
+        self._sort_keys: Dict[str, Tuple[str, str]] = {}
+        self._trigrams: Dict[str, Set[str]] = {}
+        self._prefix: List[Tuple[str, str]] = []
+
+    @staticmethod
+    def _grams(term: str) -> Set[str]:
+        return {term[i:i + 3] for i in range(len(term) - 2)}
+
+    def _add(self, key: str, doc: Dict[str, str], terms: Tuple[str, ...]):
+        """登记文档与 trigram；前缀表由 _sync 批量追加后统一排序"""
+        self._docs[key] = doc
+        self._terms[key] = terms
+        self._sort_keys[key] = (doc["alias"].lower(), key)
+        for term in terms:
+            for g in self._grams(term):
+                self._trigrams.setdefault(g, set()).add(key)
+
+    def _remove(self, key: str):
+        """移除文档与 trigram；前缀表由 _sync 批量过滤"""
+        self._docs.pop(key, None)
+        self._sort_keys.pop(key, None)
+        for term in self._terms.pop(key, ()):
+            for g in self._grams(term):
+                keys = self._trigrams.get(g)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._trigrams[g]
+
+    def _sync(self, kind: str, docs: Dict[str, Dict[str, str]], allow_removals: bool = True):
+        with self._lock:
+            removed: Set[str] = set()
+            added: List[Tuple[str, str]] = []
+            if allow_removals:
+                for key in [k for k, d in self._docs.items() if d["kind"] == kind and k not in docs]:
+                    self._remove(key)
+                    removed.add(key)
+            for key, doc in docs.items():
+                if self._docs.get(key) == doc:
+                    continue
+                if key in self._docs:
+                    self._remove(key)
+                    removed.add(key)
+                terms: Set[str] = set()
+                for f, v in doc.items():
+                    if f in ("kind", "callback") or not v:
+                        continue
+                    # 整个字段 + 按空白拆开的单词（如 "ProjectA 主库" -> "主库"）
+                    terms.add(v.lower())
+                    terms.update(v.lower().split())
+                self._add(key, doc, tuple(sorted(terms)))
+                added.extend((term, key) for term in terms)
+            # 一次过滤 + 一次排序，代替逐条 insort / del 的 O(n) 移动
+            if removed:
+                self._prefix = [entry for entry in self._prefix if entry[1] not in removed]
+            if added:
+                self._prefix.extend(added)
+                self._prefix.sort()
+
+    def update_nodes(self, projects: Dict[str, List[Dict[str, str]]], allow_removals: bool = True):
+        docs = {}
+        for project, nodes in projects.items():
+            for node in nodes:
+                instance = node["instance"]
+                ref = node_ref(instance, node.get("region", ""))
+                docs[f"node:{ref}"] = {
+                    "kind": "node",
+                    "callback": f"node:{ref}",
+                    "instance": instance,
+                    "ip": instance.split(":")[0],
+                    "alias": node.get("alias", instance),
+                    "role": node.get("role", ""),
+                    "project": project,
+                    "region": node.get("region", ""),
+                }
+        self._sync("node", docs, allow_removals)
+
+    def update_rds(self, instances: List[Dict[str, str]]):
+        docs = {}
+        for item in instances:
+            project = item.get("project", "unknown")
+            docs[f"rds:{item['id']}"] = {
+                "kind": "rds",
+                "callback": f"rds:{project}:{item['id']}",
+                "instance": item["id"],
+                "alias": item.get("alias", item["id"]),
+                "project": project,
+            }
+        self._sync("rds", docs)
+
+    def _estimate(self, word: str) -> int:
+        """该词候选数的上界估计（不展开候选），用于多词查询时先走最窄的词"""
+        if len(word) >= 3:
+            return min(len(self._trigrams.get(g, ())) for g in self._grams(word))
+        lo = bisect.bisect_left(self._prefix, (word, ""))
+        hi = bisect.bisect_left(self._prefix, (word + "\U0010ffff", ""))
+        return hi - lo
+
+    def _match_word(self, word: str) -> Dict[str, int]:
+        """返回 key -> 匹配等级（0 完全匹配 / 1 前缀 / 2 子串），最多展开 CANDIDATE_LIMIT 个候选"""
+        matches: Dict[str, int] = {}
+        i = bisect.bisect_left(self._prefix, (word, ""))
+        stop = min(len(self._prefix), i + self.CANDIDATE_LIMIT)
+        while i < stop and self._prefix[i][0].startswith(word):
+            term, key = self._prefix[i]
+            rank = 0 if term == word else 1
+            matches[key] = min(rank, matches.get(key, rank))
+            i += 1
+        if len(word) >= 3 and len(matches) < self.CANDIDATE_LIMIT:
+            grams = sorted(self._grams(word), key=lambda g: len(self._trigrams.get(g, ())))
+            candidates = set(self._trigrams.get(grams[0], ()))
+            for g in grams[1:]:
+                if not candidates:
+                    break
+                candidates &= self._trigrams.get(g, set())
+            budget = self.CANDIDATE_LIMIT - len(matches)
+            for key in candidates:
+                if key in matches:
+                    continue
+                if any(word in t for t in self._terms[key]):
+                    matches[key] = 2
+                    budget -= 1
+                    if budget <= 0:
+                        break
+        return matches
+
+    def _rank(self, word: str, key: str) -> Optional[int]:
+        """单个文档对某个词的匹配等级，不匹配返回 None"""
+        best = None
+        substring = len(word) >= 3  # 与 _match_word 一致：短词只做前缀匹配
+        for term in self._terms[key]:
+            if term == word:
+                return 0
+            if term.startswith(word):
+                best = 1
+            elif best is None and substring and word in term:
+                best = 2
+        return best
+
+    def search(self, text: str, limit: int = 10) -> List[Dict[str, str]]:
+        """
+        多个词为 AND：最窄的词走索引取候选，其余词直接在候选的词项上校验
+        排序：匹配等级（取各词最差）、alias、key；只选出前 limit 条
+        """
+        words = sorted(set(text.lower().split()))
+        if not words:
+            return []
+        with self._lock:
+            words.sort(key=self._estimate)
+            scores = self._match_word(words[0])
+            for word in words[1:]:
+                if not scores:
+                    break
+                narrowed: Dict[str, int] = {}
+                for key, score in scores.items():
+                    rank = self._rank(word, key)
+                    if rank is not None:
+                        narrowed[key] = max(score, rank)
+                scores = narrowed
+            sort_keys = self._sort_keys
+            ranked = heapq.nsmallest(limit, scores, key=lambda k: (scores[k], sort_keys[k]))
+            return [dict(self._docs[k]) for k in ranked]
+
+    def __len__(self):
+        return len(self._docs)
+
+search_index = SearchIndex()
+search_index.update_rds(RDS_INSTANCES)
+
+def refresh_inventory_job(context: CallbackContext):
+    """定时刷新 inventory，保持搜索索引新鲜（搜索路径本身不访问 Prometheus）"""
+    get_nodes_grouped_by_project()
+
+def format_search_result(doc: Dict[str, str]) -> str:
+    if doc["kind"] == "rds":
+        return f"🗄 {doc['alias']} ({doc['instance']}) · {doc['project']}"
+    region = f" · {doc['region']}" if doc.get("region") else ""
+    return f"🖥 {doc['alias']} ({doc['ip']}) · {doc['project']}/{doc['role']}{region}"
+
+def find_command(update: Update, context: CallbackContext):
+    text = " ".join(context.args or [])
+    if not text:
+        update.message.reply_text("用法：/find <别名 / IP / 角色 / 项目>")
+        return
+    results = search_index.search(text)
+    if not results:
+        update.message.reply_text(f"🔎 未找到匹配「{text}」的节点或 RDS。")
+        return
+    keyboard = [
+        [InlineKeyboardButton(format_search_result(doc), callback_data=doc["callback"])]
+        for doc in results
+    ]
+    keyboard.append([InlineKeyboardButton("🏠 主菜单", callback_data="main_menu")])
+    update.message.reply_text(f"🔎 「{text}」的搜索结果：", reply_markup=InlineKeyboardMarkup(keyboard))
+
+def inline_find(update: Update, context: CallbackContext):
+    text = update.inline_query.query
+    articles = []
+    for doc in search_index.search(text, limit=20):
+        label = format_search_result(doc)
+        button = "🔍 查看节点详情" if doc["kind"] == "node" else "🔍 查看 RDS 详情"
+        articles.append(InlineQueryResultArticle(
+            id=doc["callback"][:64],
+            title=label,
+            input_message_content=InputTextMessageContent(label),
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(button, callback_data=doc["callback"])]]),
+        ))
+    update.inline_query.answer(articles, cache_time=5)
+
+# ==========================================
+# 💾 启动快照（Warm Start）
+# ==========================================
+
+class SnapshotStore:
+    """
+    最近一次的 inventory / 节点状态 / 列式节点快照 / RDS 指标 / Firing 告警
+    - 运行中由各查询函数 record()，定时压缩落盘（gzip JSON，原子替换）
+    - 启动后首次需要时才从磁盘加载
+    - 某类数据在本进程内拿到过实时结果后，就不再从快照提供
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.saved_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._disk: Dict[str, Any] = {}
+        self._live: Dict[str, Any] = {"node_status": {}}
+        self._live_keys: Set[Tuple[str, str]] = set()
+        self._dirty = False
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                    snap = json.load(f)
+                if time.time() - snap.get("saved_at", 0) <= SNAPSHOT_MAX_AGE_SECONDS:
+                    self._disk = snap
+                    self.saved_at = snap["saved_at"]
+                    logger.info(f"Loaded snapshot from {self.path}")
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"Snapshot load failed: {e}")
+            self._loaded = True
+
+    def available(self) -> bool:
+        self._ensure_loaded()
+        return bool(self._disk)
+
+    def stale(self, kind: str, key: str = "") -> Optional[Any]:
+        if (kind, key) in self._live_keys:
+            return None
+        self._ensure_loaded()
+        section = self._disk.get(kind)
+        if kind == "node_status":
+            return (section or {}).get(key)
+        return section
+
+    def record(self, kind: str, value: Any, key: str = ""):
+        with self._lock:
+            if kind == "node_status":
+                self._live["node_status"][key] = value
+            else:
+                self._live[kind] = value
+            self._live_keys.add((kind, key))
+            self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        self._ensure_loaded()
+        with self._lock:
+            snap = {k: v for k, v in self._disk.items() if k != "saved_at"}
+            snap.update({k: v for k, v in self._live.items() if k != "node_status"})
+            node_status = dict(snap.get("node_status") or {})
+            node_status.update(self._live["node_status"])
+            # 只保留仍在 inventory 中的节点
+            known = {
+                node_ref(n["instance"], n.get("region", ""))
+                for nodes in (snap.get("nodes") or {}).values() for n in nodes
+            }
+            snap["node_status"] = {k: v for k, v in node_status.items() if not known or k in known}
+            snap["saved_at"] = time.time()
+            self._dirty = False
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = self.path + ".tmp"
+            with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=6) as f:
+                json.dump(snap, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logger.warning(f"Snapshot save failed: {e}")
+
+snapshot_store = SnapshotStore(SNAPSHOT_PATH)
+
+# 可以先用快照渲染、再后台刷新的视图
+WARM_VIEW_PREFIXES = (
+    "main:projects", "main:status", "project:", "nodes_of_project:", "status_project:", "alerts_menu",
+)
+
+def snapshot_lookup(kind: str, key: str = "") -> Optional[Any]:
+    """仅在快照渲染模式下返回快照数据，否则返回 None 走实时查询"""
+    if not getattr(_render_local, "allow_stale", False):
+        return None
+    value = snapshot_store.stale(kind, key)
+    if value is not None:
+        _render_local.used_snapshot = True
+    return value
+
+class StaleMarkedQuery:
+    """用到快照数据时，在消息末尾标注数据时间"""
+
+    def __init__(self, query):
+        self._query = query
+
+    def edit_message_text(self, text, *args, **kwargs):
+        if getattr(_render_local, "used_snapshot", False) and snapshot_store.saved_at:
+            as_of = datetime.datetime.fromtimestamp(snapshot_store.saved_at, DISPLAY_TZ).strftime("%m-%d %H:%M:%S")
+            text = f"{text}\n\n🕒 快照数据（截至 {as_of}），正在后台刷新…"
+        return self._query.edit_message_text(text, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._query, name)
+
+def snapshot_save_job(context: CallbackContext):
+    snapshot_store.save()
+
+# ==========================================
+# 🩺 性能诊断（管理员）
+# ==========================================
+
+class RequestTrace:
+    """一次回调的轻量追踪：每个 PromQL / exporter / Telegram 调用的耗时与字节数"""
+
+    __slots__ = ("name", "started_at", "spans", "total", "_t0")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = time.time()
+        self.spans: List[Tuple[str, str, float, int]] = []
+        self.total: Optional[float] = None
+        self._t0 = time.perf_counter()
+
+    def finish(self):
+        self.total = time.perf_counter() - self._t0
+
+    def render(self) -> str:
+        total = self.total or 0.0
+        by_kind: Dict[str, float] = {}
+        for kind, _, duration, _ in self.spans:
+            by_kind[kind] = by_kind.get(kind, 0.0) + duration
+        # 并发 fan-out 的 span 可能重叠，"其他" 只是粗略的格式化/渲染耗时
+        other = max(0.0, total - sum(by_kind.values()))
+        breakdown = [f"{k} {v * 1000:.1f}ms" for k, v in sorted(by_kind.items(), key=lambda x: -x[1])]
+        breakdown.append(f"formatting/other {other * 1000:.1f}ms")
+        lines = [
+            f"callback : {self.name}",
+            f"started  : {datetime.datetime.fromtimestamp(self.started_at, DISPLAY_TZ):%Y-%m-%d %H:%M:%S}",
+            f"total    : {total * 1000:.1f} ms",
+            f"breakdown: {', '.join(breakdown)}",
+            "",
+        ]
+        for kind, detail, duration, nbytes in self.spans:
+            lines.append(f"{duration * 1000:8.1f}ms {nbytes:>8}B  {kind:<14} {detail}")
+        return "\n".join(lines)
+
+trace_buffer: "collections.deque[RequestTrace]" = collections.deque(maxlen=TRACE_BUFFER_SIZE)
+
+@contextlib.contextmanager
+def trace_span(kind: str, detail: str = ""):
+    """在当前回调的追踪中记录一个子调用；yield 出的 dict 可回填 bytes"""
+    trace = getattr(_render_local, "trace", None)
+    span = {"bytes": 0}
+    t0 = time.perf_counter()
+    try:
+        yield span
+    finally:
+        if trace is not None:
+            trace.spans.append((kind, detail, time.perf_counter() - t0, span["bytes"]))
+
+def trace_event(kind: str, detail: str = ""):
+    """记录一个不耗时的事件（如缓存命中）"""
+    trace = getattr(_render_local, "trace", None)
+    if trace is not None:
+        trace.spans.append((kind, detail, 0.0, 0))
+
+def begin_trace(name: str) -> RequestTrace:
+    trace = RequestTrace(name)
+    _render_local.trace = trace
+    profiler.enter()
+    return trace
+
+def end_trace(trace: RequestTrace):
+    trace.finish()
+    trace_buffer.append(trace)
+    _render_local.trace = None
+    profiler.exit()
+
+class TracedQuery:
+    """记录 Telegram API 调用耗时的 CallbackQuery 代理"""
+
+    def __init__(self, query):
+        self._query = query
+
+    def edit_message_text(self, *args, **kwargs):
+        with trace_span("telegram", "editMessageText"):
+            return self._query.edit_message_text(*args, **kwargs)
+
+    def answer(self, *args, **kwargs):
+        with trace_span("telegram", "answerCallbackQuery"):
+            return self._query.answer(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._query, name)
+
+class SamplingProfiler:
+    """
+    纯 Python 采样分析器：定时抓取正在处理回调的线程栈。
+    按「接下来 N 次回调」或「N 秒」采样，结束后把 Top 函数汇总
+    和 flamegraph.pl / speedscope 可读的 collapsed stacks 发给管理员。
+    不采样时 enter/exit 只是一次 Event 检查，开销可以忽略。
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._targets: Dict[int, int] = {}
+        self._stacks: Dict[str, int] = {}
+        self._samples = 0
+        self._remaining_callbacks: Optional[int] = None
+        self._deadline: Optional[float] = None
+        self._chat_id = None
+        self._started = 0.0
+
+    @property
+    def active(self) -> bool:
+        return self._active.is_set()
+
+    def start(self, chat_id, callbacks: Optional[int] = None, seconds: Optional[float] = None) -> bool:
+        with self._lock:
+            if self.active:
+                return False
+            self._stacks, self._samples = {}, 0
+            self._targets.clear()
+            self._remaining_callbacks = callbacks
+            self._deadline = time.monotonic() + seconds if seconds else None
+            self._chat_id = chat_id
+            self._started = time.time()
+            self._active.set()
+        threading.Thread(target=self._run, name="profiler", daemon=True).start()
+        return True
+
+    def stop(self):
+        self._active.clear()
+
+    def enter(self):
+        if not self.active:
+            return
+        ident = threading.get_ident()
+        with self._lock:
+            self._targets[ident] = self._targets.get(ident, 0) + 1
+
+    def exit(self):
+        if not self.active:
+            return
+        ident = threading.get_ident()
+        with self._lock:
+            # 只统计采样开始后 enter 过的回调；开始前已在进行的回调结束时不计数
+            if ident not in self._targets:
+                return
+            self._targets[ident] -= 1
+            if self._targets[ident] <= 0:
+                del self._targets[ident]
+            if self._remaining_callbacks is not None:
+                self._remaining_callbacks -= 1
+                if self._remaining_callbacks <= 0:
+                    self._active.clear()
+
+    def _sample(self, frame) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    def _run(self):
+        while self._active.is_set():
+            if self._deadline is not None and time.monotonic() >= self._deadline:
+                break
+            with self._lock:
+                targets = list(self._targets)
+            if targets:
+                frames = sys._current_frames()
+                for ident in targets:
+                    frame = frames.get(ident)
+                    if frame is None:
+                        continue
+                    key = self._sample(frame)
+                    self._stacks[key] = self._stacks.get(key, 0) + 1
+                    self._samples += 1
+            time.sleep(self.interval)
+        self._active.clear()
+        self._report()
+
+    def summary(self) -> str:
+        self_counts: Dict[str, int] = {}
+        total_counts: Dict[str, int] = {}
+        for stack, count in self._stacks.items():
+            funcs = stack.split(";")
+            self_counts[funcs[-1]] = self_counts.get(funcs[-1], 0) + count
+            for func in set(funcs):
+                total_counts[func] = total_counts.get(func, 0) + count
+
+        n = max(1, self._samples)
+        lines = [
+            f"SentinelBot profile  {datetime.datetime.fromtimestamp(self._started, DISPLAY_TZ):%Y-%m-%d %H:%M:%S}",
+            f"samples: {self._samples} @ {self.interval * 1000:.1f}ms (≈ {self._samples * self.interval:.2f}s callback time)",
+            "",
+            "Top functions by self time:",
+        ]
+        for func, count in sorted(self_counts.items(), key=lambda x: -x[1])[:25]:
+            lines.append(f"{count / n * 100:6.1f}%  {count:6}  {func}")
+        lines += ["", "Top functions by inclusive time:"]
+        for func, count in sorted(total_counts.items(), key=lambda x: -x[1])[:25]:
+            lines.append(f"{count / n * 100:6.1f}%  {count:6}  {func}")
+        return "\n".join(lines)
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in sorted(self._stacks.items()))
+
+    def _report(self):
+        summary, folded = self.summary(), self.folded()
+        if not bot_instance or not self._chat_id:
+            logger.info(summary)
+            return
+        stamp = datetime.datetime.fromtimestamp(self._started, DISPLAY_TZ).strftime("%Y%m%d-%H%M%S")
+        try:
+            bot_instance.send_document(
+                chat_id=self._chat_id, document=io.BytesIO(summary.encode()),
+                filename=f"profile-{stamp}.txt", caption="🩺 Profile summary",
+            )
+            bot_instance.send_document(
+                chat_id=self._chat_id, document=io.BytesIO(folded.encode()),
+                filename=f"profile-{stamp}.folded", caption="🔥 Collapsed stacks (flamegraph.pl / speedscope)",
+            )
+        except Exception as e:
+            logger.error(f"Profile upload failed: {e}")
+
+profiler = SamplingProfiler(PROFILE_SAMPLE_INTERVAL)
+
+def profile_command(update: Update, context: CallbackContext):
+    """/profile [N | Ns | stop]：采样接下来 N 次回调（默认 10）或 N 秒"""
+    if str(update.effective_user.id) != str(ADMIN_ID):
+        update.message.reply_text("⛔️ Access Denied")
+        return
+    arg = (context.args or ["10"])[0].lower()
+    if arg == "stop":
+        profiler.stop()
+        update.message.reply_text("🩺 已停止采样，正在生成报告…")
+        return
+    try:
+        if arg.endswith("s"):
+            seconds, callbacks = float(arg[:-1]), None
+            scope = f"{seconds:g} 秒"
+        else:
+            seconds, callbacks = None, int(arg)
+            scope = f"接下来 {callbacks} 次回调"
+    except ValueError:
+        update.message.reply_text("用法：/profile [N | Ns | stop]")
+        return
+    if not profiler.start(update.effective_chat.id, callbacks=callbacks, seconds=seconds):
+        update.message.reply_text("⚠️ 已有采样在进行中，可发送 /profile stop 结束。")
+        return
+    update.message.reply_text(f"🩺 开始采样：{scope}，结束后发送报告文件。")
+
+def trace_command(update: Update, context: CallbackContext):
+    """/trace [last | list]：最近一次回调的调用明细，或最近 10 次回调的耗时"""
+    if str(update.effective_user.id) != str(ADMIN_ID):
+        update.message.reply_text("⛔️ Access Denied")
+        return
+    arg = (context.args or ["last"])[0].lower()
+    traces = list(trace_buffer)
+    if not traces:
+        update.message.reply_text("暂无追踪记录。")
+        return
+    if arg == "list":
+        text = "\n".join(f"{(t.total or 0) * 1000:8.1f}ms {len(t.spans):3} calls  {t.name}" for t in traces[-10:])
+    else:
+        text = traces[-1].render()
+    if len(text) > 3500:
+        update.message.reply_document(document=io.BytesIO(text.encode()), filename=f"trace-{arg}.txt")
+    else:
+        update.message.reply_text(f"```\n{text}\n```", parse_mode=ParseMode.MARKDOWN)
+
 # ==========================================
 # 📺 菜单与回调逻辑 (完全还原)
 # ==========================================
 
 def start_command(update: Update, context: CallbackContext):
-    show_main_menu(update, True)
+    text, markup = main_menu()
+    update.message.reply_text(text, reply_markup=markup, parse_mode=ParseMode.MARKDOWN)
 
-def show_main_menu(update, is_new_message=False):
+def main_menu() -> Tuple[str, InlineKeyboardMarkup]:
     keyboard = [
         [InlineKeyboardButton("🔐 MFA 验证码", callback_data="show_mfa")],
         [InlineKeyboardButton("📂 浏览项目服务器", callback_data="main:projects")],
         [InlineKeyboardButton("📊 查看项目汇总", callback_data="main:status")],
+        [InlineKeyboardButton("🔥 Top 热点", callback_data="main:hotspots")],
+        [InlineKeyboardButton("📉 磁盘容量预测", callback_data="main:forecast")],
         [InlineKeyboardButton("🚨 当前告警", callback_data="alerts_menu")],
         [InlineKeyboardButton("❌ 关闭", callback_data="cancel")],
     ]
@@ -411,68 +1914,126 @@ def show_main_menu(update, is_new_message=False):
         "• 查看项目健康状态\n\n"
         "🏠 *主菜单*"
     )
-    if is_new_message:
-        update.message.reply_text(text, reply_markup=markup, parse_mode=ParseMode.MARKDOWN)
-    else:
-        update.callback_query.edit_message_text(text, reply_markup=markup, parse_mode=ParseMode.MARKDOWN)
+    return text, markup
+
+def show_main_menu(query):
+    text, markup = main_menu()
+    query.edit_message_text(text, reply_markup=markup, parse_mode=ParseMode.MARKDOWN)
 
 def handle_callback(update: Update, context: CallbackContext):
     query = update.callback_query
     data = query.data
-    
+
+    key = callback_render_key(query)
+    ticket = render_registry.acquire(key, data)
+    if ticket is None:
+        query.answer("⏳ 正在刷新，请稍候…")
+        return
+    _render_local.ticket = ticket
+    _render_local.results = {}
+    trace = begin_trace(data)
+    query = CancellableQuery(TracedQuery(query))
+
+    stale_render = data.startswith(WARM_VIEW_PREFIXES) and snapshot_store.available()
+    _render_local.allow_stale = stale_render
+    _render_local.used_snapshot = False
+    refreshing = False
+
     try:
-        # MFA 相关
-        if data == "show_mfa":
-            send_mfa_message(query.edit_message_text)
-        elif data == "refresh_code":
-            try:
-                code, remaining = get_totp_info()
-                bar_length = 10
-                filled = int((remaining / 30) * bar_length)
-                bar = "▓" * filled + "░" * (bar_length - filled)
-                new_text = f"🔐 *SentinelBot MFA Verify*\n━━━━━━━━━━━━━━━━\nCode: `{code}`\nTime: {remaining}s {bar}\n━━━━━━━━━━━━━━━━"
-                query.edit_message_text(text=new_text, reply_markup=query.message.reply_markup, parse_mode=ParseMode.MARKDOWN)
-            except: pass
-            
-        # 核心导航
-        elif data == "main_menu":
-            show_main_menu(update)
-        elif data == "cancel":
-            query.edit_message_text("操作已取消。\n发送 /start 重新开始。")
-            
-        # 项目浏览
-        elif data == "main:projects":
-            show_nodes_project_selector(query)
-        elif data.startswith("project:"):
-            project = data.split(":", 1)[1]
-            handle_project(query, project)
-        elif data.startswith("nodes_of_project:"):
-            project = data.split(":", 1)[1]
-            handle_project(query, project)
-        elif data.startswith("node:"):
-            instance = data.split(":", 1)[1]
-            handle_node(query, instance)
-        elif data.startswith("rds:"):
-            parts = data.split(":", 2)
-            handle_rds_detail(query, parts[1], parts[2])
-            
-        # 状态汇总
-        elif data == "main:status":
-            show_status_project_selector(query)
-        elif data.startswith("status_project:"):
-            parts = data.split(":", 2)
-            project = parts[1]
-            filter_mode = parts[2] if len(parts) > 2 else "all"
-            handle_status_project(query, project, filter_mode)
-            
-        # 告警
-        elif data == "alerts_menu":
-            show_current_alerts(query)
-            
+        dispatch_callback(update, StaleMarkedQuery(query) if stale_render else query, data)
+        query.answer()
+        # 冷启动时先用快照渲染，再在后台拉取最新数据覆盖同一条消息
+        if stale_render and _render_local.used_snapshot:
+            refreshing = True
+            threading.Thread(
+                target=refresh_view_in_background, args=(update, query, data, key, ticket), daemon=True
+            ).start()
+    except RenderCancelled:
+        logger.info(f"Render superseded: {data}")
         query.answer()
     except Exception as e:
         logger.error(f"Callback error: {e}")
         query.answer("Error processing request")
+    finally:
+        _render_local.ticket = None
+        _render_local.results = None
+        _render_local.allow_stale = False
+        end_trace(trace)
+        if not refreshing:
+            render_registry.release(key, ticket)
+
+def dispatch_callback(update: Update, query, data: str):
+    # MFA 相关
+    if data == "show_mfa":
+        send_mfa_message(query.edit_message_text)
+    elif data == "refresh_code":
+        try:
+            code, remaining = get_totp_info()
+            bar_length = 10
+            filled = int((remaining / 30) * bar_length)
+            bar = "▓" * filled + "░" * (bar_length - filled)
+            new_text = f"🔐 *SentinelBot MFA Verify*\n━━━━━━━━━━━━━━━━\nCode: `{code}`\nTime: {remaining}s {bar}\n━━━━━━━━━━━━━━━━"
+            query.edit_message_text(text=new_text, reply_markup=query.message.reply_markup, parse_mode=ParseMode.MARKDOWN)
+        except: pass
+        
+    # 核心导航
+    elif data == "main_menu":
+        show_main_menu(query)
+    elif data == "cancel":
+        query.edit_message_text("操作已取消。\n发送 /start 重新开始。")
+        
+    # 项目浏览
+    elif data == "main:projects":
+        show_nodes_project_selector(query)
+    elif data.startswith("project:"):
+        project = data.split(":", 1)[1]
+        handle_project(query, project)
+    elif data.startswith("nodes_of_project:"):
+        project = data.split(":", 1)[1]
+        handle_project(query, project)
+    elif data.startswith("node:"):
+        handle_node(query, data.split(":", 1)[1])
+    elif data.startswith("rds:"):
+        parts = data.split(":", 2)
+        handle_rds_detail(query, parts[1], parts[2])
+        
+    # 状态汇总
+    elif data == "main:status":
+        show_status_project_selector(query)
+    elif data.startswith("status_project:"):
+        parts = data.split(":", 2)
+        project = parts[1]
+        filter_mode = parts[2] if len(parts) > 2 else "all"
+        handle_status_project(query, project, filter_mode)
+    elif data == "main:hotspots":
+        show_fleet_hotspots(query)
+    elif data == "main:forecast":
+        show_disk_forecast(query)
+    elif data.startswith("forecast:"):
+        show_disk_forecast(query, data.split(":", 1)[1])
+        
+    # 告警
+    elif data == "alerts_menu":
+        show_current_alerts(query)
+    elif data.startswith("hist:"):
+        _, token, page = data.split(":", 2)
+        show_history(query, token, int(page))
+
+def refresh_view_in_background(update: Update, query, data: str, key: Tuple[Any, Any], ticket: RenderTicket):
+    _render_local.ticket = ticket
+    _render_local.results = {}
+    trace = begin_trace(f"{data} (refresh)")
+    try:
+        dispatch_callback(update, query, data)
+    except RenderCancelled:
+        logger.info(f"Render superseded: {data}")
+    except Exception as e:
+        logger.error(f"Background refresh error: {e}")
+    finally:
+        _render_local.ticket = None
+        _render_local.results = None
+        end_trace(trace)
+        render_registry.release(key, ticket)
 
 def show_nodes_project_selector(query):
     node_projects = get_nodes_grouped_by_project()
@@ -487,7 +2048,9 @@ def show_nodes_project_selector(query):
     for proj in all_projects:
         keyboard.append([InlineKeyboardButton(f"📂 {proj}", callback_data=f"project:{proj}")])
     keyboard.append([InlineKeyboardButton("🏠 主菜单", callback_data="main_menu")])
-    query.edit_message_text("选择项目进行浏览：", reply_markup=InlineKeyboardMarkup(keyboard))
+    note = degraded_note()
+    text = "选择项目进行浏览：" + (f"\n\n{note}" if note else "")
+    query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN)
 
 def show_status_project_selector(query):
     node_projects = get_nodes_grouped_by_project()
@@ -498,13 +2061,15 @@ def show_status_project_selector(query):
     for proj in all_projects:
         keyboard.append([InlineKeyboardButton(f"📊 {proj}", callback_data=f"status_project:{proj}")])
     keyboard.append([InlineKeyboardButton("🏠 主菜单", callback_data="main_menu")])
-    query.edit_message_text("选择项目（查看汇总）：", reply_markup=InlineKeyboardMarkup(keyboard))
+    note = degraded_note()
+    text = "选择项目（查看汇总）：" + (f"\n\n{note}" if note else "")
+    query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN)
 
 def handle_project(query, project):
-    node_projects = get_nodes_grouped_by_project()
+    fleet = get_fleet()
     rds_projects = get_rds_grouped_by_project()
     
-    nodes = node_projects.get(project, [])
+    rows = fleet.rows(project)
     rds_list = rds_projects.get(project, [])
     
     lines = [
@@ -512,20 +2077,19 @@ def handle_project(query, project):
         ""
     ]
     
-    if nodes:
-        lines.append(f"🖥 *服务器节点* ({len(nodes)} 台)")
+    if rows:
+        lines.append(f"🖥 *服务器节点* ({len(rows)} 台)")
         lines.append("")
-        for node in nodes:
-            status = get_node_status(node["instance"])
-            cpu_val = status["cpu_percent"]
-            mem_pct = status.get("mem_percent")
-            disk_pct = status.get("disk_percent")
+        for i in rows:
+            cpu_val = fleet.value("cpu", i)
+            mem_pct = fleet.value("mem", i)
+            disk_pct = fleet.value("disk", i)
             
-            icon = level_emoji(max(filter(None, [cpu_val, mem_pct, disk_pct])))
-            ip = node["instance"].split(":")[0]
+            icon = level_emoji(max(filter(None, [cpu_val, mem_pct, disk_pct]), default=None))
+            ip = fleet.instances[i].split(":")[0]
             
             # 优化：别名 (IP) 格式
-            lines.append(f"{icon} *{node['alias']}* (`{ip}`)") 
+            lines.append(f"{icon} *{fleet.aliases[i]}* (`{ip}`)") 
             lines.append(f"   CPU {fmt_pct(cpu_val)} ｜ MEM {fmt_pct(mem_pct)} ｜ DISK {fmt_pct(disk_pct)}")
             lines.append("")
     else:
@@ -546,10 +2110,9 @@ def handle_project(query, project):
          lines.append("🗄 *RDS 数据库*: _无_")
          
     keyboard = []
-    for node in nodes:
-        ip = node["instance"].split(":")[0]
-        btn_text = f"{node['alias']} ({node['role']})\n{ip}"
-        keyboard.append([InlineKeyboardButton(btn_text, callback_data=f"node:{node['instance']}")])
+    for i in rows:
+        btn_text = f"{fleet.aliases[i]} ({fleet.roles[i]})\n{fleet.instances[i].split(':')[0]}"
+        keyboard.append([InlineKeyboardButton(btn_text, callback_data=f"node:{fleet.ref(i)}")])
         
     for r in rds_list:
         keyboard.append([InlineKeyboardButton(f"🗄 {r['alias']}", callback_data=f"rds:{project}:{r['id']}")])
@@ -557,29 +2120,21 @@ def handle_project(query, project):
     keyboard.append([InlineKeyboardButton("⬅ 返回项目列表", callback_data="main:projects")])
     keyboard.append([InlineKeyboardButton("🏠 主菜单", callback_data="main_menu")])
     
+    note = degraded_note()
+    if note:
+        lines.insert(1, note)
     query.edit_message_text("\n".join(lines), reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN)
 
-def handle_node(query, instance):
-    labels = get_node_labels(instance)
-    st = get_node_status(instance)
+def handle_node(query, node):
+    """:param node: 节点键（node_ref），多后端时带区域前缀"""
+    labels = get_node_labels(node)
+    st = get_node_status(node)
     ip = labels["instance"].split(":")[0]
 
     # 计算趋势（根分区 /）
-    cpu_expr = f'avg(1 - rate(node_cpu_seconds_total{{instance="{instance}",mode="idle"}}[5m])) * 100'
-    cpu_trend = get_metric_trend(cpu_expr)
-
-    mem_expr = (
-        f'(node_memory_MemTotal_bytes{{instance="{instance}"}} - node_memory_MemAvailable_bytes{{instance="{instance}"}}) '
-        f'/ node_memory_MemTotal_bytes{{instance="{instance}"}} * 100'
-    )
-    mem_trend = get_metric_trend(mem_expr)
-
-    disk_expr = (
-        f'(node_filesystem_size_bytes{{instance="{instance}",mountpoint="/",fstype!~"tmpfs|overlay|squashfs"}} '
-        f'- node_filesystem_avail_bytes{{instance="{instance}",mountpoint="/",fstype!~"tmpfs|overlay|squashfs"}}) '
-        f'/ node_filesystem_size_bytes{{instance="{instance}",mountpoint="/",fstype!~"tmpfs|overlay|squashfs"}} * 100'
-    )
-    disk_trend = get_metric_trend(disk_expr)
+    cpu_trend = get_metric_trend("node_cpu_percent", node)
+    mem_trend = get_metric_trend("node_mem_percent", node)
+    disk_trend = get_metric_trend("node_root_percent", node)
 
     cpu_emo = level_emoji(st.get("cpu_percent"))
     mem_emo = level_emoji(st.get("mem_percent"))
@@ -587,7 +2142,7 @@ def handle_node(query, instance):
     worst_disk_emo = level_emoji(st.get("disk_percent"))
 
     # 磁盘分区列表（包含 /data 等）
-    disks = get_node_disks(instance)
+    disks = get_node_disks(node)
     disk_lines: List[str] = []
     if disks:
         disk_lines.append("🟢 *磁盘分区*：")
@@ -607,7 +2162,8 @@ def handle_node(query, instance):
         f"项目：*{labels['project']}*\n"
         f"别名：`{labels['alias']}`\n"
         f"角色：`{labels['role']}`\n"
-        f"IP：`{ip}`\n"
+        + (f"区域：`{labels['region']}`\n" if labels.get("region") else "")
+        + f"IP：`{ip}`\n"
         "━━━━━━━━━━━━━━━━━━━━\n"
         f"{cpu_emo} *CPU*：{fmt_pct(st.get('cpu_percent'))} {cpu_trend}  (load1: {fmt_load(st.get('load1'))})\n"
         f"{mem_emo} *内存*：{fmt_pct(st.get('mem_percent'))} {mem_trend}\n"
@@ -620,7 +2176,7 @@ def handle_node(query, instance):
     )
 
     keyboard = [
-        [InlineKeyboardButton("🔄 刷新", callback_data=f"node:{instance}")],
+        [InlineKeyboardButton("🔄 刷新", callback_data=f"node:{node}")],
         [InlineKeyboardButton("⬅ 返回项目", callback_data=f"nodes_of_project:{labels['project']}")],
         [InlineKeyboardButton("🏠 主菜单", callback_data="main_menu")]
     ]
@@ -666,8 +2222,8 @@ def handle_rds_detail(query, project, rds_id):
     query.edit_message_text("\n".join(lines), reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN)
 
 def handle_status_project(query, project, filter_mode="all"):
-    node_projects = get_nodes_grouped_by_project()
-    nodes = node_projects.get(project, [])
+    fleet = get_fleet()
+    rows = fleet.rows(project)
     rds_projects = get_rds_grouped_by_project()
     rds_list = rds_projects.get(project, [])
     
@@ -682,29 +2238,27 @@ def handle_status_project(query, project, filter_mode="all"):
         lines.append("⚠️ *仅显示异常节点*")
         lines.append("")
     
-    if nodes:
+    if rows:
         lines.append("🌐 *服务器节点*")
         lines.append("")
         
+        # 过滤逻辑：整列扫描，只保留异常行
+        if filter_mode == "alert":
+            rows = fleet.abnormal(rows)
+        
         displayed_count = 0
-        for node in nodes:
-            instance = node["instance"]
-            st = get_node_status(instance)
-            
-            # 过滤逻辑
-            if filter_mode == "alert" and not is_node_abnormal(st):
-                continue
-            
+        for i in rows:
+            instance = fleet.instances[i]
+            st = fleet.status(i)
             displayed_count += 1
             
-            # 计算趋势
-            cpu_expr = f'avg(1 - rate(node_cpu_seconds_total{{instance="{instance}",mode="idle"}}[5m])) * 100'
-            cpu_trend = get_metric_trend(cpu_expr)
+            # 计算趋势（快照中的 5 分钟前 CPU 列，不再逐节点查询）
+            cpu_trend = fleet.trend("cpu", i)
             
             overall = overall_emoji(st["cpu_percent"], st["mem_percent"], st["disk_percent"])
             ip = instance.split(":")[0]
             
-            lines.append(f"{overall} *{node['alias']}* (`{ip}`)") 
+            lines.append(f"{overall} *{fleet.aliases[i]}* (`{ip}`)") 
             lines.append(f"   CPU {fmt_pct(st['cpu_percent'])} {cpu_trend} ｜ MEM {fmt_pct(st['mem_percent'])} ｜ DISK {fmt_pct(st['disk_percent'])}")
             lines.append("")
         
@@ -746,7 +2300,7 @@ def handle_status_project(query, project, filter_mode="all"):
     else:
         lines.append("🗄 *RDS 数据库*: _无_")
         
-    # 按钮布局：三行
+    # 按钮布局：四行
     keyboard = [
         [
             InlineKeyboardButton("📊 全部资源", callback_data=f"status_project:{project}:all"),
@@ -756,23 +2310,130 @@ def handle_status_project(query, project, filter_mode="all"):
             InlineKeyboardButton("🔄 刷新", callback_data=f"status_project:{project}:{filter_mode}"),
             InlineKeyboardButton("📂 查看服务器", callback_data=f"project:{project}")
         ],
+        [
+            InlineKeyboardButton("📉 容量预测", callback_data=f"forecast:{project}")
+        ],
         [
             InlineKeyboardButton("⬅ 返回项目选择", callback_data="main:status"),
             InlineKeyboardButton("🏠 主菜单", callback_data="main_menu")
         ]
     ]
+    note = degraded_note()
+    if note:
+        lines.insert(1, note)
+    query.edit_message_text("\n".join(lines), reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN)
+
+def show_fleet_hotspots(query):
+    hotspots = get_fleet_hotspots()
+    sections = [
+        ("cpu", "🧮 *CPU*", fmt_pct),
+        ("mem", "🧠 *内存*", fmt_pct),
+        ("disk", "💽 *最紧张分区*", fmt_pct),
+        ("load1", "⚙️ *Load1*", fmt_load),
+    ]
+
+    lines = [f"🔥 *全局 Top {HOTSPOT_TOP_N} 热点*", ""]
+    seen: List[str] = []
+    for key, title, fmt in sections:
+        rows = hotspots.get(key, [])
+        lines.append(title)
+        if not rows:
+            lines.append("   _无数据_")
+        for r in rows:
+            emo = level_emoji(r["value"]) if key != "load1" else "▫️"
+            ip = r["instance"].split(":")[0]
+            lines.append(f"{emo} {fmt(r['value'])}  *{r['alias']}* (`{ip}`) · {r['project']}")
+            if r["instance"] and r["node"] not in seen:
+                seen.append(r["node"])
+        lines.append("")
+
+    # 热点实例去重后提供直达节点详情的按钮
+    inventory_alias = {
+        r["node"]: (r["alias"], r["project"]) for rows in hotspots.values() for r in rows
+    }
+    keyboard = []
+    for node in seen:
+        alias, project = inventory_alias[node]
+        keyboard.append([InlineKeyboardButton(f"🔍 {alias} ({project})", callback_data=f"node:{node}")])
+    keyboard.append([InlineKeyboardButton("🔄 刷新", callback_data="main:hotspots")])
+    keyboard.append([InlineKeyboardButton("🏠 主菜单", callback_data="main_menu")])
+    note = degraded_note()
+    if note:
+        lines.insert(1, note)
+    query.edit_message_text("\n".join(lines), reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN)
+
+def show_disk_forecast(query, project: Optional[str] = None):
+    forecasts = get_disk_forecasts(project)
+    scope = f"项目 {project}" if project else "全局"
+
+    lines = [
+        f"📉 *{scope} 磁盘容量预测*",
+        f"_(基于最近 {FORECAST_WINDOW} 的增长趋势，{FORECAST_HORIZON_DAYS:g} 天内将写满)_",
+        ""
+    ]
+    if not forecasts:
+        lines.append(f"✅ _{FORECAST_HORIZON_DAYS:g} 天内无分区会写满_")
+
+    forecasts = sorted(forecasts, key=lambda x: x["hours_to_full"])
+    shown, hidden = forecasts[:FORECAST_TOP_N], len(forecasts) - FORECAST_TOP_N
+
+    keyboard = []
+    for f in shown:
+        hours = f["hours_to_full"]
+        emo = "🔴" if hours < 24 else ("🟠" if hours < 72 else "🟡")
+        if f["kind"] == "rds":
+            lines.append(f"{emo} 🗄 *{f['alias']}* (`{f['id']}`) · {f['project']}")
+            lines.append(f"   剩余存储约 *{fmt_duration_hours(hours)}* 后耗尽")
+            callback = f"rds:{f['project']}:{f['id']}"
+        else:
+            lines.append(f"{emo} *{f['alias']}* `{f['mountpoint']}` · {f['project']}")
+            lines.append(f"   当前 {fmt_pct(f['used_pct'])} ｜ 预计 *{fmt_duration_hours(hours)}* 后写满")
+            callback = f"node:{f['id']}"
+        lines.append("")
+        if not any(row[0].callback_data == callback for row in keyboard):
+            keyboard.append([InlineKeyboardButton(f"🔍 {f['alias']}", callback_data=callback)])
+    if hidden > 0:
+        lines.append(f"➕ _另有 {hidden} 项将在 {FORECAST_HORIZON_DAYS:g} 天内写满（仅显示最紧急的 {FORECAST_TOP_N} 项）_")
+
+    refresh = f"forecast:{project}" if project else "main:forecast"
+    keyboard.append([InlineKeyboardButton("🔄 刷新", callback_data=refresh)])
+    if project:
+        keyboard.append([InlineKeyboardButton("⬅ 返回项目汇总", callback_data=f"status_project:{project}:all")])
+    keyboard.append([InlineKeyboardButton("🏠 主菜单", callback_data="main_menu")])
+    note = degraded_note()
+    if note:
+        lines.insert(1, note)
     query.edit_message_text("\n".join(lines), reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN)
 
+def get_firing_alerts() -> List[Dict[str, Any]]:
+    """合并所有后端当前 Firing 的告警；全部后端不可用时抛出异常"""
+    cached = snapshot_lookup("alerts")
+    if cached is not None:
+        return cached
+    responses = prom_fanout("/api/v1/alerts")
+    if not responses:
+        raise RuntimeError("Prometheus 不可用")
+    firing = []
+    for backend, data in responses:
+        for a in data.get("data", {}).get("alerts", []):
+            if a.get("state") != "firing":
+                continue
+            if backend["name"]:
+                a.setdefault("labels", {}).setdefault(PROMETHEUS_BACKEND_LABEL, backend["name"])
+            firing.append(a)
+    snapshot_store.record("alerts", firing)
+    return firing
+
 def show_current_alerts(query):
-    url = PROMETHEUS_URL.rstrip("/") + "/api/v1/alerts"
     try:
-        resp = requests.get(url, timeout=3)
-        data = resp.json()
-        alerts = data.get("data", {}).get("alerts", [])
-        firing = [a for a in alerts if a.get("state") == "firing"]
+        firing = get_firing_alerts()
+        note = degraded_note()
         
-        if not firing:
-            query.edit_message_text("✅ 当前无 Firing 告警。", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🏠 返回", callback_data="main_menu")]]))
+        if not firing and not note:
+            query.edit_message_text("✅ 当前无 Firing 告警。", reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("📜 近 7 天告警历史", callback_data="hist:-:0")],
+                [InlineKeyboardButton("🏠 返回", callback_data="main_menu")],
+            ]))
             return
             
         # Group by project
@@ -782,6 +2443,10 @@ def show_current_alerts(query):
             grouped.setdefault(proj, []).append(a)
             
         lines = ["🚨 *当前告警一览*"]
+        if note:
+            lines.append(note)
+        if not firing:
+            lines.append("\n✅ 其余区域无 Firing 告警。")
         for proj, items in grouped.items():
             lines.append(f"\n*项目 {proj}*:")
             for item in items:
@@ -791,15 +2456,20 @@ def show_current_alerts(query):
                 desc = item.get("annotations", {}).get("description", "")
                 
                 icon = "❌" if sev == "critical" else "⚠️" 
-                lines.append(f"{icon} {name} ({sev})")
+                region = labels.get(PROMETHEUS_BACKEND_LABEL) if MULTI_BACKEND else None
+                lines.append(f"{icon} {name} ({sev})" + (f" · {region}" if region else ""))
                 if desc: lines.append(f"   _{desc}_")
                 
         keyboard = [
             [InlineKeyboardButton("🔄 刷新", callback_data="alerts_menu")],
+            [InlineKeyboardButton("📜 近 7 天告警历史", callback_data="hist:-:0")],
             [InlineKeyboardButton("🏠 主菜单", callback_data="main_menu")]
         ]
         query.edit_message_text("\n".join(lines), reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.MARKDOWN)
         
+    except RenderCancelled:
+        # 已被同一消息上的新操作取代：交给 handle_callback 处理，不能覆盖新视图
+        raise
     except Exception as e:
         query.edit_message_text(f"❌ Error: {str(e)}", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🏠 返回", callback_data="main_menu")]]))
 
@@ -807,42 +2477,297 @@ def show_current_alerts(query):
 # 🚒 Webhook & Scheduler (维持不变)
 # ==========================================
 
-app = Flask(__name__)
+app = None
 bot_instance = None
 
-@app.route('/webhook', methods=['POST'])
+def create_app():
+    """延迟导入 Flask：Telegram 轮询无需等待 Web 框架加载"""
+    global app
+    if app is None:
+        from flask import Flask
+        app = Flask(__name__)
+        app.add_url_rule('/webhook', view_func=webhook, methods=['POST'])
+    return app
+
 def webhook():
+    """
+    只做大小检查、JSON 解析与入队，立即返回；
+    告警的路由、格式化与发送由后台 ingest 线程完成。
+    队列满时返回 503，让 Alertmanager 稍后重试。
+    """
+    from flask import request
+    if request.content_length is not None and request.content_length > WEBHOOK_MAX_BYTES:
+        return "Payload Too Large", 413
+    raw = request.stream.read(WEBHOOK_MAX_BYTES + 1)
+    if len(raw) > WEBHOOK_MAX_BYTES:
+        return "Payload Too Large", 413
     try:
-        data = request.json
-        if data and 'alerts' in data:
-            process_alerts(data)
-        return "OK", 200
-    except Exception as e:
+        data = json_loads(raw)
+    except ValueError as e:
         logger.error(f"Webhook error: {e}")
-        return "Error", 500
+        return "Bad Request", 400
+
+    if not isinstance(data, dict) or not data.get('alerts'):
+        return "OK", 200
+    try:
+        ingest_queue.put_nowait(data)
+    except queue.Full:
+        logger.warning("Webhook ingest queue full, asking Alertmanager to retry")
+        return "Busy", 503
+    return "OK", 200
+
+ingest_queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+_ingest_threads: List[threading.Thread] = []
+
+def _ingest_worker():
+    while True:
+        data = ingest_queue.get()
+        try:
+            process_alerts(data)
+        except Exception as e:
+            logger.error(f"Webhook error: {e}")
+        finally:
+            ingest_queue.task_done()
+
+def start_ingest_workers():
+    """启动 webhook 后台处理线程（可重复调用）"""
+    while len(_ingest_threads) < WEBHOOK_WORKERS:
+        t = threading.Thread(target=_ingest_worker, name=f"ingest-{len(_ingest_threads)}", daemon=True)
+        t.start()
+        _ingest_threads.append(t)
+
+class AlertRouter:
+    """
+    预编译的告警路由（ALERT_ROUTES）
+    - 每条规则的每个 label 各编译一个正则，对该 label 的值做 fullmatch；规则内各 label 为 AND，缺失的 label 视为空串
+    - 规则按顺序匹配，命中后停止；带 "continue": true 的规则命中后继续匹配后续规则
+    - 没有命中任何不带 continue 的规则时，再追加默认群（TELEGRAM_CHAT_ID），即 continue 规则命中后默认群仍会收到
+    同一组 label 值的路由结果会被缓存。
+    """
+
+    def __init__(self, rules: List[Dict[str, Any]], default_chat: Optional[str]):
+        self.default_chat = str(default_chat) if default_chat else None
+        self.keys = sorted({k for r in rules for k in r.get("match", {})})
+        self.rules: List[Tuple[List[Tuple[str, "re.Pattern"]], List[str], bool]] = []
+        for r in rules:
+            matchers = [(k, re.compile(str(v))) for k, v in sorted(r.get("match", {}).items())]
+            chats = r.get("chat_id")
+            chats = [str(c) for c in (chats if isinstance(chats, list) else [chats]) if c]
+            self.rules.append((matchers, chats, bool(r.get("continue"))))
+        self._cache: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+
+    def route(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        values = tuple(str(labels.get(k, "")) for k in self.keys)
+        cached = self._cache.get(values)
+        if cached is not None:
+            return cached
+
+        subject = dict(zip(self.keys, values))
+        chats: List[str] = []
+        for matchers, targets, cont in self.rules:
+            if all(regex.fullmatch(subject[k]) for k, regex in matchers):
+                chats.extend(c for c in targets if c not in chats)
+                if not cont:
+                    break
+        else:
+            if self.default_chat and self.default_chat not in chats:
+                chats.append(self.default_chat)
+
+        result = tuple(chats)
+        if len(self._cache) > 4096:
+            self._cache.clear()
+        self._cache[values] = result
+        return result
+
+class RateLimiter:
+    """令牌桶限速"""
+
+    def __init__(self, rate_per_min: float, burst: int):
+        self.rate = rate_per_min / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            time.sleep((1 - self.tokens) / self.rate)
+
+class DeliveryLane:
+    """
+    单个目的地的投递通道：独立队列 + 独立线程 + 独立限速
+    某个群被 Telegram 限流时只会阻塞自己的队列，不影响发往其他群的告警。
+    """
+
+    MAX_RETRIES = 3
+
+    def __init__(self, chat_id: str):
+        self.chat_id = chat_id
+        self.queue: "queue.Queue[Tuple[str, list]]" = queue.Queue(maxsize=ALERT_LANE_QUEUE_SIZE)
+        self.limiter = RateLimiter(ALERT_LANE_RATE_PER_MIN, ALERT_LANE_BURST)
+        self.thread = threading.Thread(target=self._run, name=f"lane-{chat_id}", daemon=True)
+        self.thread.start()
+
+    def submit(self, text: str, keyboard: list):
+        try:
+            self.queue.put_nowait((text, keyboard))
+        except queue.Full:
+            logger.error(f"Delivery lane {self.chat_id} full, dropping alert message")
+
+    def _run(self):
+        while True:
+            text, keyboard = self.queue.get()
+            try:
+                self._deliver(text, keyboard)
+            finally:
+                self.queue.task_done()
+
+    def _deliver(self, text: str, keyboard: list):
+        """发送一条消息；Telegram 限流（RetryAfter）只等待、不计入重试次数"""
+        self.limiter.acquire()
+        attempt = 0
+        while True:
+            try:
+                bot_instance.send_message(
+                    chat_id=self.chat_id,
+                    text=text,
+                    parse_mode=ParseMode.MARKDOWN,
+                    reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None
+                )
+                return
+            except RetryAfter as e:
+                logger.warning(f"Lane {self.chat_id} flood-limited, retry after {e.retry_after}s")
+                time.sleep(e.retry_after)
+            except Exception as e:
+                attempt += 1
+                logger.error(f"Lane {self.chat_id} send failed ({attempt}/{self.MAX_RETRIES}): {e}")
+                if attempt >= self.MAX_RETRIES:
+                    logger.warning(f"Lane {self.chat_id} dropping alert message after {attempt} failed attempts")
+                    return
+                time.sleep(2 ** (attempt - 1))
+
+alert_router = AlertRouter(ALERT_ROUTES, CHAT_ID)
+_lanes: Dict[str, DeliveryLane] = {}
+_lanes_lock = threading.Lock()
+
+def get_delivery_lane(chat_id: str) -> DeliveryLane:
+    with _lanes_lock:
+        lane = _lanes.get(chat_id)
+        if lane is None:
+            lane = _lanes[chat_id] = DeliveryLane(chat_id)
+        return lane
+
+def _wait_queue_idle(q: queue.Queue, deadline: float) -> bool:
+    while q.unfinished_tasks:
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+def drain_delivery(timeout: float = SHUTDOWN_DRAIN_SECONDS) -> bool:
+    """等待 webhook 接入队列与所有投递通道处理完已排队的告警；超时返回 False"""
+    deadline = time.monotonic() + timeout
+    drained = _wait_queue_idle(ingest_queue, deadline)
+    with _lanes_lock:
+        lanes = list(_lanes.values())
+    for lane in lanes:
+        drained = _wait_queue_idle(lane.queue, deadline) and drained
+    return drained
 
 def process_alerts(data):
-    if not bot_instance or not CHAT_ID: return
+    if not bot_instance: return
     alerts = data.get('alerts', [])
-    firing = [a for a in alerts if a.get('status') == 'firing']
-    resolved = [a for a in alerts if a.get('status') == 'resolved']
-    
-    if firing:
-        msg, keyboard = format_alert_message(firing, "🔥 Firing")
-        bot_instance.send_message(
-            chat_id=CHAT_ID, 
-            text=msg, 
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    if resolved:
-        msg, keyboard = format_alert_message(resolved, "✅ Resolved")
-        bot_instance.send_message(
-            chat_id=CHAT_ID, 
-            text=msg, 
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+    if len(alerts) > WEBHOOK_MAX_ALERTS:
+        logger.warning(f"Webhook batch of {len(alerts)} alerts truncated to {WEBHOOK_MAX_ALERTS}")
+        alerts = alerts[:WEBHOOK_MAX_ALERTS]
+    if REPLICA_MODE:
+        alerts = dedupe_alerts(alerts)
+    try:
+        alert_history.record(alerts)
+    except Exception as e:
+        logger.error(f"Alert history write failed: {e}")
+
+    # 一次遍历：按 (目的地, 状态) 分桶，每个目的地各自投递
+    buckets: Dict[str, Dict[str, list]] = {}
+    for a in alerts:
+        status = a.get('status')
+        if status not in ('firing', 'resolved'):
+            continue
+        for chat_id in alert_router.route(a.get('labels', {})):
+            buckets.setdefault(chat_id, {"firing": [], "resolved": []})[status].append(a)
+
+    for chat_id, groups in buckets.items():
+        lane = get_delivery_lane(chat_id)
+        if groups["firing"]:
+            lane.submit(*format_alert_message(groups["firing"], "🔥 Firing"))
+        if groups["resolved"]:
+            lane.submit(*format_alert_message(groups["resolved"], "✅ Resolved"))
+
+def load_display_tz(name: str) -> datetime.tzinfo:
+    """解析显示时区；IANA 名称不可用时支持 UTC+8 / +08:00 形式，最后回退到 CST (UTC+8)"""
+    try:
+        from zoneinfo import ZoneInfo
+        return ZoneInfo(name)
+    except Exception:
+        pass
+    m = re.fullmatch(r"(?:UTC|GMT)?\s*([+-])(\d{1,2})(?::?(\d{2}))?", name.strip())
+    if m:
+        delta = datetime.timedelta(hours=int(m.group(2)), minutes=int(m.group(3) or 0))
+        return datetime.timezone(delta if m.group(1) == "+" else -delta, name.strip())
+    if name.strip().upper() in ("UTC", "GMT"):
+        return datetime.timezone.utc
+    logger.warning(f"Unknown ALERT_DISPLAY_TZ {name!r}, falling back to UTC+8")
+    return datetime.timezone(datetime.timedelta(hours=8), "CST")
+
+DISPLAY_TZ = load_display_tz(ALERT_DISPLAY_TZ)
+
+# Alertmanager 的 RFC3339 时间，小数秒可能长达纳秒
+_ALERT_TIME_RE = re.compile(
+    r"^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.\d+)?(Z|[+-]\d{2}:?\d{2})?$"
+)
+
+def _parse_rfc3339(value: str) -> Optional[datetime.datetime]:
+    m = _ALERT_TIME_RE.match(value)
+    if not m:
+        return None
+    try:
+        # 格式匹配但日期 / 时区偏移本身非法（如 2026-13-45、+25:00）
+        dt = datetime.datetime.strptime(m.group(1), "%Y-%m-%dT%H:%M:%S")
+        offset = m.group(2)
+        if offset and offset != "Z":
+            sign = 1 if offset[0] == "+" else -1
+            hours, minutes = int(offset[1:3]), int(offset[-2:])
+            tz = datetime.timezone(sign * datetime.timedelta(hours=hours, minutes=minutes))
+        else:
+            tz = datetime.timezone.utc
+    except ValueError:
+        return None
+    return dt.replace(tzinfo=tz)
+
+@functools.lru_cache(maxsize=4096)
+def format_alert_time(starts_at: str) -> str:
+    """RFC3339 -> 显示时区的 'YYYY-mm-dd HH:MM:SS TZ'，与容器本地时区无关；解析失败原样返回"""
+    dt = _parse_rfc3339(starts_at)
+    if dt is None:
+        return starts_at
+    try:
+        local = dt.astimezone(DISPLAY_TZ)
+    except OverflowError:
+        return starts_at
+    return local.strftime('%Y-%m-%d %H:%M:%S') + " " + (local.tzname() or ALERT_DISPLAY_TZ)
+
+@functools.lru_cache(maxsize=4096)
+def parse_alert_time(value: str) -> Optional[float]:
+    """RFC3339 -> Unix 秒；无法解析或 Alertmanager 未设置的时间（0001-01-01）返回 None"""
+    dt = _parse_rfc3339(value)
+    if dt is None or dt.year < 1971:
+        return None
+    return dt.timestamp()
 
 def format_alert_message(alerts_list, title):
     # 标题映射
@@ -887,26 +2812,9 @@ def format_alert_message(alerts_list, title):
         # 处理 IP：如果是 IP:Port 格式，取 IP；如果是 RDS ID，保持原样
         ip = instance.split(':')[0] if ':' in instance else instance
         
-        # ⏰ 时间优化：UTC -> 北京时间 (UTC+8)
+        # ⏰ 时间本地化：按 ALERT_DISPLAY_TZ 显示
         starts_at_str = alert.get('startsAt')
-        time_display = "Unknown"
-        if starts_at_str:
-            try:
-                # 解析 ISO8601 (例如 2023-12-13T02:54:52.04Z)
-                # 注意：简单的 string split 不够严谨，这里手动处理时区
-                # 简单起见，假设输入是 UTC，手动 +8 小时
-                if '.' in starts_at_str:
-                    dt_str = starts_at_str.split('.')[0] # 去掉毫秒
-                else:
-                    dt_str = starts_at_str.replace('Z', '')
-                    
-                dt_struct = time.strptime(dt_str, '%Y-%m-%dT%H:%M:%S')
-                ts = time.mktime(dt_struct)
-                ts_cst = ts + 8 * 3600 # +8 hours
-                time_struct_cst = time.gmtime(ts_cst) # gmtime 因为我们已经手动加了 offset
-                time_display = time.strftime('%Y-%m-%d %H:%M:%S', time_struct_cst) + " CST"
-            except Exception:
-                time_display = starts_at_str # 解析失败回退到原始字符串
+        time_display = format_alert_time(starts_at_str) if starts_at_str else "Unknown"
 
         desc = annotations.get('description') or annotations.get('summary') or '暂无说明'
         
@@ -944,7 +2852,7 @@ def format_alert_message(alerts_list, title):
         
         if instance:
             keyboard.append([
-                InlineKeyboardButton("🔍 查看节点详情", callback_data=f"node:{instance}")
+                InlineKeyboardButton("🔍 查看节点详情", callback_data=f"node:{node_ref_of(labels)}")
             ])
         keyboard.append([
             InlineKeyboardButton("📊 查看项目汇总", callback_data=f"status_project:{project}:all")
@@ -955,13 +2863,1073 @@ def format_alert_message(alerts_list, title):
     return "\n".join(lines), keyboard
 
 def run_flask():
-    make_server('0.0.0.0', 5000, app).serve_forever()
+    from werkzeug.serving import make_server
+    start_ingest_workers()
+    make_server('0.0.0.0', 5000, create_app()).serve_forever()
+
+# ==========================================
+# 📈 指标汇总与定时报表
+# ==========================================
+
+class RollupStat:
+    """
+    可增量合并的统计量：count / sum / min / max + 对数分桶直方图
+    分桶相对误差约 2.5%，用于估算 p95，内存与样本数无关。
+    """
+
+    __slots__ = ("n", "total", "min", "max", "buckets")
+    GAMMA = math.log(1.05)
+
+    def __init__(self):
+        self.n = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self.buckets: Dict[int, int] = {}
+
+    def add(self, v: float):
+        self.n += 1
+        self.total += v
+        self.min = v if self.min is None else min(self.min, v)
+        self.max = v if self.max is None else max(self.max, v)
+        b = int(math.floor(math.log(v) / self.GAMMA)) if v > 0 else -10**6
+        self.buckets[b] = self.buckets.get(b, 0) + 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.n:
+            return None
+        rank = q * (self.n - 1)
+        seen = 0
+        for b in sorted(self.buckets):
+            seen += self.buckets[b]
+            if seen > rank:
+                v = 0.0 if b == -10**6 else math.exp((b + 0.5) * self.GAMMA)
+                return min(max(v, self.min), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        return {
+            "n": self.n,
+            "min": self.min,
+            "avg": self.total / self.n if self.n else None,
+            "max": self.max,
+            "p95": self.quantile(0.95),
+        }
+
+    def to_json(self) -> Dict[str, Any]:
+        return {"n": self.n, "sum": self.total, "min": self.min, "max": self.max,
+                "b": {str(k): v for k, v in self.buckets.items()}}
+
+    @classmethod
+    def from_json(cls, d: Dict[str, Any]) -> "RollupStat":
+        st = cls()
+        st.n, st.total, st.min, st.max = d["n"], d["sum"], d["min"], d["max"]
+        st.buckets = {int(k): v for k, v in d["b"].items()}
+        return st
+
+NODE_ROLLUP_METRICS = ("cpu", "mem", "disk")
+RDS_ROLLUP_METRICS = ("cpu", "conns", "free_mem", "free_storage")
+
+def period_keys(ts: float) -> List[str]:
+    """某时刻所属的日 / 周汇总周期（按 ALERT_DISPLAY_TZ）"""
+    local = datetime.datetime.fromtimestamp(ts, DISPLAY_TZ)
+    year, week, _ = local.isocalendar()
+    return [f"day:{local:%Y-%m-%d}", f"week:{year}-W{week:02d}"]
+
+def period_bounds(period: str) -> Tuple[float, float]:
+    kind, label = period.split(":", 1)
+    if kind == "day":
+        start = datetime.datetime.strptime(label, "%Y-%m-%d")
+        end = start + datetime.timedelta(days=1)
+    else:
+        start = datetime.datetime.strptime(label + "-1", "%G-W%V-%u")
+        end = start + datetime.timedelta(days=7)
+    return (start.replace(tzinfo=DISPLAY_TZ).timestamp(), end.replace(tzinfo=DISPLAY_TZ).timestamp())
+
+class RollupStore:
+    """
+    每个周期、每个节点 / RDS 的增量统计
+    采集任务每 ROLLUP_COLLECT_SECONDS 用固定数量的全局查询取一次样本并合并，
+    报表只读汇总结果，不再按节点查询 Prometheus。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._loaded = False
+        # period -> {"samples": int, "nodes": {inst: {...}}, "rds": {id: {...}}}
+        self.periods: Dict[str, Dict[str, Any]] = {}
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                    raw = json.load(f)
+                for period, p in raw.items():
+                    for section, metrics in (("nodes", NODE_ROLLUP_METRICS), ("rds", RDS_ROLLUP_METRICS)):
+                        for entry in p[section].values():
+                            for m in metrics:
+                                if m in entry:
+                                    entry[m] = RollupStat.from_json(entry[m])
+                self.periods = raw
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"Rollup load failed: {e}")
+            self._loaded = True
+
+    def add_sample(self, ts: float, nodes: Dict[str, Dict[str, Any]], rds: Dict[str, Dict[str, Any]]):
+        """
+        :param nodes: instance -> {"project", "alias", "cpu", "mem", "disk"}
+        :param rds: rds id -> {"project", "alias", "cpu", "conns", "free_mem", "free_storage"}
+        """
+        self._ensure_loaded()
+        with self._lock:
+            for period in period_keys(ts):
+                p = self.periods.setdefault(period, {"samples": 0, "nodes": {}, "rds": {}})
+                p["samples"] += 1
+                for section, items, metrics in (("nodes", nodes, NODE_ROLLUP_METRICS),
+                                                 ("rds", rds, RDS_ROLLUP_METRICS)):
+                    for key, item in items.items():
+                        entry = p[section].setdefault(key, {})
+                        entry["project"] = item.get("project", "unknown")
+                        entry["alias"] = item.get("alias", key)
+                        for m in metrics:
+                            if item.get(m) is not None:
+                                entry.setdefault(m, RollupStat()).add(item[m])
+            self._expire(ts)
+
+    def _expire(self, now: float):
+        cutoff = now - ROLLUP_RETENTION_DAYS * 86400
+        for period in [k for k in self.periods if period_bounds(k)[1] < cutoff]:
+            del self.periods[period]
+
+    def summarize(self, period: str) -> Dict[str, Any]:
+        """在锁内把某个周期复制成普通 dict（统计量转为 summary），报表在锁外使用不受采集任务影响"""
+        self._ensure_loaded()
+        with self._lock:
+            p = self.periods.get(period) or {"samples": 0, "nodes": {}, "rds": {}}
+            out = {"samples": p["samples"]}
+            for section, metrics in (("nodes", NODE_ROLLUP_METRICS), ("rds", RDS_ROLLUP_METRICS)):
+                out[section] = {
+                    key: dict(entry, **{m: entry[m].summary() for m in metrics if m in entry})
+                    for key, entry in p[section].items()
+                }
+            return out
+
+    def save(self):
+        self._ensure_loaded()
+        with self._lock:
+            raw = {}
+            for period, p in self.periods.items():
+                out = {"samples": p["samples"], "nodes": {}, "rds": {}}
+                for section in ("nodes", "rds"):
+                    for key, entry in p[section].items():
+                        out[section][key] = {
+                            k: (v.to_json() if isinstance(v, RollupStat) else v) for k, v in entry.items()
+                        }
+                raw[period] = out
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = self.path + ".tmp"
+            with gzip.open(tmp, "wt", encoding="utf-8") as f:
+                json.dump(raw, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logger.warning(f"Rollup save failed: {e}")
+
+rollup_store = RollupStore(ROLLUP_PATH)
+
+def collect_rollup_sample():
+    """一次采样：列式节点快照（inventory + 全局向量查询）+ 一次 exporter 拉取，与节点数无关"""
+    fleet = get_fleet()
+    inventory: Dict[str, Dict[str, Any]] = {}
+    for i in fleet.rows():
+        entry = {"project": fleet.projects[fleet.project_code[i]], "alias": fleet.aliases[i]}
+        for key in ("cpu", "mem", "disk"):
+            value = fleet.value(key, i)
+            if value is not None:
+                entry[key] = value
+        inventory[fleet.ref(i)] = entry
+
+    rds: Dict[str, Dict[str, Any]] = {}
+    for project, items in get_rds_grouped_by_project().items():
+        for r in items:
+            rds[r["id"]] = dict(r, project=project)
+
+    if inventory or rds:
+        rollup_store.add_sample(time.time(), inventory, rds)
+
+def rollup_collect_job(context: CallbackContext):
+    collect_rollup_sample()
+
+def rollup_save_job(context: CallbackContext):
+    rollup_store.save()
+
+# 补齐查询结果的缓存（秒）：/report 任何人都能触发，重复生成同一周期的报表不再重复发起区间子查询
+GAP_FILL_CACHE_SECONDS = 600
+# 按实例补齐时每条查询最多带的实例数
+GAP_FILL_BATCH = 100
+gap_fill_cache = QueryResultCache(GAP_FILL_CACHE_SECONDS, max_entries=64)
+
+def fill_rollup_gaps(period: str, nodes: Dict[str, Dict[str, Any]], samples: int) -> int:
+    """
+    采样不足（覆盖率 < 50%）时用 rollup_gap_fill 模板的 *_over_time 子查询补齐，返回补齐的节点数
+    - Bot 本身停机过（总采样数不足）：整个 fleet 都缺数据，做一次全局补齐（也能发现期间新增的节点）
+    - Bot 采样正常、只有个别节点不足（新上线 / 下线 / 重启）：只查这些实例，不做全局子查询
+    """
+    step = ROLLUP_COLLECT_SECONDS
+    start, end = period_bounds(period)
+    # 对齐到采样步长：同一周期内重复生成报表得到相同的查询，可命中 gap_fill_cache
+    end = min(end, time.time() // step * step)
+    expected = max(1, int((end - start) / step))
+    gaps = {inst for inst, e in nodes.items() if e.get("cpu", {}).get("n", 0) < expected * 0.5}
+    bot_covered = samples >= expected * 0.5
+    if bot_covered and not gaps:
+        return 0
+
+    params = {"window": f"{int(end - start)}s", "step": f"{step}s"}
+    if bot_covered:
+        ordered = sorted({parse_node_ref(ref)[1] for ref in gaps})
+        exprs = [
+            promql("rollup_gap_fill", params=params, instance=ordered[i:i + GAP_FILL_BATCH])
+            for i in range(0, len(ordered), GAP_FILL_BATCH)
+        ]
+    else:
+        exprs = [promql("rollup_gap_fill", params=params)]
+
+    results: List[Tuple[Dict[str, str], float]] = []
+    for expr in exprs:
+        key = (expr, str(end))
+        cached = gap_fill_cache.get(key)
+        if cached is None:
+            cached = query_vector(expr, at=end)
+            gap_fill_cache.put(key, cached)
+        results.extend(cached)
+
+    filled: Set[str] = set()
+    for labels, value in results:
+        inst = node_ref_of(labels)
+        metric, stat = labels.get("rollup_metric"), labels.get("rollup_stat")
+        entry = nodes.get(inst)
+        if entry is None:
+            entry = nodes[inst] = {
+                "project": labels.get("project", "unknown"),
+                "alias": labels.get("alias", labels.get("instance", "")),
+            }
+            gaps.add(inst)
+        if inst in gaps:
+            entry.setdefault(metric, {"n": expected})[stat] = value
+            filled.add(inst)
+    return len(filled)
+
+def build_report(period: str) -> str:
+    """从汇总结果一次遍历生成报表文本"""
+    p = rollup_store.summarize(period)
+    nodes = p["nodes"]
+    filled = fill_rollup_gaps(period, nodes, p["samples"])
+
+    projects: Dict[str, Dict[str, Any]] = {}
+    for inst, e in nodes.items():
+        proj = projects.setdefault(e.get("project", "unknown"), {"nodes": [], "rds": []})
+        proj["nodes"].append((inst, e))
+    for rid, e in p["rds"].items():
+        proj = projects.setdefault(e.get("project", "unknown"), {"nodes": [], "rds": []})
+        proj["rds"].append((rid, e))
+
+    kind, label = period.split(":", 1)
+    title = "📋 *每日报表*" if kind == "day" else "📋 *每周报表*"
+    lines = [f"{title} `{label}`", f"节点 {len(nodes)} 台 ｜ 采样 {p['samples']} 次", ""]
+    if filled:
+        lines.insert(2, f"_({filled} 台节点采样不足，已用 Prometheus 区间查询补齐)_")
+
+    def stat(e, metric, key):
+        return (e.get(metric) or {}).get(key)
+
+    for project in sorted(projects):
+        items = projects[project]
+        lines.append(f"📂 *{project}*")
+        if items["nodes"]:
+            cpu_avgs = [v for v in (stat(e, "cpu", "avg") for _, e in items["nodes"]) if v is not None]
+            avg_cpu = sum(cpu_avgs) / len(cpu_avgs) if cpu_avgs else None
+            lines.append(f"   🖥 {len(items['nodes'])} 台 ｜ 平均 CPU {fmt_pct(avg_cpu)}")
+            for metric, name in (("cpu", "CPU p95"), ("mem", "内存 p95"), ("disk", "磁盘峰值")):
+                key = "max" if metric == "disk" else "p95"
+                ranked = sorted(
+                    ((stat(e, metric, key), e.get("alias", inst)) for inst, e in items["nodes"]
+                     if stat(e, metric, key) is not None),
+                    reverse=True,
+                )[:3]
+                if ranked:
+                    top = "，".join(f"{alias} {fmt_pct(v)}" for v, alias in ranked)
+                    lines.append(f"   {level_emoji(ranked[0][0])} {name}：{top}")
+        for rid, e in items["rds"]:
+            free_min = stat(e, "free_storage", "min")
+            lines.append(
+                f"   🗄 {e.get('alias', rid)}：CPU 峰值 {fmt_pct(stat(e, 'cpu', 'max'))} ｜ "
+                f"连接峰值 {int(stat(e, 'conns', 'max') or 0)} ｜ "
+                f"最低可用磁盘 {('%.1fG' % (free_min / 1024**3)) if free_min else '—'}"
+            )
+        lines.append("")
+    return "\n".join(lines)
+
+def previous_period(kind: str, now: Optional[float] = None) -> str:
+    now = time.time() if now is None else now
+    delta = 86400 if kind == "day" else 7 * 86400
+    return next(k for k in period_keys(now - delta) if k.startswith(kind + ":"))
+
+def send_report(period: str, chat_id: Optional[str] = None):
+    chat_id = chat_id or CHAT_ID
+    if not chat_id: return
+    text = build_report(period)
+    # Telegram 单条上限 4096 字符，按行切分
+    chunk: List[str] = []
+    for line in text.split("\n"):
+        if sum(len(l) + 1 for l in chunk) + len(line) > 3900:
+            get_delivery_lane(str(chat_id)).submit("\n".join(chunk), [])
+            chunk = []
+        chunk.append(line)
+    if chunk:
+        get_delivery_lane(str(chat_id)).submit("\n".join(chunk), [])
 
 def daily_report_job(context: CallbackContext):
-    if not CHAT_ID: return
-    node_projects = get_nodes_grouped_by_project()
-    total = sum(len(v) for v in node_projects.values())
-    context.bot.send_message(chat_id=CHAT_ID, text=f"📋 *每日晨报*\n时间: {time.strftime('%H:%M')}\n监控节点: {total}\n✅ 系统正常", parse_mode=ParseMode.MARKDOWN)
+    send_report(previous_period("day"))
+
+def weekly_report_job(context: CallbackContext):
+    send_report(previous_period("week"))
+
+def report_command(update: Update, context: CallbackContext):
+    """/report [day|week] [prev]：按需生成报表（默认今日截至目前）"""
+    args = [a.lower() for a in (context.args or [])]
+    kind = "week" if args and args[0].startswith("w") else "day"
+    if "prev" in args:
+        period = previous_period(kind)
+    else:
+        period = next(k for k in period_keys(time.time()) if k.startswith(kind + ":"))
+    send_report(period, update.effective_chat.id)
+
+# ==========================================
+# 🧭 多副本：共享状态与选主
+# ==========================================
+
+class SharedState(abc.ABC):
+    """
+    副本间共享状态的后端接口
+    - try_lease：获取或续约一个带过期时间的租约（选主）
+    - claim：批量占用去重键，返回本副本首次占用成功的键（已过期的键可再次占用）
+    - expire_claims：清理过期的去重键，由定时任务调用
+    """
+
+    @abc.abstractmethod
+    def try_lease(self, name: str, owner: str, ttl: float) -> bool:
+        ...
+
+    @abc.abstractmethod
+    def release_lease(self, name: str, owner: str):
+        ...
+
+    @abc.abstractmethod
+    def claim(self, keys: List[str], ttl: float) -> Set[str]:
+        ...
+
+    def expire_claims(self):
+        """默认无需清理（如 Redis 键自带过期时间）"""
+
+class MemorySharedState(SharedState):
+    """单进程默认实现"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._leases: Dict[str, Tuple[str, float]] = {}
+        self._claims: Dict[str, float] = {}
+
+    def try_lease(self, name, owner, ttl):
+        now = time.time()
+        with self._lock:
+            holder = self._leases.get(name)
+            if holder and holder[0] != owner and holder[1] > now:
+                return False
+            self._leases[name] = (owner, now + ttl)
+            return True
+
+    def release_lease(self, name, owner):
+        with self._lock:
+            if self._leases.get(name, ("",))[0] == owner:
+                del self._leases[name]
+
+    def claim(self, keys, ttl):
+        now = time.time()
+        with self._lock:
+            claimed = {k for k in keys if self._claims.get(k, 0.0) <= now}
+            for k in claimed:
+                self._claims[k] = now + ttl
+            return claimed
+
+    def expire_claims(self):
+        now = time.time()
+        with self._lock:
+            for k in [k for k, exp in self._claims.items() if exp <= now]:
+                del self._claims[k]
+
+class SQLiteSharedState(SharedState):
+    """
+    基于 SQLite 文件的实现（同一主机 / 共享卷上的多个副本，也用于测试）
+    通过 BEGIN IMMEDIATE 的写锁保证租约与去重的原子性。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, expires REAL)")
+            db.execute("CREATE TABLE IF NOT EXISTS claims (key TEXT PRIMARY KEY, expires REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS claims_expires ON claims (expires)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def try_lease(self, name, owner, ttl):
+        now = time.time()
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT owner, expires FROM leases WHERE name = ?", (name,)).fetchone()
+            if row and row[0] != owner and row[1] > now:
+                db.execute("COMMIT")
+                return False
+            db.execute("INSERT OR REPLACE INTO leases (name, owner, expires) VALUES (?, ?, ?)", (name, owner, now + ttl))
+            db.execute("COMMIT")
+            return True
+        finally:
+            db.close()
+
+    def release_lease(self, name, owner):
+        db = self._connect()
+        try:
+            db.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+        finally:
+            db.close()
+
+    def claim(self, keys, ttl):
+        now = time.time()
+        claimed = set()
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            for k in keys:
+                # 新键插入；已存在但过期的键视为可再次占用
+                cur = db.execute(
+                    "INSERT INTO claims (key, expires) VALUES (?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET expires = excluded.expires WHERE claims.expires <= ?",
+                    (k, now + ttl, now),
+                )
+                if cur.rowcount:
+                    claimed.add(k)
+            db.execute("COMMIT")
+        finally:
+            db.close()
+        return claimed
+
+    def expire_claims(self):
+        db = self._connect()
+        try:
+            db.execute("DELETE FROM claims WHERE expires <= ?", (time.time(),))
+        finally:
+            db.close()
+
+class RedisSharedState(SharedState):
+    """基于 Redis 的实现（跨主机部署）；需要额外安装 redis 包"""
+
+    _RENEW = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) end return 0"
+    _RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self, url: str):
+        import redis  # 可选依赖，仅在使用 Redis 后端时需要
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def try_lease(self, name, owner, ttl):
+        key, ms = f"sentinel:lease:{name}", int(ttl * 1000)
+        if self.client.set(key, owner, nx=True, px=ms):
+            return True
+        return bool(self.client.eval(self._RENEW, 1, key, owner, ms))
+
+    def release_lease(self, name, owner):
+        self.client.eval(self._RELEASE, 1, f"sentinel:lease:{name}", owner)
+
+    def claim(self, keys, ttl):
+        pipe = self.client.pipeline(transaction=False)
+        for k in keys:
+            pipe.set(f"sentinel:claim:{k}", REPLICA_ID, nx=True, ex=max(1, int(ttl)))
+        return {k for k, ok in zip(keys, pipe.execute()) if ok}
+
+SHARED_STATE_BACKENDS = {
+    "sqlite": lambda url: SQLiteSharedState(url[len("sqlite:///"):]),
+    "redis": RedisSharedState,
+    "rediss": RedisSharedState,
+}
+
+def open_shared_state(url: str) -> SharedState:
+    if not url:
+        return MemorySharedState()
+    scheme = url.split(":", 1)[0]
+    if scheme not in SHARED_STATE_BACKENDS:
+        raise ValueError(f"Unsupported SHARED_STATE_URL scheme: {scheme}")
+    return SHARED_STATE_BACKENDS[scheme](url)
+
+REPLICA_MODE = bool(SHARED_STATE_URL)
+shared_state = open_shared_state(SHARED_STATE_URL)
+
+def alert_dedupe_key(alert: Dict[str, Any]) -> str:
+    """同一告警的同一次状态变化对应同一个键（与接收副本无关）"""
+    fingerprint = alert.get("fingerprint") or hashlib.sha1(
+        json.dumps(alert.get("labels", {}), sort_keys=True).encode()
+    ).hexdigest()
+    return f"{fingerprint}:{alert.get('status')}:{alert.get('startsAt')}:{alert.get('endsAt') if alert.get('status') == 'resolved' else ''}"
+
+def dedupe_alerts(alerts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """多副本时同一告警可能被投递到多个副本，只保留本副本首次占用的告警"""
+    keys = [alert_dedupe_key(a) for a in alerts]
+    try:
+        claimed = shared_state.claim(list(set(keys)), ALERT_DEDUPE_SECONDS)
+    except Exception as e:
+        # 共享状态不可用时宁可重复也不丢告警
+        logger.error(f"Alert dedupe failed, delivering without dedupe: {e}")
+        return alerts
+    kept, seen = [], set()
+    for a, k in zip(alerts, keys):
+        if k in claimed and k not in seen:
+            seen.add(k)
+            kept.append(a)
+    return kept
+
+class LeaderElector:
+    """
+    租约选主：每 ttl/3 续约一次
+    - 成为 leader 时调用 on_elected（开始 Telegram 轮询）
+    - 租约丢失（被其他副本接管或共享状态长时间不可用）时调用 on_lost
+    """
+
+    def __init__(self, state: SharedState, name: str, owner: str, ttl: float, on_elected, on_lost):
+        self.state, self.name, self.owner, self.ttl = state, name, owner, ttl
+        self.on_elected, self.on_lost = on_elected, on_lost
+        self.is_leader = False
+        self._valid_until = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="leader-elector", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.is_leader:
+            try:
+                self.state.release_lease(self.name, self.owner)
+            except Exception as e:
+                logger.warning(f"Lease release failed: {e}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                held = self.state.try_lease(self.name, self.owner, self.ttl)
+                if held:
+                    self._valid_until = time.monotonic() + self.ttl
+            except Exception as e:
+                logger.warning(f"Lease renewal failed: {e}")
+                held = self.is_leader and time.monotonic() < self._valid_until
+
+            if held and not self.is_leader:
+                self.is_leader = True
+                logger.info(f"Replica {self.owner} elected leader")
+                self.on_elected()
+            elif not held and self.is_leader:
+                self.is_leader = False
+                logger.error(f"Replica {self.owner} lost leadership")
+                self.on_lost()
+            self._stop.wait(self.ttl / 3)
+
+leader_elector: Optional[LeaderElector] = None
+
+def leader_only(job):
+    """仅由 leader 执行的定时任务（报表等）；单进程模式总是执行"""
+    @functools.wraps(job)
+    def wrapper(context: CallbackContext):
+        if leader_elector is None or leader_elector.is_leader:
+            job(context)
+    return wrapper
+
+# ==========================================
+# 📜 告警历史（追加写日志）
+# ==========================================
+
+class AlertHistory:
+    """
+    Webhook 告警状态变化的本地追加写日志
+    - 段文件 {writer}-{毫秒}.log：每行一条紧凑 JSON 事件
+    - 同名 .idx：定长索引记录（接收时间、行偏移、fingerprint / alertname / project / 主机的 crc32、
+      状态、恢复耗时），查询和统计只扫描索引，翻页时才按偏移读取对应的行
+    - 每个副本写自己的段，查询时按时间倒序归并所有段；单段超过 segment_bytes 后滚动
+    - 索引里只有 crc32，按字符串字段筛选时命中的记录会再读出日志行核对真实值，避免哈希碰撞
+    - 状态变化去重键：多副本时放在共享状态里，单进程时放在段目录下的 SQLite 文件，重启后仍有效
+    索引按块倒序读取，内存占用与历史总量无关。
+    """
+
+    INDEX = struct.Struct("<dIIIIIBf")
+    CHUNK_RECORDS = 4096
+    # 同一告警同一次状态变化在这段时间内只记一次（Alertmanager 会按 repeat_interval 重发 firing）
+    TRANSITION_TTL = 7 * 86400
+    FIELDS = ("project", "alertname", "instance", "status")
+
+    def __init__(self, directory: str, writer: str, segment_bytes: int, retention_days: int,
+                 claims: Optional[SharedState] = None):
+        self.directory = directory
+        self.writer = re.sub(r"[^A-Za-z0-9_.]", "_", writer)
+        self.segment_bytes = segment_bytes
+        self.retention = retention_days * 86400
+        self._lock = threading.Lock()
+        self._log = None
+        self._idx = None
+        self._claims = claims
+
+    def claims(self) -> SharedState:
+        """去重键存储；未指定时首次使用才创建本地 SQLite 文件"""
+        if self._claims is None:
+            with self._lock:
+                if self._claims is None:
+                    self._claims = SQLiteSharedState(os.path.join(self.directory, "transitions.db"))
+        return self._claims
+
+    def expire_claims(self):
+        self.claims().expire_claims()
+
+    @staticmethod
+    def _hash(value: Any) -> int:
+        return zlib.crc32(str(value or "").encode())
+
+    @staticmethod
+    def _host(instance: str) -> str:
+        return instance.split(":")[0] if ":" in instance else instance
+
+    # ---------- 写入 ----------
+
+    def _rotate(self):
+        for f in (self._log, self._idx):
+            if f:
+                f.close()
+        os.makedirs(self.directory, exist_ok=True)
+        prefix = os.path.join(self.directory, f"{self.writer}-{int(time.time() * 1000)}")
+        self._log = open(prefix + ".log", "ab")
+        self._idx = open(prefix + ".idx", "ab")
+        self._expire()
+
+    def _segment_end(self, prefix: str) -> Optional[float]:
+        """段内最后一条索引记录的时间；空段返回 None"""
+        size = self.INDEX.size
+        try:
+            with open(prefix + ".idx", "rb") as f:
+                count = os.fstat(f.fileno()).st_size // size
+                if not count:
+                    return None
+                f.seek((count - 1) * size)
+                return self.INDEX.unpack(f.read(size))[0]
+        except FileNotFoundError:
+            return None
+
+    def _expire(self):
+        """
+        删除所有 writer（含已退出的进程 / 其他副本）超过保留期的段
+        段的结束时间取其最后一条索引记录的时间；本进程正在写的段不删除
+        """
+        cutoff = time.time() - self.retention
+        current = self._log.name[:-len(".log")] if self._log else None
+        for start, _, prefix in self._segments():
+            if start >= cutoff:
+                break
+            if prefix == current:
+                continue
+            end = self._segment_end(prefix)
+            if end is not None and end >= cutoff:
+                continue
+            for ext in (".log", ".idx"):
+                try:
+                    os.remove(prefix + ext)
+                except FileNotFoundError:
+                    pass
+
+    def expire(self):
+        """定时任务入口：低流量时段文件可能很久不滚动，不能只在滚动时清理"""
+        with self._lock:
+            self._expire()
+
+    def record(self, alerts: List[Dict[str, Any]]):
+        """记录一批 webhook 告警中的状态变化"""
+        keys = {}
+        for a in alerts:
+            if a.get("status") in ("firing", "resolved"):
+                fingerprint = a.get("fingerprint") or alert_dedupe_key(a).split(":", 1)[0]
+                keys[f"hist:{fingerprint}:{a['status']}:{a.get('startsAt')}"] = (fingerprint, a)
+        if not keys:
+            return
+        try:
+            fresh = self.claims().claim(list(keys), self.TRANSITION_TTL)
+        except Exception as e:
+            logger.error(f"History dedupe failed, recording anyway: {e}")
+            fresh = set(keys)
+
+        now = time.time()
+        with self._lock:
+            # 当前段可能已被其他副本按保留期删除（长时间无告警时），此时换一个新段
+            if (self._log is None or self._log.tell() >= self.segment_bytes
+                    or not os.path.exists(self._log.name)):
+                self._rotate()
+            for key, (fingerprint, a) in keys.items():
+                if key not in fresh:
+                    continue
+                labels = a.get("labels", {})
+                annotations = a.get("annotations", {})
+                instance = labels.get("instance") or labels.get("dbinstance_identifier") or ""
+                status = a["status"]
+                duration = 0.0
+                if status == "resolved":
+                    started, ended = parse_alert_time(a.get("startsAt") or ""), parse_alert_time(a.get("endsAt") or "")
+                    if started and ended and ended >= started:
+                        duration = ended - started
+                event = {
+                    "t": round(now, 3), "s": status, "fp": fingerprint,
+                    "a": labels.get("alertname", ""), "p": labels.get("project", ""),
+                    "i": instance, "n": labels.get("alias", ""), "sev": labels.get("severity", ""),
+                    "st": a.get("startsAt", ""), "d": (annotations.get("description") or annotations.get("summary") or "")[:300],
+                }
+                if status == "resolved":
+                    event["en"] = a.get("endsAt", "")
+                offset = self._log.tell()
+                self._log.write(json.dumps(event, ensure_ascii=False, separators=(",", ":")).encode() + b"\n")
+                self._idx.write(self.INDEX.pack(
+                    now, offset, self._hash(fingerprint), self._hash(event["a"]), self._hash(event["p"]),
+                    self._hash(self._host(instance)), 1 if status == "firing" else 0, duration,
+                ))
+            self._log.flush()
+            self._idx.flush()
+
+    # ---------- 查询 ----------
+
+    def _segments(self) -> List[Tuple[float, str, str]]:
+        """[(起始时间, writer, 路径前缀)]，按起始时间升序"""
+        segments = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        for name in names:
+            if not name.endswith(".idx"):
+                continue
+            writer, _, ms = name[:-4].rpartition("-")
+            if writer and ms.isdigit():
+                segments.append((int(ms) / 1000.0, writer, os.path.join(self.directory, name[:-4])))
+        segments.sort()
+        return segments
+
+    def _scan_segment(self, prefix: str, since: float, until: float,
+                      match: Dict[int, int]) -> Any:
+        """倒序产出 (ts, prefix, 索引记录)；match 为 {记录字段下标: 期望值}"""
+        size = self.INDEX.size
+        fields = sorted(match)
+        # 多个字段一次 itemgetter 取出后整体比较
+        getter = operator.itemgetter(*fields) if fields else None
+        expected = tuple(match[i] for i in fields) if len(fields) > 1 else (match[fields[0]] if fields else None)
+        try:
+            f = open(prefix + ".idx", "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            end = os.fstat(f.fileno()).st_size // size
+            while end > 0:
+                start = max(0, end - self.CHUNK_RECORDS)
+                f.seek(start * size)
+                records = list(self.INDEX.iter_unpack(f.read((end - start) * size)))
+                records.reverse()
+                done = records[-1][0] < since
+                for rec in records:
+                    if rec[0] > until:
+                        continue
+                    if rec[0] < since:
+                        break
+                    if getter is None or getter(rec) == expected:
+                        yield (rec[0], prefix, rec)
+                if done:
+                    return
+                end = start
+
+    def _compile_filters(self, filters: Dict[str, str]) -> Dict[int, int]:
+        match = {}
+        if filters.get("alertname"):
+            match[3] = self._hash(filters["alertname"])
+        if filters.get("project"):
+            match[4] = self._hash(filters["project"])
+        if filters.get("instance"):
+            match[5] = self._hash(self._host(filters["instance"]))
+        if filters.get("status"):
+            match[6] = 1 if filters["status"] == "firing" else 0
+        return match
+
+    def _event_check(self, filters: Dict[str, str]):
+        """按日志行真实值核对字符串筛选条件；没有字符串条件（索引比较已精确）时返回 None"""
+        expected = [(key, filters[name]) for name, key in (("alertname", "a"), ("project", "p")) if filters.get(name)]
+        host = self._host(filters["instance"]) if filters.get("instance") else None
+        if not expected and host is None:
+            return None
+
+        def check(event: Dict[str, Any]) -> bool:
+            if host is not None and self._host(event.get("i", "")) != host:
+                return False
+            return all(event.get(key) == value for key, value in expected)
+        return check
+
+    def scan(self, filters: Dict[str, str], since: float = 0.0, until: float = float("inf"),
+             ordered: bool = True):
+        """
+        流式产出匹配的索引记录
+        :param ordered: True 时各段之间做 k 路归并、严格按时间倒序；统计时不需要顺序，逐段串联更快
+        """
+        match = self._compile_filters(filters)
+        segments = self._segments()
+        # 同一 writer 的下一段起始时间即本段结束时间的上界，用于跳过整段
+        bound: Dict[str, float] = {}
+        streams = []
+        for start, writer, prefix in reversed(segments):
+            seg_end = bound.get(writer, float("inf"))
+            bound[writer] = start
+            if start > until or seg_end < since:
+                continue
+            streams.append(self._scan_segment(prefix, since, until, match))
+        if not ordered:
+            return itertools.chain.from_iterable(streams)
+        return heapq.merge(*streams, key=operator.itemgetter(0), reverse=True)
+
+    def read_event(self, prefix: str, offset: int, handles: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        f = handles.get(prefix)
+        if f is None:
+            f = handles[prefix] = open(prefix + ".log", "rb")
+        # pread 只读这一行附近的字节；倒序随机访问时 seek + readline 每次都会重新填满缓冲区
+        fd, chunk, line = f.fileno(), 2048, b""
+        while True:
+            data = os.pread(fd, chunk, offset + len(line))
+            end = data.find(b"\n")
+            if end >= 0 or not data:
+                line += data if end < 0 else data[:end]
+                break
+            line += data
+        try:
+            return json_loads(line)
+        except Exception:
+            return None
+
+    def stats(self, filters: Dict[str, str], since: float, until: float = float("inf")) -> Dict[str, Any]:
+        """
+        触发 / 恢复次数、MTTR 分布、按告警类型计数
+        只有状态筛选时只扫描索引；有字符串筛选时命中的记录逐条读日志行核对
+        """
+        firing = resolved = 0
+        mttr = RollupStat()
+        by_alertname: Dict[int, List[Any]] = {}
+        check = self._event_check(filters)
+        names: List[Tuple[str, int]] = []
+        handles: Dict[str, Any] = {}
+        try:
+            for _, prefix, rec in self.scan(filters, since, until, ordered=False):
+                if check is not None:
+                    event = self.read_event(prefix, rec[1], handles)
+                    if event is None or not check(event):
+                        continue
+                if rec[6]:
+                    firing += 1
+                    entry = by_alertname.get(rec[3])
+                    if entry is None:
+                        by_alertname[rec[3]] = [1, prefix, rec[1]]
+                    else:
+                        entry[0] += 1
+                else:
+                    resolved += 1
+                    if rec[7] > 0:
+                        mttr.add(rec[7])
+            # 每种告警类型只读一行日志取名字
+            for count, prefix, offset in sorted(by_alertname.values(), key=lambda x: -x[0])[:5]:
+                event = self.read_event(prefix, offset, handles) or {}
+                names.append((event.get("a") or "?", count))
+        finally:
+            for f in handles.values():
+                f.close()
+        return {"firing": firing, "resolved": resolved, "mttr": mttr, "top_alertnames": names}
+
+    def page(self, filters: Dict[str, str], since: float, page: int, size: int) -> List[Dict[str, Any]]:
+        """
+        第 page 页（从 0 开始，最新在前）的事件
+        没有字符串筛选时只读取这一页对应的日志行；否则前面各页的候选行也要读出核对
+        """
+        events: List[Dict[str, Any]] = []
+        handles: Dict[str, Any] = {}
+        check = self._event_check(filters)
+        skip = page * size
+        try:
+            for _, prefix, rec in self.scan(filters, since):
+                if len(events) >= size:
+                    break
+                if check is None and skip > 0:
+                    skip -= 1
+                    continue
+                event = self.read_event(prefix, rec[1], handles)
+                if event is None or (check is not None and not check(event)):
+                    continue
+                if skip > 0:
+                    skip -= 1
+                    continue
+                event["dur"] = rec[7]
+                events.append(event)
+        finally:
+            for f in handles.values():
+                f.close()
+        return events
+
+alert_history = AlertHistory(
+    HISTORY_DIR, REPLICA_ID if REPLICA_MODE else "local", HISTORY_SEGMENT_BYTES, HISTORY_RETENTION_DAYS,
+    claims=shared_state if REPLICA_MODE else None,
+)
+
+def claims_expire_job(context: CallbackContext):
+    """定时清理过期的去重键（webhook 去重与告警历史状态变化）"""
+    for store in (shared_state, alert_history):
+        try:
+            store.expire_claims()
+        except Exception as e:
+            logger.warning(f"Claim expiry failed: {e}")
+
+def history_expire_job(context: CallbackContext):
+    """按 HISTORY_RETENTION_DAYS 删除过期的历史段（多副本共享目录时任一副本删除即可）"""
+    try:
+        alert_history.expire()
+    except Exception as e:
+        logger.warning(f"History expiry failed: {e}")
+
+# 翻页按钮的 callback_data 有 64 字节限制：查询条件放在内存里，按钮只带短 token
+_history_queries: "collections.OrderedDict[str, Tuple[Dict[str, str], str]]" = collections.OrderedDict()
+_history_queries_lock = threading.Lock()
+
+def parse_history_args(args: List[str]) -> Tuple[Dict[str, str], str]:
+    """key=value 形式的筛选条件 + since=（24h / 7d / day / week / all），默认 7d"""
+    filters: Dict[str, str] = {}
+    since = "7d"
+    for arg in args:
+        key, sep, value = arg.partition("=")
+        key = key.lower()
+        if not sep or not value:
+            raise ValueError(arg)
+        if key == "since":
+            since = value.lower()
+        elif key in AlertHistory.FIELDS:
+            filters[key] = value
+        else:
+            raise ValueError(arg)
+    history_since(since)
+    if filters.get("status") not in (None, "firing", "resolved"):
+        raise ValueError(filters["status"])
+    return filters, since
+
+def history_since(since: str) -> float:
+    if since == "all":
+        return 0.0
+    if since in ("day", "today", "week"):
+        kind = "week" if since == "week" else "day"
+        period = next(k for k in period_keys(time.time()) if k.startswith(kind + ":"))
+        return period_bounds(period)[0]
+    m = re.fullmatch(r"(\d+)([hd])", since)
+    if not m:
+        raise ValueError(since)
+    return time.time() - int(m.group(1)) * (3600 if m.group(2) == "h" else 86400)
+
+def fmt_duration_seconds(seconds: Optional[float]) -> str:
+    if seconds is None: return "—"
+    if seconds < 3600: return "%dm" % max(1, round(seconds / 60))
+    if seconds < 86400: return "%dh%02dm" % (seconds // 3600, seconds % 3600 // 60)
+    return "%dd%02dh" % (seconds // 86400, seconds % 86400 // 3600)
+
+def render_history(filters: Dict[str, str], since: str, page: int, token: str) -> Tuple[str, InlineKeyboardMarkup]:
+    since_ts = history_since(since)
+    st = alert_history.stats(filters, since_ts)
+    total = st["firing"] + st["resolved"]
+    pages = max(1, math.ceil(total / HISTORY_PAGE_SIZE))
+    page = min(max(0, page), pages - 1)
+    since_label = {"all": "全部", "day": "今日", "today": "今日", "week": "本周"}.get(since, f"近 {since}")
+
+    lines = [f"📜 *告警历史* · {since_label}"]
+    if filters:
+        lines.append("筛选：" + " ".join(f"`{k}={v}`" for k, v in filters.items()))
+    lines.append("━━━━━━━━━━━━━━━━")
+    lines.append(f"🔥 触发 *{st['firing']}* 次 ｜ ✅ 恢复 *{st['resolved']}* 次")
+    mttr = st["mttr"]
+    if mttr.n:
+        lines.append(
+            f"⏱ MTTR：平均 {fmt_duration_seconds(mttr.total / mttr.n)} ｜ P50 {fmt_duration_seconds(mttr.quantile(0.5))}"
+            f" ｜ P90 {fmt_duration_seconds(mttr.quantile(0.9))} ｜ 最长 {fmt_duration_seconds(mttr.max)}"
+        )
+    if "alertname" not in filters and st["top_alertnames"]:
+        lines.append("📊 触发最多：" + "，".join(f"`{name}` {count}" for name, count in st["top_alertnames"]))
+    lines.append("━━━━━━━━━━━━━━━━")
+
+    events = alert_history.page(filters, since_ts, page, HISTORY_PAGE_SIZE) if total else []
+    if not events:
+        lines.append("_无记录_")
+    for e in events:
+        when = datetime.datetime.fromtimestamp(e["t"], DISPLAY_TZ).strftime("%m-%d %H:%M")
+        who = e.get("n") or AlertHistory._host(e.get("i", "")) or "?"
+        line = f"{'🔥' if e['s'] == 'firing' else '✅'} {when} `{e.get('a') or '?'}` · `{who}` · {e.get('p') or '-'}"
+        if e["s"] == "resolved" and e.get("dur"):
+            line += f" · 用时 {fmt_duration_seconds(e['dur'])}"
+        lines.append(line)
+    lines.append("")
+    lines.append(f"第 {page + 1}/{pages} 页")
+
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("⬅ 上一页", callback_data=f"hist:{token}:{page - 1}"))
+    if page + 1 < pages:
+        nav.append(InlineKeyboardButton("下一页 ➡", callback_data=f"hist:{token}:{page + 1}"))
+    keyboard = [nav] if nav else []
+    keyboard.append([InlineKeyboardButton("🔄 刷新", callback_data=f"hist:{token}:{page}")])
+    keyboard.append([InlineKeyboardButton("🏠 主菜单", callback_data="main_menu")])
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+def history_command(update: Update, context: CallbackContext):
+    """/history [project=..] [alertname=..] [instance=..] [status=firing|resolved] [since=7d|24h|day|week|all]"""
+    try:
+        filters, since = parse_history_args(context.args or [])
+    except ValueError as e:
+        update.message.reply_text(
+            f"无法识别：{e}\n用法：/history [project=X] [alertname=Y] [instance=IP] "
+            "[status=firing|resolved] [since=7d|24h|day|week|all]"
+        )
+        return
+    token = hashlib.sha1(json.dumps([filters, since], sort_keys=True).encode()).hexdigest()[:10]
+    with _history_queries_lock:
+        _history_queries[token] = (filters, since)
+        _history_queries.move_to_end(token)
+        while len(_history_queries) > 256:
+            _history_queries.popitem(last=False)
+    text, markup = render_history(filters, since, 0, token)
+    update.message.reply_text(text, reply_markup=markup, parse_mode=ParseMode.MARKDOWN)
+
+def show_history(query, token: str, page: int):
+    # "-" 为默认查询（近 7 天全部告警），供告警页按钮使用
+    saved = ({}, "7d") if token == "-" else _history_queries.get(token)
+    if saved is None:
+        query.edit_message_text("⌛️ 查询已过期，请重新发送 /history。")
+        return
+    text, markup = render_history(saved[0], saved[1], page, token)
+    query.edit_message_text(text, reply_markup=markup, parse_mode=ParseMode.MARKDOWN)
 
 # ==========================================
 # 🚀 启动
@@ -979,12 +3947,62 @@ if __name__ == '__main__':
     dp.add_handler(CommandHandler("start", start_command))
     dp.add_handler(CommandHandler("mfa", mfa_command)) # 别名 mfa
     dp.add_handler(CommandHandler("FA", mfa_command))
-    dp.add_handler(CallbackQueryHandler(handle_callback))
+    dp.add_handler(CommandHandler("find", find_command))
+    dp.add_handler(CommandHandler("report", report_command, run_async=True))
+    dp.add_handler(CommandHandler("history", history_command, run_async=True))
+    dp.add_handler(CommandHandler("profile", profile_command))
+    dp.add_handler(CommandHandler("trace", trace_command))
+    dp.add_handler(InlineQueryHandler(inline_find))
+    # run_async：渲染并发执行，重复点击由 render_registry 合并
+    dp.add_handler(CallbackQueryHandler(handle_callback, run_async=True))
     
-    # 已关闭每日晨报（按你的要求）
-    # updater.job_queue.run_daily(daily_report_job, time=datetime.time(hour=0, minute=0, second=0))
+    # 定时保存启动快照（多副本时仅 leader 执行，避免多个副本写同一文件）
+    updater.job_queue.run_repeating(leader_only(snapshot_save_job), interval=SNAPSHOT_INTERVAL_SECONDS, first=SNAPSHOT_INTERVAL_SECONDS)
+
+    # 保持搜索索引新鲜（只有 leader 处理 /find 与内联查询）
+    updater.job_queue.run_repeating(leader_only(refresh_inventory_job), interval=INVENTORY_REFRESH_SECONDS, first=0)
+
+    # 报表：持续采集汇总；日报 / 周报默认关闭，由环境变量开启（多副本时仅 leader 执行）
+    updater.job_queue.run_repeating(leader_only(rollup_collect_job), interval=ROLLUP_COLLECT_SECONDS, first=30)
+    updater.job_queue.run_repeating(leader_only(rollup_save_job), interval=SNAPSHOT_INTERVAL_SECONDS, first=SNAPSHOT_INTERVAL_SECONDS)
+    # 去重键不在占用时清理，由这里定时删除过期记录
+    updater.job_queue.run_repeating(claims_expire_job, interval=600, first=600)
+    updater.job_queue.run_repeating(history_expire_job, interval=3600, first=60)
+    report_hour, report_minute = (int(x) for x in REPORT_TIME.split(":"))
+    report_at = datetime.time(hour=report_hour, minute=report_minute, tzinfo=DISPLAY_TZ)
+    if DAILY_REPORT_ENABLED:
+        updater.job_queue.run_daily(leader_only(daily_report_job), time=report_at)
+    if WEEKLY_REPORT_ENABLED:
+        updater.job_queue.run_daily(leader_only(weekly_report_job), time=report_at, days=(0,))
     
-    logger.info("Bot Started.")
-    updater.start_polling()
+    lease_lost = threading.Event()
+    if REPLICA_MODE:
+        # 多副本：所有副本都接收 /webhook（按 fingerprint 去重），只有 leader 轮询 Telegram。
+        # 租约丢失时停止轮询并让 idle() 返回，走下面的正常退出流程（清空队列、保存快照），
+        # 再以非零状态退出，由容器编排以 follower 身份重启，避免两个副本同时 getUpdates。
+        def on_lost():
+            lease_lost.set()
+            leader_elector.stop()
+            updater.stop()
+            updater.is_idle = False
+
+        updater.job_queue.start()
+        leader_elector = LeaderElector(
+            shared_state, "telegram-leader", REPLICA_ID, LEADER_LEASE_SECONDS,
+            on_elected=updater.start_polling, on_lost=on_lost,
+        )
+        leader_elector.start()
+        logger.info(f"Bot Started (replica {REPLICA_ID}).")
+    else:
+        logger.info("Bot Started.")
+        updater.start_polling()
     updater.idle()
+    if leader_elector is not None:
+        leader_elector.stop()
+    if not drain_delivery():
+        logger.warning(f"Delivery queues not drained within {SHUTDOWN_DRAIN_SECONDS:g}s, exiting anyway")
+    snapshot_store.save()
+    rollup_store.save()
+    if lease_lost.is_set():
+        sys.exit(3)
 
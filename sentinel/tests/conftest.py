@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# 导入 sentinel 前准备环境：数据文件写到临时目录，不连接任何外部服务
+_data_dir = tempfile.mkdtemp(prefix="sentinel-test-")
+os.environ.setdefault("HISTORY_DIR", os.path.join(_data_dir, "history"))
+os.environ.setdefault("SNAPSHOT_PATH", os.path.join(_data_dir, "snapshot.json.gz"))
+os.environ.setdefault("ROLLUP_PATH", os.path.join(_data_dir, "rollups.json.gz"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,20 @@
+import pytest
+
+import sentinel
+
+
+@pytest.mark.parametrize("value", [
+    "2026-13-45T00:00:00Z",       # 月 / 日越界
+    "2026-02-29T10:00:00Z",       # 非闰年
+    "2026-01-01T00:00:00+25:00",  # 时区偏移越界
+    "not a time",
+])
+def test_invalid_times(value):
+    assert sentinel.format_alert_time(value) == value
+    assert sentinel.parse_alert_time(value) is None
+
+
+def test_valid_time():
+    assert sentinel.parse_alert_time("2026-01-01T00:00:00Z") == 1767225600.0
+    assert sentinel.parse_alert_time("2026-01-01T08:00:00.123456789+08:00") == 1767225600.0
+    assert sentinel.parse_alert_time("0001-01-01T00:00:00Z") is None
@@ -0,0 +1,133 @@
+import threading
+
+import pytest
+
+import sentinel
+
+BACKENDS = [{"name": "east", "url": "http://east"}, {"name": "west", "url": "http://west"}]
+
+
+@pytest.fixture
+def multi(monkeypatch):
+    """两个区域后端；_prom_get 由各测试替换"""
+    monkeypatch.setattr(sentinel, "PROMETHEUS_BACKENDS", BACKENDS)
+    monkeypatch.setattr(sentinel, "MULTI_BACKEND", True)
+    monkeypatch.setattr(sentinel, "_backend_names", {"east", "west"})
+    monkeypatch.setattr(sentinel, "_backend_down_until", {})
+    monkeypatch.setattr(sentinel, "query_cache", sentinel.QueryResultCache(0))
+    monkeypatch.setattr(sentinel, "_fleet_cache", None)
+    monkeypatch.setattr(sentinel.snapshot_store, "available", lambda: False)
+
+
+def vector(*samples):
+    return {"status": "success", "data": {"resultType": "vector", "result": [
+        {"metric": dict(metric), "value": [0, str(value)]} for metric, value in samples
+    ]}}
+
+
+def test_fanout_queries_backends_concurrently(multi, monkeypatch):
+    # 两个请求必须同时在途才能越过 barrier，串行执行会超时失败
+    barrier = threading.Barrier(2, timeout=2)
+
+    def fake_get(backend, path, params):
+        barrier.wait()
+        return vector(({"instance": "a:9100"}, 1)), 10
+
+    monkeypatch.setattr(sentinel, "_prom_get", fake_get)
+    responses = sentinel.prom_fanout("/api/v1/query", {"query": "up"})
+    assert sorted(b["name"] for b, _ in responses) == ["east", "west"]
+    assert sentinel.degraded_backends() == []
+
+
+def test_failing_backend_is_backed_off(multi, monkeypatch):
+    calls = []
+
+    def fake_get(backend, path, params):
+        calls.append(backend["name"])
+        if backend["name"] == "west":
+            raise RuntimeError("connection refused")
+        return vector(({"instance": "a:9100"}, 1)), 10
+
+    monkeypatch.setattr(sentinel, "_prom_get", fake_get)
+    samples = sentinel.query_vector("up")
+    assert [m[sentinel.PROMETHEUS_BACKEND_LABEL] for m, _ in samples] == ["east"]
+    assert sentinel.degraded_backends() == ["west"]
+
+    calls.clear()
+    sentinel.query_vector("up")
+    assert calls == ["east"]  # 退避期内不再请求 west
+
+
+def test_timed_out_backend_does_not_block(multi, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(sentinel, "PROMETHEUS_TIMEOUT", 0.1)
+
+    def fake_get(backend, path, params):
+        if backend["name"] == "west":
+            release.wait(5)
+        return vector(({"instance": "a:9100"}, 1)), 10
+
+    monkeypatch.setattr(sentinel, "_prom_get", fake_get)
+    try:
+        samples = sentinel.query_vector("up")
+    finally:
+        release.set()
+    assert [m[sentinel.PROMETHEUS_BACKEND_LABEL] for m, _ in samples] == ["east"]
+    assert sentinel.degraded_backends() == ["west"]
+
+
+def test_node_ref_routes_to_owning_backend(multi, monkeypatch):
+    calls = []
+
+    def fake_get(backend, path, params):
+        calls.append(backend["name"])
+        return vector(), 0
+
+    monkeypatch.setattr(sentinel, "_prom_get", fake_get)
+    ref = sentinel.node_ref("10.0.0.1:9100", "west")
+    assert sentinel.parse_node_ref(ref) == ("west", "10.0.0.1:9100")
+    assert sentinel.parse_node_ref("10.0.0.1:9100") == ("", "10.0.0.1:9100")
+    sentinel.query_vector(sentinel.promql("node_up", instance="10.0.0.1:9100"), ref)
+    assert calls == ["west"]
+
+
+def test_same_instance_in_two_regions_stays_separate(multi, monkeypatch):
+    """两个区域存在相同 instance：快照行、指标值、回调数据按 (region, instance) 区分"""
+    values = {"east": 30.0, "west": 90.0}
+
+    def fake_get(backend, path, params):
+        expr = params["query"]
+        if expr == sentinel.promql("node_up"):
+            return vector(({"instance": "10.0.0.1:9100", "project": "p", "alias": f"web-{backend['name']}",
+                            "role": "r"}, 1)), 0
+        if "node_cpu_seconds_total" in expr:
+            return vector(({"instance": "10.0.0.1:9100"}, values[backend["name"]])), 0
+        return vector(), 0
+
+    monkeypatch.setattr(sentinel, "_prom_get", fake_get)
+    fleet = sentinel.get_fleet()
+    by_ref = {fleet.ref(i): fleet.value("cpu", i) for i in fleet.rows()}
+    assert by_ref == {"east/10.0.0.1:9100": 30.0, "west/10.0.0.1:9100": 90.0}
+    assert set(fleet.row_of) == set(by_ref)
+
+    hotspots = sentinel.get_fleet_hotspots(top_n=2)
+    assert [(h["node"], h["alias"], h["value"]) for h in hotspots["cpu"]] == [
+        ("west/10.0.0.1:9100", "web-west", 90.0), ("east/10.0.0.1:9100", "web-east", 30.0),
+    ]
+
+
+def test_hotspot_merge_order_is_stable(multi, monkeypatch):
+    """各后端返回顺序不同时，合并结果按值降序、同值按节点键排序"""
+    def fake_get(backend, path, params):
+        expr = params["query"]
+        if expr.startswith("topk("):
+            if backend["name"] == "east":
+                return vector(({"instance": "b:9100"}, 50), ({"instance": "a:9100"}, 70)), 0
+            return vector(({"instance": "a:9100"}, 50), ({"instance": "c:9100"}, 10)), 0
+        return vector(), 0
+
+    monkeypatch.setattr(sentinel, "_prom_get", fake_get)
+    hotspots = sentinel.get_fleet_hotspots(top_n=3)
+    assert [(h["node"], h["value"]) for h in hotspots["cpu"]] == [
+        ("east/a:9100", 70.0), ("east/b:9100", 50.0), ("west/a:9100", 50.0),
+    ]
@@ -0,0 +1,41 @@
+import logging
+
+import pytest
+from telegram.error import RetryAfter
+
+import sentinel
+
+
+class FlakyBot:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.sent = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append(text)
+
+
+@pytest.fixture
+def lane(monkeypatch):
+    monkeypatch.setattr(sentinel.time, "sleep", lambda seconds: None)
+    return sentinel.DeliveryLane("-1")
+
+
+def test_retry_after_does_not_consume_attempts(lane, monkeypatch):
+    bot = FlakyBot([RetryAfter(1)] * (sentinel.DeliveryLane.MAX_RETRIES + 2) + [RuntimeError("boom")])
+    monkeypatch.setattr(sentinel, "bot_instance", bot)
+    lane.submit("hello", [])
+    lane.queue.join()
+    assert bot.sent == ["hello"]
+
+
+def test_dropped_message_logs_warning(lane, monkeypatch, caplog):
+    bot = FlakyBot([RuntimeError("boom")] * sentinel.DeliveryLane.MAX_RETRIES)
+    monkeypatch.setattr(sentinel, "bot_instance", bot)
+    with caplog.at_level(logging.WARNING):
+        lane.submit("hello", [])
+        lane.queue.join()
+    assert bot.sent == []
+    assert any(r.levelno == logging.WARNING and "dropping" in r.getMessage() for r in caplog.records)
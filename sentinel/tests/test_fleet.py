@@ -0,0 +1,65 @@
+import pytest
+
+import sentinel
+
+NODES = [
+    ("p1", "10.0.0.1:9100", "web-1"),
+    ("p1", "10.0.0.2:9100", "web-2"),
+    ("p2", "10.0.0.3:9100", "db-1"),
+]
+CPU = {"10.0.0.1:9100": 90.0, "10.0.0.2:9100": 20.0, "10.0.0.3:9100": 50.0}
+CPU_5M = {"10.0.0.1:9100": 50.0, "10.0.0.2:9100": 20.0, "10.0.0.3:9100": 80.0}
+
+
+@pytest.fixture
+def prom(monkeypatch):
+    """替换 prom_query：按表达式返回固定向量，并记录发出的查询"""
+    queries = []
+
+    def vector(values):
+        return [{"metric": {"instance": k}, "value": [0, str(v)]} for k, v in values.items()]
+
+    def fake_prom_query(expr, instance=None, at=None):
+        queries.append(expr)
+        if expr == sentinel.promql("node_up"):
+            result = [{"metric": {"project": p, "instance": i, "alias": a, "role": "r"}, "value": [0, "1"]}
+                      for p, i, a in NODES]
+        elif expr == sentinel.promql("fleet_cpu", offset="5m"):
+            result = vector(CPU_5M)
+        elif expr.startswith("topk(2, ") and "node_cpu_seconds_total" in expr:
+            result = vector({k: CPU[k] for k in ("10.0.0.1:9100", "10.0.0.3:9100")})
+        elif "node_cpu_seconds_total" in expr:
+            result = vector(CPU)
+        else:
+            result = []
+        return {"status": "success", "data": {"result": result}}
+
+    monkeypatch.setattr(sentinel, "prom_query", fake_prom_query)
+    monkeypatch.setattr(sentinel, "_fleet_cache", None)
+    return queries
+
+
+def test_fleet_trend_uses_one_offset_query(prom):
+    fleet = sentinel.get_fleet()
+    assert len(prom) == 6  # inventory + cpu / mem / disk / load1 / cpu_5m
+    trends = {fleet.instances[i]: fleet.trend("cpu", i) for i in fleet.rows()}
+    assert trends == {"10.0.0.1:9100": "↗️", "10.0.0.2:9100": "➡️", "10.0.0.3:9100": "↘️"}
+
+
+def test_fleet_snapshot_without_trend_column():
+    fleet = sentinel.FleetSnapshot.build(
+        {"p1": [{"instance": "a", "alias": "a", "role": "r"}]}, {"cpu": {"a": 10.0}}
+    )
+    data = fleet.to_json()
+    del data["cpu_5m"]  # 旧版本写入的快照
+    restored = sentinel.FleetSnapshot.from_json(data)
+    assert restored.value("cpu", 0) == 10.0
+    assert restored.trend("cpu", 0) == ""
+
+
+def test_hotspots_use_server_side_topk(prom):
+    hotspots = sentinel.get_fleet_hotspots(top_n=2)
+    assert all(q.startswith("topk(2, ") for q in prom if q != sentinel.promql("node_up"))
+    assert [(h["alias"], h["project"], h["value"]) for h in hotspots["cpu"]] == [
+        ("web-1", "p1", 90.0), ("db-1", "p2", 50.0),
+    ]
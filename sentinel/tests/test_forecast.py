@@ -0,0 +1,27 @@
+import sentinel
+
+
+class FakeQuery:
+    def __init__(self):
+        self.edits = []
+
+    def edit_message_text(self, text, reply_markup=None, parse_mode=None):
+        self.edits.append((text, reply_markup))
+
+
+def test_forecast_view_is_capped(monkeypatch):
+    forecasts = [
+        {"kind": "node", "id": f"10.0.{i // 256}.{i % 256}:9100", "alias": f"node-{i}", "project": "p",
+         "mountpoint": "/data", "used_pct": 90.0, "hours_to_full": 100.0 - i * 0.01}
+        for i in range(2000)
+    ]
+    monkeypatch.setattr(sentinel, "get_disk_forecasts", lambda project=None: forecasts)
+    query = FakeQuery()
+    sentinel.show_disk_forecast(query)
+
+    text, markup = query.edits[-1]
+    assert len(text) < 4096
+    assert len(markup.inline_keyboard) == sentinel.FORECAST_TOP_N + 2  # 刷新 + 主菜单
+    # 最先写满的排在最前
+    assert markup.inline_keyboard[0][0].text == "🔍 node-1999"
+    assert f"另有 {2000 - sentinel.FORECAST_TOP_N} 项" in text
@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import time
+import zlib
+
+import pytest
+
+import sentinel
+
+# crc32("plumless") == crc32("buckeroo")
+COLLIDING = ("plumless", "buckeroo")
+
+
+@pytest.fixture
+def history(tmp_path):
+    return sentinel.AlertHistory(str(tmp_path), "local", 1 << 20, 365)
+
+
+def alert(fp, alertname, status="firing", project="p1", instance="10.0.0.1:9100"):
+    return {
+        "fingerprint": fp, "status": status,
+        "labels": {"alertname": alertname, "project": project, "instance": instance},
+        "startsAt": "2026-01-01T00:00:00Z",
+        "endsAt": "2026-01-01T00:05:00Z" if status == "resolved" else "0001-01-01T00:00:00Z",
+    }
+
+
+def test_crc_collision_is_filtered(history):
+    assert zlib.crc32(COLLIDING[0].encode()) == zlib.crc32(COLLIDING[1].encode())
+    history.record([alert("a", COLLIDING[0]), alert("b", COLLIDING[1]), alert("c", COLLIDING[1])])
+
+    events = history.page({"alertname": COLLIDING[0]}, 0, 0, 10)
+    assert [e["a"] for e in events] == [COLLIDING[0]]
+
+    st = history.stats({"alertname": COLLIDING[1]}, 0)
+    assert st["firing"] == 2
+    assert st["top_alertnames"] == [(COLLIDING[1], 2)]
+
+
+def test_paging_counts_only_verified_events(history):
+    history.record([alert(f"x{i}", COLLIDING[i % 2]) for i in range(10)])
+    pages = [history.page({"alertname": COLLIDING[0]}, 0, page, 2) for page in range(3)]
+    assert [len(p) for p in pages] == [2, 2, 1]
+    assert {e["fp"] for p in pages for e in p} == {f"x{i}" for i in range(0, 10, 2)}
+
+
+def test_instance_filter_matches_host(history):
+    history.record([alert("a", "Down", instance="10.0.0.1:9100"), alert("b", "Down", instance="10.0.0.2:9100")])
+    assert [e["fp"] for e in history.page({"instance": "10.0.0.1"}, 0, 0, 10)] == ["a"]
+
+
+def test_transition_dedupe_survives_restart(tmp_path):
+    first = sentinel.AlertHistory(str(tmp_path), "local", 1 << 20, 365)
+    first.record([alert("a", "Down")])
+
+    # 重启后 Alertmanager 按 repeat_interval 重发同一个 firing
+    second = sentinel.AlertHistory(str(tmp_path), "local", 1 << 20, 365)
+    second.record([alert("a", "Down"), alert("a", "Down", status="resolved")])
+    st = second.stats({}, 0)
+    assert (st["firing"], st["resolved"]) == (1, 1)
+
+
+def test_expired_transition_claims_are_purged(history, monkeypatch):
+    monkeypatch.setattr(sentinel.AlertHistory, "TRANSITION_TTL", -1)
+    history.record([alert("a", "Down")])
+    history.expire_claims()
+    db = history.claims()
+    assert db.claim(["probe"], 60) == {"probe"}
+    with sqlite3.connect(db.path) as conn:
+        keys = [row[0] for row in conn.execute("SELECT key FROM claims")]
+    assert keys == ["probe"]
+
+
+def write_segment(directory, writer, start, records):
+    """直接写一个段：records 为索引记录时间列表"""
+    prefix = directory / f"{writer}-{int(start * 1000)}"
+    prefix.with_suffix(".log").write_bytes(b"{}\n" * len(records))
+    prefix.with_suffix(".idx").write_bytes(b"".join(
+        sentinel.AlertHistory.INDEX.pack(ts, i * 3, 0, 0, 0, 0, 1, 0.0) for i, ts in enumerate(records)
+    ))
+    return prefix
+
+
+def test_expire_removes_old_segments_of_every_writer(tmp_path):
+    now = time.time()
+    day = 86400
+    old_other = write_segment(tmp_path, "host-a-123", now - 40 * day, [now - 40 * day, now - 35 * day])
+    old_last = write_segment(tmp_path, "host-b-456", now - 50 * day, [now - 45 * day])  # 该 writer 的最后一段
+    straddling = write_segment(tmp_path, "host-a-123", now - 35 * day, [now - 35 * day, now - 10 * day])
+    empty_old = write_segment(tmp_path, "host-c-789", now - 60 * day, [])
+
+    history = sentinel.AlertHistory(str(tmp_path), "host-d-1", 1 << 20, 30)
+    history.expire()
+
+    remaining = {p.name for p in tmp_path.iterdir()}
+    for gone in (old_other, old_last, empty_old):
+        assert gone.with_suffix(".idx").name not in remaining
+        assert gone.with_suffix(".log").name not in remaining
+    assert straddling.with_suffix(".idx").name in remaining
+
+
+def test_record_rotates_when_segment_deleted(history):
+    history.record([alert("a", "Down")])
+    current = history._log.name
+    os.remove(current)
+    os.remove(current[:-len(".log")] + ".idx")
+    time.sleep(0.002)
+    history.record([alert("b", "Down")])
+    assert history._log.name != current
+    assert [e["fp"] for e in history.page({}, 0, 0, 10)] == ["b"]
@@ -0,0 +1,79 @@
+import re
+import threading
+import time
+
+import sentinel
+
+
+def wait_for_profiler_thread():
+    for t in threading.enumerate():
+        if t.name == "profiler":
+            t.join(5)
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_callbacks_started_before_profiling_are_not_counted():
+    profiler = sentinel.SamplingProfiler(0.001)
+    assert profiler.start(None, callbacks=1)
+    try:
+        profiler.exit()  # 采样开始前就在进行的回调
+        assert profiler.active
+
+        profiler.enter()
+        busy(0.05)
+        profiler.exit()
+        assert not profiler.active
+    finally:
+        profiler.stop()
+        wait_for_profiler_thread()
+    assert profiler._samples > 0
+
+
+def test_folded_output_format():
+    profiler = sentinel.SamplingProfiler(0.001)
+    assert profiler.start(None, callbacks=1)
+    profiler.enter()
+    busy(0.05)
+    profiler.exit()
+    wait_for_profiler_thread()
+
+    lines = profiler.folded().splitlines()
+    assert lines and lines == sorted(lines)
+    for line in lines:
+        # 每行：frame;frame;... 次数，frame 为 "函数名 (文件:行号)"
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+        assert all(re.fullmatch(r"\S+ \(.+:\d+\)", frame) for frame in stack.split(";"))
+    assert any(f"busy (test_profiler.py:{busy.__code__.co_firstlineno})" in line for line in lines)
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == profiler._samples
+    assert "Top functions by self time:" in profiler.summary()
+
+
+def test_trace_span_records_duration_and_bytes():
+    trace = sentinel.begin_trace("main:hotspots")
+    try:
+        with sentinel.trace_span("promql", "up") as span:
+            span["bytes"] = 128
+            time.sleep(0.01)
+        sentinel.trace_event("promql_cached", "up")
+    finally:
+        sentinel.end_trace(trace)
+
+    (kind, detail, duration, nbytes), cached = trace.spans
+    assert (kind, detail, nbytes) == ("promql", "up", 128)
+    assert duration >= 0.01
+    assert cached == ("promql_cached", "up", 0.0, 0)
+    assert trace.total >= duration
+    assert sentinel.trace_buffer[-1] is trace
+    rendered = trace.render()
+    assert "callback : main:hotspots" in rendered and "128B" in rendered
+
+    # 回调之外的 span 不记录到任何追踪
+    with sentinel.trace_span("promql", "outside"):
+        pass
+    assert len(trace.spans) == 2
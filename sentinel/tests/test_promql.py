@@ -0,0 +1,67 @@
+import re
+
+import pytest
+
+import sentinel
+
+
+def matchers(expr, label):
+    """取出表达式中某个标签的全部 matcher（op, 原始字面量）"""
+    return re.findall(label + r'(=~|!~|!=|=)"((?:[^"\\]|\\.)*)"', expr)
+
+
+@pytest.mark.parametrize("label,value,literal", [
+    ("instance", 'a"b:9100', r'a\"b:9100'),
+    ("instance", "c:\\d", r"c:\\d"),
+    ("mountpoint", "/data\nx", r"/data\nx"),
+    ("project", 'p"} or vector(1) #', r'p\"} or vector(1) #'),
+])
+def test_equality_values_are_escaped(label, value, literal):
+    template = {"instance": "node_load1", "mountpoint": "node_fs_size", "project": "disk_used_percent"}[label]
+    expr = sentinel.promql(template, **{label: value})
+    found = [m for m in matchers(expr, label) if m[0] == "="]
+    assert found and all(m == ("=", literal) for m in found)
+    assert "\n" not in expr
+    # 去掉字符串字面量后花括号成对：注入的 "} 没有提前闭合 selector
+    bare = re.sub(r'"(?:[^"\\]|\\.)*"', '""', expr)
+    assert bare.count("{") == bare.count("}") == len(found)
+
+
+def test_regex_metacharacters_in_value_list():
+    expr = sentinel.promql("node_load1", instance=["10.0.0.1:9100", "a.b|c*", "x$y"])
+    assert matchers(expr, "instance") == [("=~", r"10\\.0\\.0\\.1:9100|a\\.b\\|c\\*|x\\$y")]
+    # 单个字符串值即使含正则元字符也走等值匹配
+    assert matchers(sentinel.promql("node_load1", instance="a.b|c*"), "instance") == [("=", "a.b|c*")]
+
+
+def test_dollar_in_label_value_is_not_a_param():
+    expr = sentinel.promql("disk_ttf", params={"window": "6h", "horizon": "86400"}, mountpoint="/$window")
+    assert all(v == "/$window" for op, v in matchers(expr, "mountpoint") if op == "=")
+    assert "[6h]" in expr and "< 86400" in expr
+
+
+def test_output_is_normalized():
+    a = sentinel.promql("node_load1", project="p", instance="i")
+    b = sentinel.promql("node_load1", instance="i", project="p")
+    assert a == b == 'node_load1{instance="i",project="p"}'
+    assert sentinel.promql("node_load1", instance=["b", "a"]) == sentinel.promql("node_load1", instance={"a", "b"})
+
+
+@pytest.mark.parametrize("call", [
+    lambda: sentinel.promql("no_such_template"),
+    lambda: sentinel.promql("disk_ttf", params={"window": "6h"}),  # 缺少 horizon
+    lambda: sentinel.promql("node_load1", params={"window": "6h"}),  # 模板没有该参数
+    lambda: sentinel.promql("fleet_top_cpu", params={"n": "5) or vector(1"}),
+    lambda: sentinel.promql("node_load1", **{"bad-label": "x"}),
+    lambda: sentinel.promql("node_load1", instance=[]),
+])
+def test_invalid_requests_raise(call):
+    with pytest.raises(ValueError):
+        call()
+
+
+def test_hotspot_and_gap_fill_queries_come_from_templates():
+    top = sentinel.promql("fleet_top_cpu", params={"n": 3})
+    assert top == "topk(3, " + sentinel.promql("fleet_cpu") + ")"
+    gap = sentinel.promql("rollup_gap_fill", params={"window": "86400s", "step": "300s"}, instance=["a:9100"])
+    assert "$window" not in gap and "$step" not in gap and gap.count("[86400s:300s]") == 12
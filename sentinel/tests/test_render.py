@@ -0,0 +1,77 @@
+import sentinel
+
+
+class FakeMessage:
+    chat_id = 1
+    message_id = 2
+
+
+class FakeQuery:
+    message = FakeMessage()
+    inline_message_id = None
+
+    def __init__(self, data):
+        self.data = data
+        self.edits = []
+        self.answers = []
+
+    def edit_message_text(self, text, *args, **kwargs):
+        self.edits.append(text)
+
+    def answer(self, *args, **kwargs):
+        self.answers.append(args)
+
+
+class FakeUpdate:
+    def __init__(self, query):
+        self.callback_query = query
+
+
+def test_superseded_render_does_not_edit(monkeypatch):
+    """查询全部完成后、写消息前被新点击取代：不覆盖新视图"""
+    query = FakeQuery("main:hotspots")
+
+    def hotspots(top_n=sentinel.HOTSPOT_TOP_N):
+        # 数据已取回，此时用户在同一消息上点了别的按钮
+        sentinel.render_registry.acquire(sentinel.callback_render_key(query), "main:forecast")
+        return {key: [] for key in sentinel.FleetSnapshot.METRICS}
+
+    monkeypatch.setattr(sentinel, "get_fleet_hotspots", hotspots)
+    monkeypatch.setattr(sentinel.snapshot_store, "available", lambda: False)
+    monkeypatch.setattr(sentinel, "render_registry", sentinel.RenderRegistry(0))
+    sentinel.handle_callback(FakeUpdate(query), None)
+    assert query.edits == []
+    assert query.answers  # 回调仍被应答
+
+
+def test_render_edits_when_not_superseded(monkeypatch):
+    query = FakeQuery("main:hotspots")
+    monkeypatch.setattr(sentinel, "get_fleet_hotspots",
+                        lambda top_n=sentinel.HOTSPOT_TOP_N: {key: [] for key in sentinel.FleetSnapshot.METRICS})
+    monkeypatch.setattr(sentinel.snapshot_store, "available", lambda: False)
+    monkeypatch.setattr(sentinel, "render_registry", sentinel.RenderRegistry(0))
+    sentinel.handle_callback(FakeUpdate(query), None)
+    assert len(query.edits) == 1
+
+
+def test_main_menu_edits_through_wrapped_query(monkeypatch):
+    query = FakeQuery("main_menu")
+    monkeypatch.setattr(sentinel, "render_registry", sentinel.RenderRegistry(0))
+    sentinel.handle_callback(FakeUpdate(query), None)
+    assert len(query.edits) == 1 and "主菜单" in query.edits[0]
+    # 经过 TracedQuery：Telegram 调用记入本次回调的追踪
+    assert ("telegram", "editMessageText") in [s[:2] for s in sentinel.trace_buffer[-1].spans]
+
+
+def test_superseded_main_menu_does_not_edit(monkeypatch):
+    query = FakeQuery("main_menu")
+    monkeypatch.setattr(sentinel, "render_registry", sentinel.RenderRegistry(0))
+    main_menu = sentinel.main_menu
+
+    def superseded():
+        sentinel.render_registry.acquire(sentinel.callback_render_key(query), "main:hotspots")
+        return main_menu()
+
+    monkeypatch.setattr(sentinel, "main_menu", superseded)
+    sentinel.handle_callback(FakeUpdate(query), None)
+    assert query.edits == []
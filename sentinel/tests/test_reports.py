@@ -0,0 +1,115 @@
+import re
+import threading
+
+import pytest
+
+import sentinel
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    s = sentinel.RollupStore(str(tmp_path / "rollups.json.gz"))
+    monkeypatch.setattr(sentinel, "rollup_store", s)
+    return s
+
+
+def test_summarize_returns_detached_copy(store):
+    ts = 1767225600.0
+    store.add_sample(ts, {"a:9100": {"project": "p1", "alias": "a", "cpu": 10.0}}, {})
+    period = sentinel.period_keys(ts)[0]
+
+    summary = store.summarize(period)
+    store.add_sample(ts, {"b:9100": {"project": "p1", "alias": "b", "cpu": 30.0}}, {})
+
+    assert list(summary["nodes"]) == ["a:9100"]
+    assert summary["samples"] == 1
+    assert summary["nodes"]["a:9100"]["cpu"]["avg"] == 10.0
+
+
+def test_build_report_concurrent_with_collection(store, monkeypatch):
+    monkeypatch.setattr(sentinel, "fill_rollup_gaps", lambda period, nodes, samples: 0)
+    ts = 1767225600.0
+    period = sentinel.period_keys(ts)[0]
+    stop = threading.Event()
+
+    def collect():
+        i = 0
+        while not stop.is_set():
+            store.add_sample(ts, {f"n{i}:9100": {"project": "p1", "alias": f"n{i}", "cpu": 50.0}}, {})
+            i += 1
+
+    t = threading.Thread(target=collect)
+    t.start()
+    reports = []
+    try:
+        for _ in range(50):
+            reports.append(sentinel.build_report(period))
+    finally:
+        stop.set()
+        t.join()
+
+    # 每次采样恰好新增一台节点：节点数与采样数不一致说明读到了写了一半的汇总
+    for report in reports:
+        nodes, samples = re.search(r"节点 (\d+) 台 ｜ 采样 (\d+) 次", report).groups()
+        assert nodes == samples
+        if int(nodes):
+            assert f"🖥 {nodes} 台 ｜ 平均 CPU 50.0%" in report
+    final = sentinel.build_report(period)
+    count = len(store.summarize(period)["nodes"])
+    assert f"节点 {count} 台 ｜ 采样 {count} 次" in final
+
+
+def test_fill_rollup_gaps_single_query_keeps_project(monkeypatch):
+    queries = []
+
+    def fake_prom_query(expr, instance=None, at=None):
+        queries.append(expr)
+        result = [
+            {"metric": {"instance": "x:9100", "project": "p2", "alias": "x",
+                        "rollup_metric": metric, "rollup_stat": stat}, "value": [0, "42"]}
+            for metric in ("cpu", "mem", "disk") for stat in ("min", "avg", "max", "p95")
+        ]
+        return {"status": "success", "data": {"result": result}}
+
+    monkeypatch.setattr(sentinel, "prom_query", fake_prom_query)
+    monkeypatch.setattr(sentinel, "gap_fill_cache", sentinel.QueryResultCache(600))
+    nodes = {}
+    assert sentinel.fill_rollup_gaps("week:2026-W01", nodes, 0) == 1
+    assert len(queries) == 1
+    assert queries[0].count("_over_time(") == 12
+    entry = nodes["x:9100"]
+    assert (entry["project"], entry["alias"]) == ("p2", "x")
+    assert entry["cpu"]["p95"] == 42.0 and entry["disk"]["min"] == 42.0
+
+
+def test_fill_rollup_gaps_queries_only_gap_instances(monkeypatch):
+    """Bot 采样正常时只为覆盖率不足的节点补齐，实例值按正则字面量转义"""
+    queries = []
+
+    def fake_prom_query(expr, instance=None, at=None):
+        queries.append(expr)
+        return {"status": "success", "data": {"result": []}}
+
+    monkeypatch.setattr(sentinel, "prom_query", fake_prom_query)
+    monkeypatch.setattr(sentinel, "gap_fill_cache", sentinel.QueryResultCache(600))
+    start, end = sentinel.period_bounds("day:2026-01-01")
+    expected = int((end - start) / sentinel.ROLLUP_COLLECT_SECONDS)
+    nodes = {
+        "full:9100": {"cpu": {"n": expected}},
+        "new.host+1:9100": {"cpu": {"n": 3}},
+    }
+    sentinel.fill_rollup_gaps("day:2026-01-01", nodes, expected)
+    sentinel.fill_rollup_gaps("day:2026-01-01", nodes, expected)  # 重复生成命中缓存
+
+    assert len(queries) == 1
+    matcher = 'instance=~"new\\\\.host\\\\+1:9100"'
+    assert queries[0].count("_over_time(") == 12
+    assert queries[0].count(matcher) == queries[0].count("{") >= 12  # 每个 selector 都带实例限定
+    assert "full:9100" not in queries[0]
+
+
+def test_fill_rollup_gaps_skips_when_covered(monkeypatch):
+    monkeypatch.setattr(sentinel, "prom_query", lambda *a, **k: pytest.fail("unexpected query"))
+    start, end = sentinel.period_bounds("day:2026-01-01")
+    expected = int((end - start) / sentinel.ROLLUP_COLLECT_SECONDS)
+    assert sentinel.fill_rollup_gaps("day:2026-01-01", {"a:9100": {"cpu": {"n": expected}}}, expected) == 0
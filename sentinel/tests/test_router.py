@@ -0,0 +1,50 @@
+import sentinel
+
+ROUTES = [
+    {"match": {"alertname": "InstanceDown"}, "chat_id": "oncall", "continue": True},
+    {"match": {"project": "ProjectA", "severity": "critical|page"}, "chat_id": ["a-crit", "oncall"]},
+    {"match": {"project": "Project.*"}, "chat_id": "projects"},
+]
+
+
+def route(labels, rules=ROUTES, default="default"):
+    return sentinel.AlertRouter(rules, default).route(labels)
+
+
+def test_first_matching_rule_stops():
+    assert route({"project": "ProjectA", "severity": "critical"}) == ("a-crit", "oncall")
+    assert route({"project": "ProjectB"}) == ("projects",)
+
+
+def test_continue_rule_merges_and_keeps_default():
+    # continue 规则命中后仍继续匹配；之后命中普通规则则不再发默认群
+    assert route({"alertname": "InstanceDown", "project": "ProjectA", "severity": "page"}) == ("oncall", "a-crit")
+    # 只命中 continue 规则：默认群仍会收到
+    assert route({"alertname": "InstanceDown", "project": "other"}) == ("oncall", "default")
+
+
+def test_unmatched_goes_to_default():
+    assert route({"project": "other"}) == ("default",)
+    assert route({"project": "other"}, default=None) == ()
+
+
+def test_each_label_is_fully_matched_separately():
+    assert route({"project": "ProjectAB", "severity": "critical"}) == ("projects",)
+    assert route({"project": "ProjectA", "severity": "critical-ish"}) == ("projects",)
+    # 值里带分隔符 / 换行也不能跨 label 匹配
+    rules = [{"match": {"a": "x.*", "b": "y"}, "chat_id": "hit"}]
+    assert route({"a": "x\x1fb=y", "b": "z"}, rules) == ("default",)
+    assert route({"a": "x\nz", "b": "y"}, rules) == ("default",)
+    assert route({"a": "xz", "b": "y"}, rules) == ("hit",)
+
+
+def test_missing_label_matches_as_empty():
+    rules = [{"match": {"team": ""}, "chat_id": "no-team"}, {"match": {"team": ".+"}, "chat_id": "team"}]
+    assert route({}, rules) == ("no-team",)
+    assert route({"team": "db"}, rules) == ("team",)
+
+
+def test_route_results_are_cached():
+    router = sentinel.AlertRouter(ROUTES, "default")
+    first = router.route({"project": "ProjectB", "instance": "a"})
+    assert router.route({"project": "ProjectB", "instance": "b"}) is first
@@ -0,0 +1,80 @@
+import pytest
+
+import sentinel
+
+PROJECTS = {
+    "shop": [
+        {"instance": "10.0.0.1:9100", "alias": "web-1", "role": "web", "region": "hk"},
+        {"instance": "10.0.0.2:9100", "alias": "web-2", "role": "web", "region": "sg"},
+        {"instance": "10.0.1.10:9100", "alias": "db-master", "role": "mysql", "region": "hk"},
+    ],
+    "blog": [
+        {"instance": "10.1.0.1:9100", "alias": "webhook-relay", "role": "proxy", "region": "sg"},
+    ],
+}
+RDS = [
+    {"id": "shop-prod-db", "project": "shop", "alias": "ProjectA 主库"},
+    {"id": "blog-db", "project": "blog", "alias": "博客库"},
+]
+
+
+@pytest.fixture
+def index():
+    idx = sentinel.SearchIndex()
+    idx.update_nodes(PROJECTS)
+    idx.update_rds(RDS)
+    return idx
+
+
+def aliases(results):
+    return [r["alias"] for r in results]
+
+
+def test_prefix_ranks_exact_first(index):
+    # "web" 完全匹配 role=web，其次是 alias 前缀 webhook-relay
+    assert aliases(index.search("web")) == ["web-1", "web-2", "webhook-relay"]
+    assert aliases(index.search("we")) == ["web-1", "web-2", "webhook-relay"]
+
+
+def test_substring_match(index):
+    assert aliases(index.search("master")) == ["db-master"]
+    assert aliases(index.search("hook")) == ["webhook-relay"]
+    assert index.search("ho") == []  # 短词只做前缀匹配
+
+
+def test_multi_word_and(index):
+    assert aliases(index.search("web sg")) == ["web-2", "webhook-relay"]
+    assert aliases(index.search("WEB shop HK")) == ["web-1"]
+    assert index.search("mysql sg") == []
+
+
+def test_ip_match(index):
+    results = index.search("10.0.1")
+    assert [r["ip"] for r in results] == ["10.0.1.10"]
+    assert results[0]["callback"] == "node:hk/10.0.1.10:9100"
+    assert aliases(index.search("10.0.0")) == ["web-1", "web-2"]
+
+
+def test_rds_match(index):
+    results = index.search("主库")
+    assert [(r["kind"], r["callback"]) for r in results] == [("rds", "rds:shop:shop-prod-db")]
+    assert {r["instance"] for r in index.search("blog") if r["kind"] == "rds"} == {"blog-db"}
+    assert {r["instance"] for r in index.search("prod") if r["kind"] == "rds"} == {"shop-prod-db"}
+
+
+def test_limit_keeps_best_matches(index):
+    assert aliases(index.search("10", limit=2)) == ["db-master", "web-1"]
+
+
+def test_incremental_update_and_removal(index):
+    projects = {"shop": [dict(PROJECTS["shop"][0], alias="web-renamed")]}
+    index.update_nodes(projects)
+    assert aliases(index.search("web")) == ["web-renamed"]
+    assert index.search("webhook") == []
+    assert len(index) == 1 + len(RDS)
+
+    # inventory 不完整（区域退避）时只增不删
+    index.update_nodes(PROJECTS, allow_removals=False)
+    index.update_nodes({}, allow_removals=False)
+    assert len(index) == 4 + len(RDS)
+    assert index._prefix == sorted(index._prefix)
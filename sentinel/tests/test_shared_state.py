@@ -0,0 +1,173 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import sentinel
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "shared.db")
+
+
+def test_shared_state_is_abstract():
+    with pytest.raises(TypeError):
+        sentinel.SharedState()
+
+
+def test_lease_acquire_renew_expiry(db_path):
+    a = sentinel.SQLiteSharedState(db_path)
+    b = sentinel.SQLiteSharedState(db_path)  # 另一个副本打开同一文件
+
+    assert a.try_lease("leader", "r1", 0.3)
+    assert not b.try_lease("leader", "r2", 0.3)
+
+    # 续约会推迟过期时间
+    time.sleep(0.2)
+    assert a.try_lease("leader", "r1", 0.3)
+    time.sleep(0.2)
+    assert not b.try_lease("leader", "r2", 0.3)
+
+    # 停止续约后租约过期，可被其他副本接管
+    time.sleep(0.35)
+    assert b.try_lease("leader", "r2", 0.3)
+    assert not a.try_lease("leader", "r1", 0.3)
+
+
+def test_lease_release(db_path):
+    a = sentinel.SQLiteSharedState(db_path)
+    assert a.try_lease("leader", "r1", 60)
+    a.release_lease("leader", "r2")  # 非持有者释放无效
+    assert not a.try_lease("leader", "r2", 60)
+    a.release_lease("leader", "r1")
+    assert a.try_lease("leader", "r2", 60)
+
+
+def test_claim_is_atomic_across_replicas(db_path):
+    keys = [f"fp{i}:firing" for i in range(200)]
+    results = []
+    barrier = threading.Barrier(8)
+
+    def replica():
+        state = sentinel.SQLiteSharedState(db_path)
+        barrier.wait()
+        results.append(state.claim(keys, 60))
+
+    threads = [threading.Thread(target=replica) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # 每个键恰好被一个副本占用
+    assert sum(len(r) for r in results) == len(keys)
+    assert set().union(*results) == set(keys)
+
+
+def test_claim_expires(db_path):
+    state = sentinel.SQLiteSharedState(db_path)
+    assert state.claim(["k"], 0.2) == {"k"}
+    assert state.claim(["k"], 0.2) == set()
+    time.sleep(0.25)
+    assert state.claim(["k"], 0.2) == {"k"}
+
+
+def alert(fp, status="firing", starts="2026-01-01T00:00:00Z", ends="0001-01-01T00:00:00Z"):
+    return {"fingerprint": fp, "status": status, "startsAt": starts, "endsAt": ends, "labels": {"alertname": fp}}
+
+
+def test_dedupe_alerts_across_replicas(db_path, monkeypatch):
+    batch = [alert("a"), alert("b"), alert("a")]
+
+    monkeypatch.setattr(sentinel, "shared_state", sentinel.SQLiteSharedState(db_path))
+    kept = sentinel.dedupe_alerts(batch)
+    assert [a["fingerprint"] for a in kept] == ["a", "b"]
+
+    # 另一个副本收到同一批告警：全部已被占用
+    monkeypatch.setattr(sentinel, "shared_state", sentinel.SQLiteSharedState(db_path))
+    assert sentinel.dedupe_alerts(batch) == []
+
+    # 状态变化（resolved）是新的事件
+    resolved = alert("a", status="resolved", ends="2026-01-01T00:10:00Z")
+    assert sentinel.dedupe_alerts([resolved]) == [resolved]
+
+
+def test_dedupe_alerts_without_state_delivers_all(monkeypatch):
+    class Broken(sentinel.MemorySharedState):
+        def claim(self, keys, ttl):
+            raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(sentinel, "shared_state", Broken())
+    batch = [alert("a"), alert("a")]
+    assert sentinel.dedupe_alerts(batch) == batch
+
+
+def test_process_alerts_dedupes_in_replica_mode(db_path, monkeypatch):
+    submitted = []
+
+    class Lane:
+        def submit(self, text, keyboard):
+            submitted.append(text)
+
+    class History:
+        def record(self, alerts):
+            pass
+
+    monkeypatch.setattr(sentinel, "REPLICA_MODE", True)
+    monkeypatch.setattr(sentinel, "shared_state", sentinel.SQLiteSharedState(db_path))
+    monkeypatch.setattr(sentinel, "bot_instance", object())
+    monkeypatch.setattr(sentinel, "alert_history", History())
+    monkeypatch.setattr(sentinel, "alert_router", sentinel.AlertRouter([], "-1000000000000"))
+    monkeypatch.setattr(sentinel, "get_delivery_lane", lambda chat_id: Lane())
+
+    payload = {"alerts": [alert("a"), alert("b")]}
+    sentinel.process_alerts(payload)
+    sentinel.process_alerts(payload)  # 同一负载投递到另一个副本 / 重试
+    assert len(submitted) == 1
+
+
+def test_leader_elector_failover(db_path):
+    events = []
+
+    def elector(owner):
+        return sentinel.LeaderElector(
+            sentinel.SQLiteSharedState(db_path), "leader", owner, 0.3,
+            on_elected=lambda: events.append(("elected", owner)),
+            on_lost=lambda: events.append(("lost", owner)),
+        )
+
+    first, second = elector("r1"), elector("r2")
+    first.start()
+    time.sleep(0.15)
+    second.start()
+    time.sleep(0.3)
+    assert first.is_leader and not second.is_leader
+
+    # 正常退出时释放租约，follower 在下一轮续约时接管
+    first.stop()
+    time.sleep(0.4)
+    second.stop()
+    assert events == [("elected", "r1"), ("elected", "r2")]
+
+
+def test_leader_elector_reports_lost_lease(db_path):
+    lost = threading.Event()
+    elector = sentinel.LeaderElector(
+        sentinel.SQLiteSharedState(db_path), "leader", "r1", 0.3,
+        on_elected=lambda: None, on_lost=lost.set,
+    )
+    elector.start()
+    time.sleep(0.15)
+    assert elector.is_leader
+
+    # 模拟租约被其他副本接管
+    db = sqlite3.connect(db_path)
+    db.execute("UPDATE leases SET owner = 'r2', expires = ?", (time.time() + 60,))
+    db.commit()
+    db.close()
+
+    assert lost.wait(1)
+    assert not elector.is_leader
+    elector.stop()